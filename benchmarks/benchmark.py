@@ -0,0 +1,390 @@
+"""
+Benchmarks for the data generator.
+
+Times the construction of persons and visits, each generator function, the
+serialization of rows and the complete pipeline (for several cohort sizes) at a fixed
+seed and without a database. Results are reported in rows per second and can be
+stored as baseline (JSON). If a baseline exists, the run fails if the throughput of
+any benchmark dropped by more than the given threshold.
+
+Usage (from the repository root):
+
+    python -m benchmarks.benchmark [--save-baseline] [--threshold 0.2]
+"""
+import argparse
+import dataclasses
+import datetime
+import json
+import logging
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+import numpy as np
+
+from data_generator import generator
+from data_generator.pipeline import generate, generate_shard
+from data_generator.streams import stage_rng
+from data_generator.timeseries import ventilation_series
+from omop import concepts, rows, tables
+from omop.buffer import TableBuffer
+from omop.pgcopy import copy_binary
+from omop.sink import MemorySink, copy_text, csv_text
+
+BASELINE_FILE = Path(__file__).parent / "baseline.json"
+SEED = 42
+N_CALLS = 200
+COHORT_SIZES = [10, 100, 1000]
+
+Results = Dict[str, Dict[str, float]]
+
+
+def _time(func: Callable[[], Any], repeat: int) -> float:
+    """
+    Return the minimal wall time of `repeat` calls of func
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _throughput(rows: int, seconds: float) -> Dict[str, float]:
+    return {
+        "rows": rows,
+        "seconds": seconds,
+        "rows_per_second": rows / seconds if seconds > 0 else float("inf"),
+    }
+
+
+def bench_tables(n_calls: int, repeat: int) -> Results:
+    """
+    Benchmark the construction of Person and VisitOccurrence (fast and validated rows)
+    """
+    persons = [
+        dataclasses.asdict(generator.create_person(i, stage_rng(SEED, i, "person")))
+        for i in range(n_calls)
+    ]
+    visits = [
+        dataclasses.asdict(generator.create_visit(i, stage_rng(SEED, i, "visit")))
+        for i in range(n_calls)
+    ]
+
+    results = {}
+
+    for name, cls, values in [
+        ("Person", rows.Person, persons),
+        ("VisitOccurrence", rows.VisitOccurrence, visits),
+        ("Person (validated)", tables.Person, persons),
+        ("VisitOccurrence (validated)", tables.VisitOccurrence, visits),
+    ]:
+
+        def run() -> None:
+            for fields in values:
+                cls(**fields)
+
+        results[name] = _throughput(n_calls, _time(run, repeat))
+
+    return results
+
+
+def bench_generator_functions(n_calls: int, repeat: int) -> Results:
+    """
+    Benchmark each create_* function of the generator (on the same set of visits)
+    """
+    persons = [
+        generator.create_person(i, stage_rng(SEED, i, "person")) for i in range(n_calls)
+    ]
+    visits = [
+        generator.create_visit(i, stage_rng(SEED, i, "visit")) for i in range(n_calls)
+    ]
+    procedures = [
+        generator.create_vent_params_procedure(
+            i, visits[i], stage_rng(SEED, i, "ventilation_procedure")
+        )
+        for i in range(n_calls)
+    ]
+
+    # function and the stage whose random number stream it uses
+    functions: Dict[str, Tuple[Callable[[int, np.random.Generator], Any], str]] = {
+        "create_person": (generator.create_person, "person"),
+        "create_visit": (generator.create_visit, "visit"),
+        "create_drug_exp2": (
+            lambda i, rng: generator.create_drug_exp2(
+                i, visits[i], rng, n_administrations=10
+            ),
+            "drugs",
+        ),
+        "drug_exposure_columns": (
+            lambda i, rng: generator.drug_exposure_columns(
+                visits[i], rng, n_administrations=10
+            ),
+            "drugs",
+        ),
+        "create_vent_params_procedure": (
+            lambda i, rng: generator.create_vent_params_procedure(i, visits[i], rng),
+            "ventilation_procedure",
+        ),
+        "create_vent_params_measurements": (
+            lambda i, rng: generator.create_vent_params_measurements(
+                i, procedures[i], visits[i], rng
+            ),
+            "ventilation_measurements",
+        ),
+        "create_lab_values_measurements": (
+            lambda i, rng: generator.create_lab_values_measurements(i, visits[i], rng),
+            "lab_values",
+        ),
+        "lab_values_columns": (
+            lambda i, rng: generator.lab_values_columns(visits[i], rng),
+            "lab_values",
+        ),
+        "create_prone_positioning_procedure": (
+            lambda i, rng: generator.create_prone_positioning_procedure(
+                i, visits[i], rng, max_occurrences=5
+            ),
+            "prone_positioning",
+        ),
+        "create_cond": (
+            lambda i, rng: generator.create_cond(i, visits[i], rng, max_occurrences=4),
+            "conditions",
+        ),
+        "create_obs": (
+            lambda i, rng: generator.create_obs(
+                i, visits[i], rng, max_occurrences=2, probability_threshold=0.5
+            ),
+            "observations",
+        ),
+        "create_weight_measurements": (
+            lambda i, rng: generator.create_weight_measurements(
+                i, persons[i], visits[i], rng
+            ),
+            "weight",
+        ),
+    }
+
+    results = {}
+
+    for name, (func, stage) in functions.items():
+        n_rows = 0
+
+        def run() -> None:
+            nonlocal n_rows
+            n_rows = 0
+            for i in range(n_calls):
+                result = func(i, stage_rng(SEED, i, stage))
+                if result is None:
+                    continue
+                elif isinstance(result, dict):
+                    n_rows += len(next(iter(result.values())))
+                elif isinstance(result, list):
+                    n_rows += len(result)
+                else:
+                    n_rows += 1
+
+        seconds = _time(run, repeat)
+        results[name] = _throughput(n_rows, seconds)
+
+    return results
+
+
+def bench_ventilation_series(repeat: int, days: int = 21) -> Results:
+    """
+    Benchmark the ventilator time series (one episode of `days` days at minute resolution)
+    """
+    start = datetime.datetime(2020, 1, 1)
+    prod = rows.ProcedureOccurrence(
+        person_id=0,
+        procedure_concept_id=concepts.ARTIFICIAL_RESPIRATION,
+        procedure_type_concept_id=concepts.EHR,
+        procedure_date=start.date(),
+        procedure_datetime=start,
+        procedure_end_date=(start + datetime.timedelta(days=days)).date(),
+        procedure_end_datetime=start + datetime.timedelta(days=days),
+    )
+    n_rows = 0
+
+    def run() -> None:
+        nonlocal n_rows
+        buffer = TableBuffer("measurement")
+        rng = stage_rng(SEED, 0, "ventilation_measurements")
+        for columns in ventilation_series(prod, rng, interval=1.0):
+            buffer.extend(person_id=0, **columns)
+        n_rows = len(buffer)
+
+    seconds = _time(run, repeat)
+
+    return {"ventilation_series": _throughput(n_rows, seconds)}
+
+
+def bench_serialization(n_patients: int, repeat: int) -> Results:
+    """
+    Benchmark the encoding of rows for COPY and CSV
+    """
+    buffers = generate_shard(range(n_patients), SEED, 0)
+    n_rows = sum(len(buffer) for buffer in buffers.values())
+
+    results = {}
+    for name, encode in [
+        ("copy_binary", copy_binary),
+        ("copy_text", copy_text),
+        ("csv_text", csv_text),
+    ]:
+
+        def run() -> None:
+            for buffer in buffers.values():
+                encode(buffer)
+
+        results[name] = _throughput(n_rows, _time(run, repeat))
+
+    return results
+
+
+def bench_pipeline(cohort_sizes: List[int], repeat: int) -> Results:
+    """
+    Benchmark the complete generation pipeline writing to an in-memory sink
+    """
+    results = {}
+
+    for n in cohort_sizes:
+        counts: Dict[str, int] = {}
+
+        def run() -> None:
+            sink = MemorySink()
+            for buffers in generate(range(n), seed=SEED):
+                sink.write_buffers(buffers)
+            sink.close()
+            counts.update(sink.row_counts())
+
+        seconds = _time(run, repeat)
+
+        results[f"pipeline[n={n}]"] = _throughput(sum(counts.values()), seconds)
+        for table, count in counts.items():
+            results[f"pipeline[n={n}].{table}"] = _throughput(count, seconds)
+
+    return results
+
+
+def run_benchmarks(
+    n_calls: int = N_CALLS, cohort_sizes: List[int] = COHORT_SIZES, repeat: int = 3
+) -> Results:
+    """
+    Run all benchmarks and return the results
+    """
+    results: Results = {}
+    results.update(bench_tables(n_calls, repeat))
+    results.update(bench_generator_functions(n_calls, repeat))
+    results.update(bench_ventilation_series(repeat))
+    results.update(bench_serialization(max(cohort_sizes), repeat))
+    results.update(bench_pipeline(cohort_sizes, repeat))
+    return results
+
+
+def compare(results: Results, baseline: Results, threshold: float) -> List[str]:
+    """
+    Return descriptions of all benchmarks whose throughput dropped by more than `threshold`
+    """
+    regressions = []
+
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]["rows_per_second"]
+        after = result["rows_per_second"]
+        if after < before * (1 - threshold):
+            regressions.append(
+                f"{name}: {after:,.0f} rows/s (baseline {before:,.0f} rows/s, {after / before - 1:+.0%})"
+            )
+
+    return regressions
+
+
+def print_results(results: Results, baseline: Results) -> None:
+    """
+    Print the results (and the change relative to the baseline)
+    """
+    width = max(len(name) for name in results)
+    for name, result in results.items():
+        line = f"{name:<{width}}  {result['rows']:>9,.0f} rows  {result['rows_per_second']:>14,.0f} rows/s"
+        if name in baseline:
+            change = result["rows_per_second"] / baseline[name]["rows_per_second"] - 1
+            line += f"  {change:+.0%}"
+        print(line)
+
+
+if __name__ == "__main__":
+
+    logging.basicConfig(
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        level=logging.INFO,
+    )
+
+    parser = argparse.ArgumentParser(description="Benchmark the OMOP data generator")
+    parser.add_argument(
+        "--baseline",
+        help="Baseline file (default: benchmarks/baseline.json)",
+        type=Path,
+        default=BASELINE_FILE,
+    )
+    parser.add_argument(
+        "--save-baseline",
+        help="Store the results as new baseline",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--threshold",
+        help="Maximal allowed relative drop in throughput (default: 0.2)",
+        type=float,
+        default=0.2,
+    )
+    parser.add_argument(
+        "--sizes",
+        help="Cohort sizes for the pipeline benchmark",
+        type=int,
+        nargs="+",
+        default=COHORT_SIZES,
+    )
+    parser.add_argument(
+        "--calls",
+        help="Number of calls per generator function",
+        type=int,
+        default=N_CALLS,
+    )
+    parser.add_argument(
+        "--repeat",
+        help="Number of repetitions (the fastest is reported)",
+        type=int,
+        default=3,
+    )
+    parser.add_argument(
+        "--output", help="Write the results to this JSON file", type=Path
+    )
+
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.calls, args.sizes, args.repeat)
+
+    baseline: Results = {}
+    if args.baseline.exists() and not args.save_baseline:
+        baseline = json.loads(args.baseline.read_text())
+
+    print_results(results, baseline)
+
+    if args.output is not None:
+        args.output.write_text(json.dumps(results, indent=2))
+
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(results, indent=2))
+        logging.info(f"Stored baseline in {args.baseline}")
+    elif baseline:
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            for regression in regressions:
+                logging.error(f"Throughput regression - {regression}")
+            sys.exit(1)
+        logging.info("No throughput regressions")
+    else:
+        logging.info(f"No baseline found at {args.baseline}")
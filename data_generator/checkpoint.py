@@ -0,0 +1,88 @@
+"""
+Checkpoints of long generation runs.
+
+A run is written in parts of `commit_every` patients; each part is committed before the
+checkpoint is updated. The checkpoint records the seed, the range of person ids and the
+number of committed patients (and the end of the visit window, which would otherwise
+move on the next day), which is all that is needed to continue an interrupted run:
+because each patient draws from its own random number streams (see
+`data_generator.streams`), the remaining patients are identical to those of an
+uninterrupted run.
+"""
+import dataclasses
+import json
+import os
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple, Union
+
+DEFAULT_CHECKPOINT_FILE = ".checkpoint.json"
+DEFAULT_COMMIT_EVERY = 1000
+
+
+@dataclasses.dataclass
+class Checkpoint:
+    """
+    Progress of a generation run
+    """
+
+    seed: int
+    first_person_id: int
+    n_person: int
+    n_committed: int = 0
+    # tables that are generated (all tables, if None)
+    tables: Optional[List[str]] = None
+    # index of the first patient within the run (of a shard, see data_generator.shards)
+    first_index: int = 0
+    # criteria file of a recommendation-driven run (see data_generator.criteria)
+    criteria: Optional[str] = None
+    # last day of the visit window of the run (ISO format, see params.VISIT_END_DATE)
+    visit_end_date: Optional[str] = None
+
+    @property
+    def person_ids(self) -> range:
+        """
+        Return all person ids of the run
+        """
+        return range(self.first_person_id, self.first_person_id + self.n_person)
+
+    @property
+    def remaining(self) -> range:
+        """
+        Return the person ids that are not committed yet
+        """
+        return self.person_ids[self.n_committed :]
+
+    @property
+    def done(self) -> bool:
+        """
+        Return whether all patients of the run are committed
+        """
+        return self.n_committed >= self.n_person
+
+    def parts(self, commit_every: int) -> Iterator[Tuple[range, int]]:
+        """
+        Yield the remaining person ids in parts of (at most) `commit_every` patients,
+        together with the index of the first patient of each part within the run
+        """
+        if commit_every < 1:
+            raise ValueError("commit_every must be positive")
+
+        for start in range(self.n_committed, self.n_person, commit_every):
+            yield self.person_ids[
+                start : start + commit_every
+            ], self.first_index + start
+
+    def save(self, path: Union[str, Path]) -> None:
+        """
+        Write the checkpoint to a file (atomically, i.e. the file is never left incomplete)
+        """
+        tmp = Path(f"{path}.tmp")
+        tmp.write_text(json.dumps(dataclasses.asdict(self), indent=2))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "Checkpoint":
+        """
+        Read a checkpoint from a file
+        """
+        return cls(**json.loads(Path(path).read_text()))
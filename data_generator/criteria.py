@@ -0,0 +1,759 @@
+"""
+Recommendation-driven cohorts.
+
+The criteria of the CELIDA recommendations (FHIR resources, see
+`data_generator.recommendations`) are compiled once into a `CriteriaPlan`. Each
+criterion is a concept of a CDM table, optionally with a range of values (e.g. a
+Horowitz index below 150 mmHg or the dose of a drug) and a time window (in hours after
+the start of the visit). Population criteria are taken from the characteristics of
+EvidenceVariable resources and interventions from ActivityDefinition resources. Their
+codings are mapped to standard OMOP concepts with the local vocabulary (see
+`omop.vocabulary`); criteria without a mapped concept are skipped.
+
+Instead of sampling conditions, drugs and labs with the weights of
+`data_generator.parameter`, each patient of a recommendation-driven run covers one case
+of the plan: it satisfies a criterion, lies exactly on the boundary of its value range,
+or violates it (by its value, by its time or by the absence of the concept). A patient
+consists of its person, its visit and the row of its case only, i.e. all edge cases of
+the recommendations are covered with a few rows per criterion.
+
+The plan is cached in a file (`DEFAULT_CRITERIA_FILE`) together with a key of its
+inputs (the files of the recommendations, the vocabulary and this module), such that
+repeated runs skip parsing the FHIR resources.
+"""
+import dataclasses
+import datetime
+import hashlib
+import json
+import logging
+import math
+import os
+from pathlib import Path
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Dict,
+    Final,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
+
+if TYPE_CHECKING:
+    import numpy as np
+
+    from omop.tables import VisitOccurrence
+    from omop.vocabulary import Concept, ConceptCache
+
+# (numpy and the generator are imported by the functions that generate rows, such that
+# the command line interface can import this module without loading them)
+
+DEFAULT_CRITERIA_FILE = ".criteria.json"
+
+# OMOP vocabulary of the code systems used in the recommendations
+SYSTEM_VOCABULARIES: Final = {
+    "http://snomed.info/sct": "SNOMED",
+    "http://loinc.org": "LOINC",
+    "http://www.nlm.nih.gov/research/umls/rxnorm": "RxNorm",
+    "http://fhir.de/CodeSystem/bfarm/atc": "ATC",
+    "http://www.whocc.no/atc": "ATC",
+    "http://fhir.de/CodeSystem/bfarm/icd-10-gm": "ICD10GM",
+    "http://hl7.org/fhir/sid/icd-10": "ICD10",
+    "http://unitsofmeasure.org": "UCUM",
+}
+
+# CDM table of the concepts of each domain
+DOMAIN_TABLES: Final = {
+    "Condition": "condition_occurrence",
+    "Drug": "drug_exposure",
+    "Measurement": "measurement",
+    "Observation": "observation",
+    "Procedure": "procedure_occurrence",
+}
+
+# tables with a value (the value of drug exposures is the quantity, an integer)
+VALUE_TABLES: Final = frozenset({"measurement", "drug_exposure"})
+INTEGER_VALUE_TABLES: Final = frozenset({"drug_exposure"})
+
+# UCUM units of time
+TIME_UNIT_HOURS: Final = {"min": 1 / 60, "h": 1.0, "d": 24.0, "wk": 168.0}
+
+# kinds of cases of a criterion
+SATISFY = "satisfy"
+BOUNDARY = "boundary"
+VIOLATE = "violate"
+
+
+@dataclasses.dataclass
+class Criterion:
+    """
+    Concept of a CDM table with an optional range of values and time window
+    """
+
+    name: str
+    # canonical url (or id) of the FHIR resource
+    source: str
+    table: str
+    concept_id: int
+    value_low: Optional[float] = None
+    value_high: Optional[float] = None
+    low_inclusive: bool = True
+    high_inclusive: bool = True
+    unit_concept_id: Optional[int] = None
+    # hours after the start of the visit
+    window_start: Optional[float] = None
+    window_end: Optional[float] = None
+    # whether the recommendation excludes patients that satisfy the criterion
+    exclude: bool = False
+
+    @property
+    def has_value(self) -> bool:
+        """
+        Return whether the criterion restricts the value
+        """
+        return self.value_low is not None or self.value_high is not None
+
+    @property
+    def has_window(self) -> bool:
+        """
+        Return whether the criterion restricts the time
+        """
+        return self.window_start is not None or self.window_end is not None
+
+    def contains(self, value: float) -> bool:
+        """
+        Return whether a value lies in the value range of the criterion
+        """
+        if self.value_low is not None:
+            if value < self.value_low or (
+                value == self.value_low and not self.low_inclusive
+            ):
+                return False
+        if self.value_high is not None:
+            if value > self.value_high or (
+                value == self.value_high and not self.high_inclusive
+            ):
+                return False
+        return True
+
+    def value_bounds(self) -> Tuple[float, float]:
+        """
+        Return the smallest and largest value that satisfy the criterion (integers for
+        tables with integer values; infinite, if unbounded)
+        """
+        low = -math.inf if self.value_low is None else self.value_low
+        high = math.inf if self.value_high is None else self.value_high
+
+        if self.table in INTEGER_VALUE_TABLES:
+            if math.isfinite(low):
+                low = math.ceil(low) if self.low_inclusive else math.floor(low) + 1
+            if math.isfinite(high):
+                high = math.floor(high) if self.high_inclusive else math.ceil(high) - 1
+
+        return low, high
+
+    def boundary(self) -> Optional[float]:
+        """
+        Return the bound of the value range that is used for the boundary case (None,
+        if the criterion has no such case)
+        """
+        bound = self.value_low if self.value_low is not None else self.value_high
+        if bound is None:
+            return None
+        if self.table in INTEGER_VALUE_TABLES and not float(bound).is_integer():
+            return None
+        return bound
+
+    def case_kinds(self) -> List[str]:
+        """
+        Return the kinds of cases of the criterion
+        """
+        kinds = []
+        low, high = self.value_bounds()
+        if low <= high:
+            kinds.append(SATISFY)
+        # (a single value is already covered by SATISFY)
+        if self.boundary() is not None and self.value_low != self.value_high:
+            kinds.append(BOUNDARY)
+        kinds.append(VIOLATE)
+        return kinds
+
+
+@dataclasses.dataclass
+class Case:
+    """
+    Patient that satisfies, lies on the boundary of or violates a criterion
+    """
+
+    criterion: int
+    kind: str
+    # whether the patient satisfies the criterion
+    satisfied: bool
+
+
+@dataclasses.dataclass
+class CriteriaPlan:
+    """
+    Criteria of the recommendations and the cases that cover them
+    """
+
+    # key of the inputs the plan was compiled from (see `plan_key`)
+    key: str
+    criteria: List[Criterion]
+    cases: List[Case]
+
+    def __post_init__(self) -> None:
+        """
+        Convert the criteria and cases read from JSON and index the criteria
+        """
+        self.criteria = [
+            c if isinstance(c, Criterion) else Criterion(**c)  # type: ignore[arg-type]
+            for c in self.criteria
+        ]
+        self.cases = [
+            c if isinstance(c, Case) else Case(**c)  # type: ignore[arg-type]
+            for c in self.cases
+        ]
+
+        # index of the criteria by table and concept
+        self.index: Dict[Tuple[str, int], List[int]] = {}
+        for i, criterion in enumerate(self.criteria):
+            self.index.setdefault((criterion.table, criterion.concept_id), []).append(i)
+
+    @classmethod
+    def build(cls, key: str, criteria: List[Criterion]) -> "CriteriaPlan":
+        """
+        Create the plan of the given criteria with all their cases
+        """
+        cases = []
+        for i, criterion in enumerate(criteria):
+            for kind in criterion.case_kinds():
+                if kind == BOUNDARY:
+                    satisfied = criterion.contains(criterion.boundary())  # type: ignore
+                else:
+                    satisfied = kind == SATISFY
+                cases.append(Case(i, kind, satisfied))
+
+        return cls(key, criteria, cases)
+
+    def case(self, index: int) -> Tuple[Criterion, Case]:
+        """
+        Return the case (and its criterion) of the patient at `index` of a run (the
+        cases are repeated, if the run has more patients than the plan has cases)
+        """
+        case = self.cases[index % len(self.cases)]
+        return self.criteria[case.criterion], case
+
+    def lookup(self, table: str, concept_id: int) -> List[Criterion]:
+        """
+        Return the criteria of a concept of a table
+        """
+        return [self.criteria[i] for i in self.index.get((table, concept_id), [])]
+
+    def save(self, path: Union[str, Path]) -> None:
+        """
+        Write the plan to a file (atomically, i.e. the file is never left incomplete)
+        """
+        tmp = Path(f"{path}.tmp")
+        tmp.write_text(json.dumps(dataclasses.asdict(self), indent=2))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "CriteriaPlan":
+        """
+        Read a plan from a file
+        """
+        return cls(**json.loads(Path(path).read_text()))
+
+
+class RawCriterion(NamedTuple):
+    """
+    Criterion as parsed from a FHIR resource, with codings instead of concepts
+    """
+
+    name: str
+    source: str
+    # (vocabulary_id, concept_code) of each coding
+    codes: List[Tuple[str, str]]
+    value_low: Optional[float] = None
+    value_high: Optional[float] = None
+    low_inclusive: bool = True
+    high_inclusive: bool = True
+    unit_code: Optional[str] = None
+    window_start: Optional[float] = None
+    window_end: Optional[float] = None
+    exclude: bool = False
+
+
+def iter_resources(directory: Union[str, Path]) -> Iterator[Dict[str, Any]]:
+    """
+    Yield the FHIR resources in the JSON files of a directory (including the entries of
+    bundles)
+    """
+    for path in sorted(Path(directory).rglob("*.json")):
+        resource = json.loads(path.read_text(encoding="utf-8"))
+        if isinstance(resource, dict):
+            yield from _unbundle(resource)
+
+
+def _unbundle(resource: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    if resource.get("resourceType") == "Bundle":
+        for entry in resource.get("entry", []):
+            if "resource" in entry:
+                yield from _unbundle(entry["resource"])
+    else:
+        yield resource
+
+
+def _codes(codeable_concept: Optional[Dict[str, Any]]) -> List[Tuple[str, str]]:
+    """
+    Return the (vocabulary_id, concept_code) of the codings of a CodeableConcept in a
+    known code system
+    """
+    codes = []
+    for coding in (codeable_concept or {}).get("coding", []):
+        vocabulary_id = SYSTEM_VOCABULARIES.get(coding.get("system", ""))
+        if vocabulary_id is not None and "code" in coding:
+            codes.append((vocabulary_id, str(coding["code"])))
+    return codes
+
+
+def _display(codeable_concept: Optional[Dict[str, Any]]) -> Optional[str]:
+    codeable_concept = codeable_concept or {}
+    if codeable_concept.get("text"):
+        return codeable_concept["text"]
+    for coding in codeable_concept.get("coding", []):
+        if coding.get("display"):
+            return coding["display"]
+    return None
+
+
+def _value_range(
+    quantity: Optional[Dict[str, Any]], range_: Optional[Dict[str, Any]]
+) -> Dict[str, Any]:
+    """
+    Return the value range (fields of `RawCriterion`) of a Quantity (with an optional
+    comparator) or a Range
+    """
+    if quantity is not None and "value" in quantity:
+        value = float(quantity["value"])
+        comparator = quantity.get("comparator")
+        unit_code = quantity.get("code")
+        if comparator in ("<", "<="):
+            return dict(
+                value_high=value, high_inclusive=comparator == "<=", unit_code=unit_code
+            )
+        if comparator in (">", ">="):
+            return dict(
+                value_low=value, low_inclusive=comparator == ">=", unit_code=unit_code
+            )
+        return dict(value_low=value, value_high=value, unit_code=unit_code)
+
+    if range_ is not None:
+        low, high = range_.get("low", {}), range_.get("high", {})
+        return dict(
+            value_low=float(low["value"]) if "value" in low else None,
+            value_high=float(high["value"]) if "value" in high else None,
+            unit_code=low.get("code") or high.get("code"),
+        )
+
+    return {}
+
+
+def _window(characteristic: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Return the time window (fields of `RawCriterion`) of a characteristic, in hours
+    """
+    for time_from_event in characteristic.get("timeFromEvent", []):
+        range_ = time_from_event.get("range")
+        if range_ is None and "quantity" in time_from_event:
+            range_ = {"high": time_from_event["quantity"]}
+        if range_ is None:
+            continue
+
+        window = {}
+        for bound, field in (("low", "window_start"), ("high", "window_end")):
+            quantity = range_.get(bound, {})
+            hours = TIME_UNIT_HOURS.get(quantity.get("code", "h"))
+            if "value" in quantity and hours is not None:
+                window[field] = float(quantity["value"]) * hours
+        return window
+
+    return {}
+
+
+def _characteristics(
+    characteristics: List[Dict[str, Any]], exclude: bool = False
+) -> Iterator[Tuple[Dict[str, Any], bool]]:
+    """
+    Yield the characteristics of an EvidenceVariable (including those of combinations)
+    together with whether they are excluded
+    """
+    for characteristic in characteristics:
+        excluded = exclude != bool(characteristic.get("exclude", False))
+        combination = characteristic.get("definitionByCombination")
+        if combination is not None:
+            yield from _characteristics(combination.get("characteristic", []), excluded)
+        else:
+            yield characteristic, excluded
+
+
+def parse_evidence_variable(resource: Dict[str, Any]) -> Iterator[RawCriterion]:
+    """
+    Yield the criteria of the characteristics of an EvidenceVariable
+    """
+    source = resource.get("url") or resource.get("id", "")
+
+    for characteristic, exclude in _characteristics(resource.get("characteristic", [])):
+        definition = characteristic.get("definitionByTypeAndValue")
+        if definition is not None:
+            type_, holder = definition.get("type"), definition
+        else:
+            type_, holder = (
+                characteristic.get("definitionCodeableConcept"),
+                characteristic,
+            )
+
+        if "valueCodeableConcept" in holder:
+            # e.g. type "Clinical finding" and value "COVID-19"
+            concept = holder["valueCodeableConcept"]
+            value = {}
+        else:
+            concept = type_
+            value = _value_range(holder.get("valueQuantity"), holder.get("valueRange"))
+
+        codes = _codes(concept)
+        if not codes:
+            continue
+
+        yield RawCriterion(
+            name=characteristic.get("description") or _display(concept) or codes[0][1],
+            source=source,
+            codes=codes,
+            exclude=exclude,
+            **value,
+            **_window(characteristic),
+        )
+
+
+def parse_activity_definition(resource: Dict[str, Any]) -> Iterator[RawCriterion]:
+    """
+    Yield the criterion of an ActivityDefinition (the administered drug and its dose, or
+    the procedure)
+    """
+    concept = resource.get("productCodeableConcept") or resource.get("code")
+    codes = _codes(concept)
+    if not codes:
+        return
+
+    value = {}
+    for dosage in resource.get("dosage", [])[:1]:
+        for dose_and_rate in dosage.get("doseAndRate", [])[:1]:
+            value = _value_range(
+                dose_and_rate.get("doseQuantity"), dose_and_rate.get("doseRange")
+            )
+
+    yield RawCriterion(
+        name=resource.get("title") or _display(concept) or codes[0][1],
+        source=resource.get("url") or resource.get("id", ""),
+        codes=codes,
+        **value,
+    )
+
+
+def parse_criteria(directory: Union[str, Path]) -> Iterator[RawCriterion]:
+    """
+    Yield the criteria of the recommendations in a directory
+    """
+    for resource in iter_resources(directory):
+        resource_type = resource.get("resourceType")
+        if resource_type == "EvidenceVariable":
+            yield from parse_evidence_variable(resource)
+        elif resource_type == "ActivityDefinition":
+            yield from parse_activity_definition(resource)
+
+
+def _default_unit(concept_id: int) -> Optional[int]:
+    """
+    Return the unit the generator uses for a measurement concept (None, if it is not
+    generated)
+    """
+    from data_generator import parameter as params
+
+    if concept_id in params.LABORATORY_LIST:
+        return params.LABORATORY_LIST[concept_id]["unit"]
+    parameters: Dict[int, Any] = {}
+    for ventilation_parameters in params.VENTILATION_PARAMS.values():
+        parameters.update(ventilation_parameters)
+    for weight_parameters in params.WEIGHT.values():
+        parameters.update(weight_parameters)
+    if concept_id in parameters:
+        return parameters[concept_id]["unit"]
+    return None
+
+
+def compile_criteria(
+    raw_criteria: Iterable[RawCriterion], cache: "ConceptCache"
+) -> List[Criterion]:
+    """
+    Map the codings of criteria to standard concepts of the vocabulary
+    (`omop.vocabulary.ConceptCache`) and return the criteria (without duplicates).
+
+    A coding of a non-standard concept is mapped to the standard concept it maps to.
+    Criteria without a standard concept of a domain in `DOMAIN_TABLES` are skipped.
+    """
+    raw_criteria = list(raw_criteria)
+    codes = {code for raw in raw_criteria for code in raw.codes}
+    codes |= {("UCUM", raw.unit_code) for raw in raw_criteria if raw.unit_code}
+    found = cache.lookup_codes(codes)
+
+    non_standard = [c.concept_id for c in found.values() if not c.is_standard]
+    maps_to = cache.related(non_standard, "Maps to")
+    standard = cache.lookup(i for ids in maps_to.values() for i in ids)
+
+    def standard_concept(code: Tuple[str, str]) -> Optional["Concept"]:
+        concept = found.get(code)
+        if concept is None or concept.is_standard:
+            return concept
+        for concept_id in maps_to.get(concept.concept_id, []):
+            if concept_id in standard and standard[concept_id].is_standard:
+                return standard[concept_id]
+        return None
+
+    criteria = []
+    seen = set()
+
+    for raw in raw_criteria:
+        concept = None
+        for code in raw.codes:
+            concept = standard_concept(code)
+            if concept is not None and concept.domain_id in DOMAIN_TABLES:
+                break
+            concept = None
+
+        if concept is None:
+            logging.warning(
+                f"Skipping criterion {raw.name} of {raw.source}: no standard concept "
+                f"for {', '.join(':'.join(code) for code in raw.codes)}"
+            )
+            continue
+
+        table = DOMAIN_TABLES[concept.domain_id]
+        value: Dict[str, Any] = {}
+        if table in VALUE_TABLES:
+            unit = found.get(("UCUM", raw.unit_code)) if raw.unit_code else None
+            value = dict(
+                value_low=raw.value_low,
+                value_high=raw.value_high,
+                low_inclusive=raw.low_inclusive,
+                high_inclusive=raw.high_inclusive,
+                unit_concept_id=(
+                    unit.concept_id
+                    if unit is not None
+                    else _default_unit(concept.concept_id)
+                ),
+            )
+        elif raw.value_low is not None or raw.value_high is not None:
+            logging.debug(f"Ignoring the value of criterion {raw.name} ({table})")
+
+        criterion = Criterion(
+            name=raw.name,
+            source=raw.source,
+            table=table,
+            concept_id=concept.concept_id,
+            window_start=raw.window_start,
+            window_end=raw.window_end,
+            exclude=raw.exclude,
+            **value,
+        )
+
+        identity = dataclasses.astuple(
+            dataclasses.replace(criterion, name="", source="")
+        )
+        if identity not in seen:
+            seen.add(identity)
+            criteria.append(criterion)
+
+    return criteria
+
+
+def plan_key(directory: Union[str, Path], vocabulary: Union[str, Path]) -> str:
+    """
+    Return the key of the inputs of a plan: this module and the size and modification
+    time of the files of the recommendations and of the vocabulary
+    """
+    key = hashlib.sha256(Path(__file__).read_bytes())
+    paths = sorted(Path(directory).rglob("*.json"))
+    for path in [*paths, Path(vocabulary)]:
+        stat = path.stat()
+        key.update(f"{path.absolute()}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+    return key.hexdigest()
+
+
+def load_plan(
+    directory: Union[str, Path],
+    vocabulary: Union[str, Path],
+    path: Union[str, Path] = DEFAULT_CRITERIA_FILE,
+) -> CriteriaPlan:
+    """
+    Return the plan of the recommendations in a directory, from the cached plan in
+    `path` if its inputs did not change, or else compile (and cache) it
+    """
+    from omop.vocabulary import ConceptCache
+
+    key = plan_key(directory, vocabulary)
+    if Path(path).exists():
+        plan = CriteriaPlan.load(path)
+        if plan.key == key:
+            logging.info(f"Using the cached criteria in {path}")
+            return plan
+
+    with ConceptCache(vocabulary) as cache:
+        criteria = compile_criteria(parse_criteria(directory), cache)
+    if not criteria:
+        raise ValueError(f"No criteria found in the recommendations in {directory}")
+
+    plan = CriteriaPlan.build(key, criteria)
+    plan.save(path)
+    logging.info(
+        f"Compiled {len(plan.criteria)} criteria ({len(plan.cases)} cases) and cached "
+        f"them in {path}"
+    )
+
+    return plan
+
+
+def case_value(criterion: Criterion, kind: str, rng: "np.random.Generator") -> float:
+    """
+    Return a value of a case of a criterion with a value range: a value within the
+    range (SATISFY), on its lower (or upper) bound (BOUNDARY) or outside (VIOLATE)
+    """
+    import numpy as np
+
+    if kind == BOUNDARY:
+        return criterion.boundary()  # type: ignore[return-value]
+
+    integer = criterion.table in INTEGER_VALUE_TABLES
+    low, high = criterion.value_bounds()
+    finite = [bound for bound in (low, high) if math.isfinite(bound)]
+    if math.isfinite(low) and math.isfinite(high) and high > low:
+        span = high - low
+    else:
+        span = max(max(abs(bound) for bound in finite), 1.0)
+
+    if kind == SATISFY:
+        if math.isfinite(low) and math.isfinite(high):
+            value = low + (high - low) * rng.uniform(0.1, 0.9)
+        elif math.isfinite(low):
+            value = low + span * rng.uniform(0.1, 1.0)
+        else:
+            value = high - span * rng.uniform(0.1, 1.0)
+        return float(np.clip(round(value), low, high)) if integer else value
+
+    # VIOLATE: below the lower or above the upper bound
+    sides = [
+        side for side, bound in (("low", low), ("high", high)) if math.isfinite(bound)
+    ]
+    distance = span * rng.uniform(0.1, 1.0)
+    if integer:
+        distance = max(round(distance), 1)
+    if sides[int(rng.integers(len(sides)))] == "low":
+        return low - distance
+    return high + distance
+
+
+def _hours(start: datetime.datetime, hours: float) -> datetime.datetime:
+    return start + datetime.timedelta(seconds=round(hours * 3600))
+
+
+def case_row(
+    criterion: Criterion,
+    case: Case,
+    visit: "VisitOccurrence",
+    rng: "np.random.Generator",
+) -> Optional[Dict[str, Any]]:
+    """
+    Create the row of a case (as values of the columns of `criterion.table`, without
+    person_id), or None, if the case violates the criterion by the absence of its concept
+    """
+    import numpy as np
+
+    from omop import concepts
+
+    visit_start = visit.visit_start_datetime
+    visit_end = datetime.datetime.combine(visit.visit_end_date, datetime.time())
+    visit_hours = (visit_end - visit_start).total_seconds() / 3600
+
+    window_start = criterion.window_start or 0.0
+    window_end = min(
+        visit_hours if criterion.window_end is None else criterion.window_end,
+        visit_hours,
+    )
+    window_end = max(window_end, window_start)
+
+    value: Optional[float] = None
+    hours = rng.uniform(window_start, window_end)
+    if criterion.has_value:
+        value = case_value(criterion, case.kind, rng)
+    elif case.kind == VIOLATE:
+        if not criterion.has_window:
+            return None
+        # outside of the window: before it, if it does not start with the visit, or
+        # else after it
+        if window_start > 0:
+            hours = window_start - rng.uniform(1.0, 24.0)
+        else:
+            hours = window_end + rng.uniform(1.0, 24.0)
+
+    start = _hours(visit_start, hours)
+    table = criterion.table
+
+    if table == "measurement":
+        return dict(
+            measurement_concept_id=criterion.concept_id,
+            measurement_date=start.date(),
+            measurement_datetime=start,
+            value_as_number=np.nan if value is None else value,
+            unit_concept_id=criterion.unit_concept_id or concepts.UNKNOWN,
+        )
+    if table == "drug_exposure":
+        end = _hours(start, 1.0)
+        return dict(
+            drug_concept_id=criterion.concept_id,
+            drug_exposure_start_date=start.date(),
+            drug_exposure_start_datetime=start,
+            drug_exposure_end_date=end.date(),
+            drug_exposure_end_datetime=end,
+            quantity=1 if value is None else int(value),
+        )
+    if table == "procedure_occurrence":
+        end = _hours(start, rng.uniform(1.0, 24.0))
+        return dict(
+            procedure_concept_id=criterion.concept_id,
+            procedure_type_concept_id=concepts.EHR,
+            procedure_date=start.date(),
+            procedure_datetime=start,
+            procedure_end_date=end.date(),
+            procedure_end_datetime=end,
+        )
+    if table == "condition_occurrence":
+        end = max(visit_end, start)
+        return dict(
+            condition_concept_id=criterion.concept_id,
+            condition_start_date=start.date(),
+            condition_start_datetime=start,
+            condition_end_date=end.date(),
+            condition_end_datetime=end,
+        )
+    if table == "observation":
+        return dict(
+            observation_concept_id=criterion.concept_id,
+            observation_date=start.date(),
+            observation_datetime=start,
+        )
+
+    raise ValueError(f"Unknown table {table}")
@@ -1,134 +1,212 @@
 import datetime
-import random
-from typing import List, Optional, cast
+import logging
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence, TypeVar
 
 import numpy as np
 
 from data_generator import parameter as params
-from data_generator.parameter import COND_WEIGHTS, OBS_WEIGHTS
 from omop import concepts
-from omop.tables import (
-    ConditionOccurrence,
-    DrugExposure,
-    Measurement,
-    Observation,
-    Person,
-    ProcedureOccurrence,
-    VisitOccurrence,
-    random_datetime,
-)
+from omop.tables import random_date, random_datetime
+
+# rows are created with the fast (non-validating) row classes, which have the same
+# fields as the data classes in omop.tables
+if TYPE_CHECKING:
+    from omop.tables import (
+        ConditionOccurrence,
+        DrugExposure,
+        Measurement,
+        Observation,
+        Person,
+        ProcedureOccurrence,
+        VisitOccurrence,
+    )
+else:
+    from omop.rows import (
+        ConditionOccurrence,
+        DrugExposure,
+        Measurement,
+        Observation,
+        Person,
+        ProcedureOccurrence,
+        VisitOccurrence,
+    )
 
 SECONDS_PER_DAY = 86400
+MICROSECONDS_PER_DAY = SECONDS_PER_DAY * 1_000_000
 
+T = TypeVar("T")
 
-def create_drug_exp2(
-    person_id: int, visit: VisitOccurrence, n_administrations: int
-) -> List[DrugExposure]:
+
+def random_choice(rng: np.random.Generator, values: Sequence[T]) -> T:
     """
-    Create a list of drug exposures for a given visit
+    Return a random element of `values` (faster than `rng.choice` for single draws)
+    """
+    return values[int(rng.integers(len(values)))]
+
+
+def create_person(person_id: int, rng: np.random.Generator) -> Person:
+    """
+    Create a person with random gender and date of birth
+    """
+    birth_datetime = random_datetime(
+        random_date(datetime.date(1920, 1, 1), datetime.date(2003, 12, 31), rng), rng
+    )
+
+    return Person(
+        person_id=person_id,
+        gender_concept_id=params.sampler("gender").draw(rng),
+        birth_datetime=birth_datetime,
+        year_of_birth=birth_datetime.year,
+        month_of_birth=birth_datetime.month,
+        day_of_birth=birth_datetime.day,
+        race_concept_id=concepts.UNKNOWN,  # always set to zero / unknown
+        ethnicity_concept_id=concepts.UNKNOWN,  # always set to zero / unknown
+    )
+
+
+def create_visit(person_id: int, rng: np.random.Generator) -> VisitOccurrence:
+    """
+    Create a visit (inpatient or intensive care) within the visit period of `params`
+    """
+    visit_concept_id = params.sampler("visit_concept").draw(rng)
+    visit_start_date = random_date(
+        start_date=params.VISIT_START_DATE, end_date=params.VISIT_END_DATE, rng=rng
+    )
+    visit_start_datetime = random_datetime(visit_start_date, rng)
+    visit_end_date = visit_start_date + datetime.timedelta(
+        days=random_choice(rng, range(3, 60))
+    )
+    visit_end_datetime = random_datetime(visit_end_date, rng)
+
+    return VisitOccurrence(
+        person_id=person_id,
+        visit_concept_id=visit_concept_id,
+        visit_start_date=visit_start_date,
+        visit_start_datetime=visit_start_datetime,
+        visit_end_date=visit_end_date,
+        visit_end_datetime=visit_end_datetime,
+        visit_type_concept_id=concepts.VISIT_TYPE_STILL_PATIENT,
+    )
+
+
+def drug_exposure_columns(
+    visit: VisitOccurrence,
+    rng: np.random.Generator,
+    n_administrations: int,
+) -> Dict[str, np.ndarray]:
+    """
+    Create the drug exposures of a visit as columns (arrays) of the drug_exposure table
 
     n_administration: number of boluses in case of LWMH/Fondaparinux or
                       number of doserate changes in case of continuous infusions
+
+    The dosing of the drug is taken from `params.DRUG_DOSING`. The gaps, durations and
+    doses of all administrations are drawn at once and the timestamps are computed as
+    their cumulative sum. Returned columns are drug_concept_id,
+    drug_exposure_start_date, drug_exposure_start_datetime, drug_exposure_end_date,
+    drug_exposure_end_datetime and quantity.
     """
-    list_of_drugs = []
     begin_drug = visit.visit_start_date + datetime.timedelta(
-        days=random.choice(range(4))
+        days=random_choice(rng, range(4))
     )
-    end_drug = begin_drug + (random.random() * (visit.visit_end_date - begin_drug))
-    #    end_drug = begin_drug + datetime.timedelta(days = random.choice(range(2,30)))
+    end_drug = begin_drug + (rng.random() * (visit.visit_end_date - begin_drug))
     # create dttm from date, add random number of hours to startdate midnight
-    drug_exposure_start_datetime = datetime.datetime.combine(
+    first_datetime = datetime.datetime.combine(
         begin_drug, datetime.datetime.min.time()
-    ) + datetime.timedelta(hours=random.choice(range(12)))
+    ) + datetime.timedelta(hours=random_choice(rng, range(12)))
 
-    drug_concept_id = random.choice(list(params.DRUG_LIST))
+    drug_concept_id = params.sampler("drug").draw(rng)
+    if drug_concept_id not in params.DRUG_DOSING:
+        raise ValueError(f"Unknown drug concept id {drug_concept_id}")
+    dosing = params.DRUG_DOSING[drug_concept_id]
+
+    # one draw for all administrations: a row of uniform indexes into each range
+    # (scaling uniform floats is much faster than rng.integers with array bounds)
+    ranges = (dosing["gap_hours"], dosing["duration_hours"], dosing["dose"])
+    indexes = (
+        rng.random((len(ranges), n_administrations))
+        * np.array([[len(r)] for r in ranges])
+    ).astype(np.int64)
+    gap_hours, duration_hours, dose = (
+        np.array([[r.start] for r in ranges])
+        + np.array([[r.step] for r in ranges]) * indexes
+    )
 
-    # continuous infusion of drugs, quantity referring to [dose] / h
-    if drug_concept_id in [concepts.HEPARIN, concepts.ARGATROBAN]:
-        drug_exposure_end_datetime = drug_exposure_start_datetime
-        for _ in range(n_administrations):
-            drug_exposure_start_datetime = (
-                drug_exposure_end_datetime
-                + datetime.timedelta(hours=random.choice(range(2)))
-            )
-            drug_exposure_start_date = (
-                drug_exposure_start_datetime.date()
-            )  # create date from dttm
-            if drug_concept_id == concepts.HEPARIN:
-                quantity_h = random.choice(range(200, 900, 100))  # heparin in IE/h
-            elif drug_concept_id == concepts.ARGATROBAN:
-                quantity_h = random.choice(range(5, 10, 1))  # argatroban in mg/h
-            drug_exposure_end_datetime = (
-                drug_exposure_start_datetime
-                + datetime.timedelta(hours=random.choice(range(1, 12)))
-            )
-            drug_exposure_end_date = drug_exposure_end_datetime.date()
-            duration = drug_exposure_end_datetime - drug_exposure_start_datetime
-            duration_h = duration.total_seconds() / 3600
-            quantity = int(duration_h * quantity_h)
+    # each administration starts `gap_hours` after the end of the previous one
+    end_hours = np.cumsum(gap_hours + duration_hours)
+    start_hours = end_hours - duration_hours
 
-            if drug_exposure_start_date > end_drug:
-                break
+    # administrations end with the first one that starts after the last day of the
+    # therapy
+    last_hour = (
+        datetime.datetime.combine(
+            end_drug + datetime.timedelta(days=1), datetime.datetime.min.time()
+        )
+        - first_datetime
+    ) / datetime.timedelta(hours=1)
+    n = int(np.count_nonzero(start_hours < last_hour))
 
-            list_of_drugs.append(
-                DrugExposure(
-                    person_id=person_id,
-                    drug_concept_id=drug_concept_id,
-                    drug_exposure_start_date=drug_exposure_start_date,
-                    drug_exposure_start_datetime=drug_exposure_start_datetime,
-                    drug_exposure_end_date=drug_exposure_end_date,
-                    drug_exposure_end_datetime=drug_exposure_end_datetime,
-                    quantity=quantity,
-                )
-            )
-    elif drug_concept_id in [
-        concepts.DALTEPARIN,
-        concepts.NADROPARIN,
-        concepts.CERTOPARIN,
-        concepts.ENOXAPARIN,
-        concepts.FONDAPARINUX,
-    ]:
-        for _ in range(n_administrations):
-            drug_exposure_start_datetime += datetime.timedelta(
-                hours=random.choice(range(4, 20))
-            )
-            drug_exposure_start_date = (
-                drug_exposure_start_datetime.date()
-            )  # create date from dttm
-            if drug_concept_id in [concepts.DALTEPARIN, concepts.NADROPARIN]:
-                quantity = random.choice(range(3000, 15000, 1000))
-            elif drug_concept_id == concepts.CERTOPARIN:
-                quantity = random.choice(range(1000, 4000, 500))
-            elif drug_concept_id == concepts.ENOXAPARIN:
-                quantity = random.choice(range(10, 120, 10))
-            elif drug_concept_id == concepts.FONDAPARINUX:
-                quantity = random.choice(range(1, 4, 1))
-            else:
-                pass
-            drug_exposure_end_date = drug_exposure_start_date
-            drug_exposure_end_datetime = drug_exposure_start_datetime
-            if drug_exposure_start_date > end_drug:
-                break
-
-            list_of_drugs.append(
-                DrugExposure(
-                    person_id=person_id,
-                    drug_concept_id=drug_concept_id,
-                    drug_exposure_start_date=drug_exposure_start_date,
-                    drug_exposure_start_datetime=drug_exposure_start_datetime,
-                    drug_exposure_end_date=drug_exposure_end_date,
-                    drug_exposure_end_datetime=drug_exposure_end_datetime,
-                    quantity=quantity,
-                )
-            )
-    else:
-        raise ValueError(f"Unknown drug concept id {drug_concept_id}")
+    first = np.datetime64(first_datetime, "us")
+    start_datetime = first + start_hours[:n].astype("timedelta64[h]")
+    end_datetime = first + end_hours[:n].astype("timedelta64[h]")
+
+    # continuous infusions: quantity refers to the dose rate [dose] / h
+    quantity = dose[:n] * duration_hours[:n] if dosing["continuous"] else dose[:n]
 
-    return list_of_drugs
+    return {
+        "drug_concept_id": np.full(n, drug_concept_id, dtype=np.int64),
+        "drug_exposure_start_date": start_datetime.astype("datetime64[D]"),
+        "drug_exposure_start_datetime": start_datetime,
+        "drug_exposure_end_date": end_datetime.astype("datetime64[D]"),
+        "drug_exposure_end_datetime": end_datetime,
+        "quantity": quantity,
+    }
+
+
+def create_drug_exp2(
+    person_id: int,
+    visit: VisitOccurrence,
+    rng: np.random.Generator,
+    n_administrations: int,
+) -> List[DrugExposure]:
+    """
+    Create a list of drug exposures for a given visit
+
+    n_administration: number of boluses in case of LWMH/Fondaparinux or
+                      number of doserate changes in case of continuous infusions
+    """
+    columns = drug_exposure_columns(visit, rng, n_administrations)
+
+    return [
+        DrugExposure(
+            person_id=person_id,
+            drug_concept_id=drug_concept_id,
+            drug_exposure_start_date=drug_exposure_start_date,
+            drug_exposure_start_datetime=drug_exposure_start_datetime,
+            drug_exposure_end_date=drug_exposure_end_date,
+            drug_exposure_end_datetime=drug_exposure_end_datetime,
+            quantity=quantity,
+        )
+        for (
+            drug_concept_id,
+            drug_exposure_start_date,
+            drug_exposure_start_datetime,
+            drug_exposure_end_date,
+            drug_exposure_end_datetime,
+            quantity,
+        ) in zip(
+            columns["drug_concept_id"].tolist(),
+            columns["drug_exposure_start_date"].tolist(),
+            columns["drug_exposure_start_datetime"].tolist(),
+            columns["drug_exposure_end_date"].tolist(),
+            columns["drug_exposure_end_datetime"].tolist(),
+            columns["quantity"].tolist(),
+        )
+    ]
 
 
 def create_vent_params_procedure(
-    person_id: int, visit: VisitOccurrence
+    person_id: int, visit: VisitOccurrence, rng: np.random.Generator
 ) -> Optional[ProcedureOccurrence]:
     """
     Create a list of procedures for a given visit
@@ -147,21 +225,23 @@ def create_vent_params_procedure(
     if visit.visit_concept_id != concepts.INTENSIVE_CARE:
         return None
 
-    print("- patient is treated on ICU")
+    logging.debug("- patient is treated on ICU")
     # create parameters for ventilated patients
 
-    procedure_concept_id = random.choice(list(params.VENTILATION_BIN))
-    print(f"- patient has episode of {params.VENTILATION_BIN[procedure_concept_id]}")
+    procedure_concept_id = params.sampler("ventilation").draw(rng)
+    logging.debug(
+        "- patient has episode of %s", params.VENTILATION_BIN[procedure_concept_id]
+    )
 
     procedure_type_concept_id = concepts.EHR
     begin_vent = visit.visit_start_date + datetime.timedelta(
-        days=random.choice(range(3))
+        days=random_choice(rng, range(3))
     )
-    end_vent = begin_vent + (random.random() * (visit.visit_end_date - begin_vent))
+    end_vent = begin_vent + (rng.random() * (visit.visit_end_date - begin_vent))
     procedure_date = begin_vent
-    procedure_datetime = random_datetime(procedure_date)
+    procedure_datetime = random_datetime(procedure_date, rng)
     procedure_end_date = end_vent
-    procedure_end_datetime = random_datetime(procedure_end_date)
+    procedure_end_datetime = random_datetime(procedure_end_date, rng)
 
     return ProcedureOccurrence(
         person_id=person_id,
@@ -175,7 +255,10 @@ def create_vent_params_procedure(
 
 
 def create_vent_params_measurements(
-    person_id: int, prod: Optional[ProcedureOccurrence], visit: VisitOccurrence
+    person_id: int,
+    prod: Optional[ProcedureOccurrence],
+    visit: VisitOccurrence,
+    rng: np.random.Generator,
 ) -> List[Measurement]:
     """
     Create (only one) episode of ventilation or O2 therapy for ICU patients with related parameters.
@@ -194,31 +277,40 @@ def create_vent_params_measurements(
     # set different frequencies (x per day)
     freq = {concepts.ARTIFICIAL_RESPIRATION: 24, concepts.OXYGEN_THERAPY: 2}
 
-    print(
-        f"- patient is treated by {params.VENTILATION_BIN[prod.procedure_concept_id]}"
+    logging.debug(
+        "- patient is treated by %s", params.VENTILATION_BIN[prod.procedure_concept_id]
     )
     vent_params = params.VENTILATION_PARAMS[prod.procedure_concept_id]
 
     begin_vent = prod.procedure_date
-    end_vent = begin_vent + (random.random() * (visit.visit_end_date - begin_vent))
+    end_vent = begin_vent + (rng.random() * (visit.visit_end_date - begin_vent))
     duration_vent = (end_vent - begin_vent).total_seconds() / SECONDS_PER_DAY
-    for x in range(int(duration_vent)):
-        base_datetime = random_datetime(begin_vent)
+    n_days = int(duration_vent)
+
+    # draw the values of each parameter for the whole episode at once
+    n_values = n_days * freq[prod.procedure_concept_id]
+    values = {}
+    for measurement_concept_id, param in vent_params.items():
+        choices = np.asarray(param["value"])
+        values[measurement_concept_id] = iter(
+            choices[rng.integers(len(choices), size=n_values)].tolist()
+        )
+
+    for x in range(n_days):
+        base_datetime = random_datetime(begin_vent, rng)
         begin_vent += datetime.timedelta(days=1)
         # create FiO2 values
         measurement_datetime = base_datetime  # set measurement_datetime to base
 
         for _ in range(freq[prod.procedure_concept_id]):
-            measurement_date = measurement_datetime.date()
             measurement_datetime += datetime.timedelta(
                 hours=24 / freq[prod.procedure_concept_id]
             )
+            measurement_date = measurement_datetime.date()
             for measurement_concept_id in vent_params:
 
                 unit_concept_id = vent_params[measurement_concept_id]["unit"]
-                value_as_number = random.choice(
-                    vent_params[measurement_concept_id]["value"]
-                )
+                value_as_number = next(values[measurement_concept_id])
 
                 list_of_measurements.append(
                     Measurement(
@@ -234,17 +326,17 @@ def create_vent_params_measurements(
     return list_of_measurements
 
 
-def create_lab_values_measurements(
-    person_id: int, visit: VisitOccurrence
-) -> List[Measurement]:
+def lab_values_columns(
+    visit: VisitOccurrence, rng: np.random.Generator
+) -> Dict[str, np.ndarray]:
     """
-    Create lab values for a patient
+    Create the lab values of a visit as columns (arrays) of the measurement table
 
-    ideally, not done yet: if ARDS or mechanical ventilation is existent, Horowitz Index should be lower,
-    because those patients are sicker
+    All measurement timestamps of the visit are computed at once as a datetime64 array
+    and the values of each parameter are drawn with a single vectorized call.
+    Returned columns are measurement_concept_id, measurement_date, measurement_datetime,
+    value_as_number and unit_concept_id.
     """
-    list_of_measurements = []
-
     # set different frequencies (x per day)
     freq_high = 4  # used for higher-frequency generation of values
     freq_low = 2  # used for less frequent generation
@@ -252,20 +344,19 @@ def create_lab_values_measurements(
 
     # set "basetime" to visit_start, i.e. generation of lab values are started up to
     # twelve hours after the start of the visit
-    measurement_datetime = random_datetime(visit.visit_start_date, max_hours=12)
-    measurement_date = measurement_datetime.date()
+    base_datetime = random_datetime(visit.visit_start_date, rng, max_hours=12)
 
     visit_duration = visit.visit_end_date - visit.visit_start_date
 
     if visit.visit_concept_id == concepts.INTENSIVE_CARE:
-        print("- patient is treated on ICU")
+        logging.debug("- patient is treated on ICU")
         freq = {
             concepts.LAB_HOROWITZ: freq_high,
             concepts.LAB_APTT: freq_daily,
             concepts.LAB_DDIMER: freq_daily,
         }
     elif visit.visit_concept_id == concepts.INPATIENT_VISIT:
-        print("- patient is treated on normal ward")
+        logging.debug("- patient is treated on normal ward")
         freq = {
             concepts.LAB_HOROWITZ: freq_low,
             concepts.LAB_APTT: freq_daily,
@@ -274,38 +365,91 @@ def create_lab_values_measurements(
     else:
         raise ValueError("visit_concept_id not recognized")
 
-    for x in range(
-        int(visit_duration.total_seconds() / SECONDS_PER_DAY)
-    ):  # generate per day
-        for parameter in list(params.LABORATORY_LIST):
-            data = params.LABORATORY_LIST[parameter]
-            for _ in range(freq[parameter]):
-                measurement_date = measurement_datetime.date()
-                measurement_concept_id = parameter
-                measurement_type_concept_id = concepts.EHR
-                # maybe here introduce if condition_concept_id ARDS/mechanical ventilation is given
-                value_as_number = data["sample_func"]()  # type: ignore
-                unit_concept_id = cast(int, data["unit"])
+    n_days = int(visit_duration.total_seconds() / SECONDS_PER_DAY)
 
-                list_of_measurements.append(
-                    Measurement(
-                        person_id=person_id,
-                        measurement_concept_id=measurement_concept_id,
-                        measurement_date=measurement_date,
-                        measurement_datetime=measurement_datetime,
-                        value_as_number=round(value_as_number, 0),
-                        unit_concept_id=unit_concept_id,
-                        measurement_type_concept_id=measurement_type_concept_id,
-                    )
-                )
+    # Each day, every parameter is measured freq[parameter] times (in the order of
+    # params.LABORATORY_LIST) and the measurement time advances by 24h / freq after each
+    # value. The timestamps are thus the cumulative sum of these steps.
+    day_concepts = np.repeat(
+        np.array(list(params.LABORATORY_LIST), dtype=np.int64),
+        [freq[parameter] for parameter in params.LABORATORY_LIST],
+    )
+    day_steps = np.repeat(
+        np.array(
+            [MICROSECONDS_PER_DAY // freq[p] for p in params.LABORATORY_LIST],
+            dtype=np.int64,
+        ),
+        [freq[parameter] for parameter in params.LABORATORY_LIST],
+    )
 
-                measurement_datetime += datetime.timedelta(hours=24 / freq[parameter])
+    concept_ids = np.tile(day_concepts, n_days)
+    steps = np.tile(day_steps, n_days)
+    offsets = np.cumsum(steps) - steps  # time before each measurement
 
-    return list_of_measurements
+    measurement_datetime = np.datetime64(base_datetime, "us") + offsets.astype(
+        "timedelta64[us]"
+    )
+
+    value_as_number = np.empty(len(concept_ids), dtype=np.float64)
+    unit_concept_id = np.empty(len(concept_ids), dtype=np.int64)
+
+    for parameter, data in params.LABORATORY_LIST.items():
+        # maybe here introduce if condition_concept_id ARDS/mechanical ventilation is given
+        mask = concept_ids == parameter
+        value_as_number[mask] = data["sample_func"](rng, size=int(mask.sum()))
+        unit_concept_id[mask] = data["unit"]
+
+    return {
+        "measurement_concept_id": concept_ids,
+        "measurement_date": measurement_datetime.astype("datetime64[D]"),
+        "measurement_datetime": measurement_datetime,
+        "value_as_number": np.round(value_as_number, 0),
+        "unit_concept_id": unit_concept_id,
+    }
+
+
+def create_lab_values_measurements(
+    person_id: int, visit: VisitOccurrence, rng: np.random.Generator
+) -> List[Measurement]:
+    """
+    Create lab values for a patient
+
+    ideally, not done yet: if ARDS or mechanical ventilation is existent, Horowitz Index should be lower,
+    because those patients are sicker
+    """
+    columns = lab_values_columns(visit, rng)
+
+    return [
+        Measurement(
+            person_id=person_id,
+            measurement_concept_id=measurement_concept_id,
+            measurement_date=measurement_date,
+            measurement_datetime=measurement_datetime,
+            value_as_number=value_as_number,
+            unit_concept_id=unit_concept_id,
+            measurement_type_concept_id=concepts.EHR,
+        )
+        for (
+            measurement_concept_id,
+            measurement_date,
+            measurement_datetime,
+            value_as_number,
+            unit_concept_id,
+        ) in zip(
+            columns["measurement_concept_id"].tolist(),
+            columns["measurement_date"].tolist(),
+            columns["measurement_datetime"].tolist(),
+            columns["value_as_number"].tolist(),
+            columns["unit_concept_id"].tolist(),
+        )
+    ]
 
 
 def create_prone_positioning_procedure(
-    person_id: int, visit: VisitOccurrence, max_occurrences: int = 5
+    person_id: int,
+    visit: VisitOccurrence,
+    rng: np.random.Generator,
+    max_occurrences: int = 5,
 ) -> List[ProcedureOccurrence]:
     """
     Create prone positioning procedure occurrences for a patient
@@ -316,24 +460,21 @@ def create_prone_positioning_procedure(
 
     list_of_procedures = []
 
-    r = random.random()  # roll the dice if patient is put in prone positioning
+    r = rng.random()  # roll the dice if patient is put in prone positioning
     if r >= 0.5:
-        print("- patient is placed in prone positioning at least once")
+        logging.debug("- patient is placed in prone positioning at least once")
         procedure_date: datetime.date = visit.visit_start_date + datetime.timedelta(
-            days=random.choice(range(3))
+            days=random_choice(rng, range(3))
         )  # beginning of positioning
-        procedure_end_date: datetime.date = procedure_date + (
-            random.random() * (visit.visit_end_date - procedure_date)
-        )
-        procedure_datetime = random_datetime(procedure_date)
+        procedure_datetime = random_datetime(procedure_date, rng)
         procedure_end_datetime = procedure_datetime + datetime.timedelta(
-            seconds=random.randint(0, 86400)
+            seconds=int(rng.integers(0, 86400, endpoint=True))
         )
 
         procedure_concept_id = concepts.PRONE_POSITIONING
         procedure_type_concept_id = concepts.EHR
 
-        n_occurrences = random.choice(range(max_occurrences)) + 1
+        n_occurrences = random_choice(rng, range(max_occurrences)) + 1
 
         for i in range(n_occurrences):  # number of times of prone positioning
 
@@ -342,45 +483,44 @@ def create_prone_positioning_procedure(
                     person_id=person_id,
                     procedure_concept_id=procedure_concept_id,
                     procedure_type_concept_id=procedure_type_concept_id,
-                    procedure_date=procedure_date,
+                    procedure_date=procedure_datetime.date(),
                     procedure_datetime=procedure_datetime,
-                    procedure_end_date=procedure_end_date,
+                    procedure_end_date=procedure_end_datetime.date(),
                     procedure_end_datetime=procedure_end_datetime,
                 )
             )
 
-            prone_duration = random.choice(range(10, 20))
+            # the next positioning starts after some hours on the back
+            prone_duration = random_choice(rng, range(10, 20))
+            back_duration = random_choice(rng, range(4, 16))
+            procedure_datetime = procedure_end_datetime + datetime.timedelta(
+                hours=back_duration
+            )
             procedure_end_datetime = procedure_datetime + datetime.timedelta(
                 hours=prone_duration
             )
-            procedure_end_date = procedure_end_datetime.date()
-
-            back_duration = random.choice(range(4, 16))
-            procedure_datetime += datetime.timedelta(
-                hours=prone_duration + back_duration
-            )
-            procedure_date = procedure_datetime.date()
 
     return list_of_procedures
 
 
 def create_cond(
-    person_id: int, visit: VisitOccurrence, max_occurrences: int = 4
+    person_id: int,
+    visit: VisitOccurrence,
+    rng: np.random.Generator,
+    max_occurrences: int = 4,
 ) -> List[ConditionOccurrence]:
     """
     create conditions from list 'conditions' (default: max_occurrences = up to four)
 
-    Use condition_ids and weights for weighted random sampling. Taking multiple random samples without replacement requires np.random.choice
+    Use condition_ids and weights for weighted random sampling. Multiple conditions are sampled without replacement (see `params.CategoricalSampler`)
     COVID-19, Venous Thrombosis, Heparin-induced thrombocytopenia with thrombosis, Allergy to heparin, Allergy to heparinoid, Thrombocytopenic disorder, Pulmonary embolism, Acute respiratory distress syndrome
     """
     list_of_conditions = []
-    r = random.randint(1, max_occurrences)
-    diagnoses = np.random.choice(
-        list(params.CONDITION_LIST), r, replace=False, p=COND_WEIGHTS
-    )
+    r = int(rng.integers(1, max_occurrences, endpoint=True))
+    diagnoses = params.sampler("condition").draw_distinct(rng, r)
     for diagnosis in diagnoses:
         condition_start_date = visit.visit_start_date
-        condition_start_datetime = random_datetime(visit.visit_start_date)
+        condition_start_datetime = random_datetime(visit.visit_start_date, rng)
         condition_concept_id = diagnosis
         condition_end_date = condition_start_date
         condition_end_datetime = condition_start_datetime
@@ -400,27 +540,26 @@ def create_cond(
 def create_obs(
     person_id: int,
     visit: VisitOccurrence,
+    rng: np.random.Generator,
     max_occurrences: int = 2,
     probability_threshold: float = 0.05,
 ) -> List[Observation]:
     """
     with a probability_threshold (default = 0.05), create entries concerning observation(s) from the list 'obs_list' (default: max_occurrences = up to two)
 
-    Use observation_concept_ids and weights for weighted random sampling. Taking multiple random samples without replacement requires np.random.choice
+    Use observation_concept_ids and weights for weighted random sampling. Multiple observations are sampled without replacement (see `params.CategoricalSampler`)
 
     """
 
     list_of_observations = []
-    ran = random.random()
+    ran = rng.random()
     if ran > 1 - probability_threshold:
-        r = random.randint(1, max_occurrences)
-        observations = np.random.choice(
-            list(params.OBSERVATION_LIST), r, replace=False, p=OBS_WEIGHTS
-        )
+        r = int(rng.integers(1, max_occurrences, endpoint=True))
+        observations = params.sampler("observation").draw_distinct(rng, r)
         for observation in observations:
             observation_concept_id = observation
             observation_date = visit.visit_start_date
-            observation_datetime = random_datetime(visit.visit_start_date)
+            observation_datetime = random_datetime(visit.visit_start_date, rng)
             list_of_observations.append(
                 Observation(
                     person_id=person_id,
@@ -433,7 +572,7 @@ def create_obs(
 
 
 def create_weight_measurements(
-    person_id: int, person: Person, visit: VisitOccurrence
+    person_id: int, person: Person, visit: VisitOccurrence, rng: np.random.Generator
 ) -> List[Measurement]:
     """
     Create Measurements for weight and ideal weight
@@ -447,8 +586,8 @@ def create_weight_measurements(
     for parameter, data in param_set.items():
         measurement_concept_id = parameter
         measurement_date = visit.visit_start_date
-        measurement_datetime = random_datetime(visit.visit_start_date)
-        value_as_number = data["sample_func"]()
+        measurement_datetime = random_datetime(visit.visit_start_date, rng)
+        value_as_number = data["sample_func"](rng)
         unit_concept_id = data["unit"]
 
         list_of_measurements.append(
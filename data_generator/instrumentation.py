@@ -0,0 +1,164 @@
+"""
+Instrumentation of the data generation.
+
+Records the wall time spent in each generation stage and in writing each table,
+the number of rows written per table and the latency of each flush to the sink.
+The statistics of the current process are collected in `STATS`; worker processes
+send theirs to the main process, where they are merged.
+"""
+import time
+from typing import Any, Dict, Optional
+
+
+class _Timer:
+    """
+    Context manager that adds the elapsed time to a stage of a `Stats` instance
+    """
+
+    __slots__ = ("stats", "name", "start")
+
+    def __init__(self, stats: "Stats", name: str) -> None:
+        self.stats = stats
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self) -> None:
+        """
+        Start the timer
+        """
+        self.start = time.perf_counter()
+
+    def __exit__(self, exc_type: Any, exc_value: Any, traceback: Any) -> None:
+        """
+        Stop the timer and record the elapsed time
+        """
+        self.stats.add_stage_time(self.name, time.perf_counter() - self.start)
+
+
+class Stats:
+    """
+    Timings and row counts of a generation run.
+    """
+
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Discard all recorded statistics and restart the clock
+        """
+        self.started = time.perf_counter()
+        self.stage_seconds: Dict[str, float] = {}
+        self.stage_calls: Dict[str, int] = {}
+        self.rows: Dict[str, int] = {}
+        self.flushes: Dict[str, int] = {}
+        self.flush_seconds: Dict[str, float] = {}
+        self.max_flush_seconds: Dict[str, float] = {}
+        self.patients = 0
+
+    def stage(self, name: str) -> _Timer:
+        """
+        Return a context manager that records the wall time of a generation stage
+        """
+        return _Timer(self, name)
+
+    def add_stage_time(self, name: str, seconds: float, calls: int = 1) -> None:
+        """
+        Record the wall time of (one or more calls of) a generation stage
+        """
+        self.stage_seconds[name] = self.stage_seconds.get(name, 0.0) + seconds
+        self.stage_calls[name] = self.stage_calls.get(name, 0) + calls
+
+    def add_flush(self, table: str, rows: int, seconds: float) -> None:
+        """
+        Record that `rows` rows of `table` were written to the sink in `seconds`
+        """
+        self.rows[table] = self.rows.get(table, 0) + rows
+        self.flushes[table] = self.flushes.get(table, 0) + 1
+        self.flush_seconds[table] = self.flush_seconds.get(table, 0.0) + seconds
+        self.max_flush_seconds[table] = max(
+            self.max_flush_seconds.get(table, 0.0), seconds
+        )
+
+    def add_patients(self, n: int) -> None:
+        """
+        Record that `n` patients were generated
+        """
+        self.patients += n
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Return the generation statistics (stages and patients) for merging in another process
+        """
+        return {
+            "stage_seconds": dict(self.stage_seconds),
+            "stage_calls": dict(self.stage_calls),
+            "patients": self.patients,
+        }
+
+    def merge(self, snapshot: Dict[str, Any]) -> None:
+        """
+        Add the generation statistics of another process (see `snapshot`)
+        """
+        for name, seconds in snapshot["stage_seconds"].items():
+            self.add_stage_time(name, seconds, snapshot["stage_calls"][name])
+        self.patients += snapshot["patients"]
+
+    def elapsed(self) -> float:
+        """
+        Return the wall time since the statistics were started
+        """
+        return time.perf_counter() - self.started
+
+    def progress_line(self, n_total: Optional[int] = None) -> str:
+        """
+        Return a one-line summary of the progress
+        """
+        elapsed = self.elapsed()
+        rows = sum(self.rows.values())
+        patients = f"{self.patients}" + (f"/{n_total}" if n_total else "")
+        return (
+            f"{patients} patients, {rows:,} rows written in {elapsed:.1f} s "
+            f"({self.patients / elapsed:,.1f} patients/s, {rows / elapsed:,.0f} rows/s)"
+        )
+
+    def report(self) -> Dict[str, Any]:
+        """
+        Return all statistics as a JSON serializable dictionary
+        """
+        elapsed = self.elapsed()
+        rows = sum(self.rows.values())
+
+        return {
+            "seconds": elapsed,
+            "patients": self.patients,
+            "rows": rows,
+            "rows_per_second": rows / elapsed if elapsed else None,
+            "stages": {
+                name: {
+                    "seconds": seconds,
+                    "calls": self.stage_calls[name],
+                }
+                for name, seconds in self.stage_seconds.items()
+            },
+            "tables": {
+                table: {
+                    "rows": self.rows[table],
+                    "flushes": self.flushes[table],
+                    "flush_seconds": self.flush_seconds[table],
+                    "max_flush_seconds": self.max_flush_seconds[table],
+                    "mean_flush_seconds": self.flush_seconds[table]
+                    / self.flushes[table],
+                    "rows_per_second": (
+                        self.rows[table] / self.flush_seconds[table]
+                        if self.flush_seconds[table]
+                        else None
+                    ),
+                }
+                for table in self.rows
+            },
+        }
+
+
+# statistics of the current process
+STATS = Stats()
@@ -0,0 +1,250 @@
+"""
+Manifest of generated tables for incremental regeneration.
+
+Each generation stage is fingerprinted by the code and parameters it uses (see
+`stage_inputs`), and each table by the fingerprints of the stages that write it (and
+of the stages these depend on, see `data_generator.pipeline`). The manifest records
+the seed, the person ids and the fingerprint of each table of the last run. A rerun
+with `--incremental` only regenerates (and replaces) the tables whose fingerprint
+changed; since every stage draws from its own random number stream, the unchanged
+stages of the regenerated tables yield exactly the same rows as before. The window of
+visit dates ends on the day of a run (`params.VISIT_END_DATE`); it is therefore not
+part of the fingerprints, but recorded in the manifest and reused by the rerun.
+
+Functions are fingerprinted by their compiled code (including constants and default
+arguments), i.e. changes of comments or formatting do not change the fingerprint.
+"""
+import dataclasses
+import datetime
+import hashlib
+import json
+import os
+import types
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from omop.constants import TABLE_NAMES
+
+DEFAULT_MANIFEST_FILE = ".manifest.json"
+MANIFEST_FILE_NAME = "manifest.json"  # within the output directory of FileSink
+
+
+def stage_inputs() -> Tuple[List[Any], Dict[str, List[Any]]]:
+    """
+    Return the code used by all stages and the code and parameters used by each stage
+
+    (The generator is imported here, such that this module can be used before the row
+    classes are configured and without loading numpy.)
+    """
+    from data_generator import criteria, generator
+    from data_generator import parameter as params
+    from data_generator import pipeline, streams, timeseries
+    from omop import tables
+
+    common = [
+        streams.stage_rng,
+        pipeline.generate_patient,
+        params.CategoricalSampler,
+        generator.random_choice,
+        tables.random_date,
+        tables.random_datetime,
+    ]
+
+    stages: Dict[str, List[Any]] = {
+        "person": [generator.create_person, params.GENDER_LIST],
+        "visit": [
+            generator.create_visit,
+            params.VISIT_CONCEPTS,
+            params.VISIT_DAYS,
+        ],
+        "drugs": [
+            generator.drug_exposure_columns,
+            params.DRUG_LIST,
+            params.DRUG_DOSING,
+        ],
+        "ventilation_procedure": [
+            generator.create_vent_params_procedure,
+            params.VENTILATION_BIN,
+        ],
+        "ventilation_measurements": [
+            generator.create_vent_params_measurements,
+            params.VENTILATION_BIN,
+            params.VENTILATION_PARAMS,
+            timeseries.ar1,
+            timeseries.ventilation_series,
+            params.VENTILATION_SAMPLING_INTERVAL,
+            params.VENTILATION_SERIES,
+        ],
+        "lab_values": [
+            generator.lab_values_columns,
+            params.LABORATORY_LIST,
+        ],
+        "prone_positioning": [generator.create_prone_positioning_procedure],
+        "conditions": [
+            generator.create_cond,
+            params.CONDITION_LIST,
+            params.COND_WEIGHTS,
+        ],
+        "observations": [
+            generator.create_obs,
+            params.OBSERVATION_LIST,
+            params.OBS_WEIGHTS,
+        ],
+        "weight": [generator.create_weight_measurements, params.WEIGHT],
+        "criteria": [criteria.case_row, criteria.case_value, criteria.Criterion],
+    }
+
+    return common, stages
+
+
+def _describe(obj: Any) -> str:
+    """
+    Return a description of code or parameters that changes whenever they change
+    """
+    import numpy as np
+
+    if isinstance(obj, dict):
+        items = sorted((_describe(k), _describe(v)) for k, v in obj.items())
+        return "{" + ",".join(f"{k}:{v}" for k, v in items) + "}"
+    if isinstance(obj, (list, tuple)):
+        return "[" + ",".join(_describe(v) for v in obj) + "]"
+    if isinstance(obj, (set, frozenset)):
+        return "{" + ",".join(sorted(_describe(v) for v in obj)) + "}"
+    if isinstance(obj, np.ndarray):
+        return f"array({obj.dtype},{obj.tolist()!r})"
+    if isinstance(obj, types.CodeType):
+        consts = ",".join(_describe(c) for c in obj.co_consts)
+        return f"code({obj.co_code.hex()},{obj.co_names!r},[{consts}])"
+    if isinstance(obj, types.FunctionType):
+        return (
+            f"function({_describe(obj.__code__)},"
+            f"{_describe(obj.__defaults__)},{_describe(obj.__kwdefaults__)})"
+        )
+    if isinstance(obj, type):
+        members = {
+            name: member
+            for name, member in vars(obj).items()
+            if isinstance(member, (types.FunctionType, property))
+            or not name.startswith("__")
+        }
+        return f"class({obj.__name__},{_describe(members)})"
+    if isinstance(obj, property):
+        return f"property({_describe(obj.fget)})"
+    if (
+        isinstance(
+            obj, (range, datetime.date, int, float, complex, str, bytes, type(None))
+        )
+        or obj is Ellipsis
+    ):
+        return repr(obj)
+
+    raise TypeError(f"Cannot fingerprint {type(obj)}")
+
+
+def _hash(*parts: str) -> str:
+    return hashlib.sha256("\n".join(parts).encode()).hexdigest()
+
+
+def stage_fingerprints() -> Dict[str, str]:
+    """
+    Return the fingerprint of each stage (including the stages it depends on)
+    """
+    from data_generator.pipeline import STAGE_DEPENDENCIES
+    from data_generator.streams import STAGES
+
+    common_inputs, inputs = stage_inputs()
+    common = _describe(common_inputs)
+    fingerprints: Dict[str, str] = {}
+
+    def fingerprint(stage: str) -> str:
+        if stage not in fingerprints:
+            dependencies = STAGE_DEPENDENCIES.get(stage, ())
+            fingerprints[stage] = _hash(
+                stage,
+                common,
+                _describe(inputs[stage]),
+                *(fingerprint(d) for d in sorted(dependencies)),
+            )
+        return fingerprints[stage]
+
+    for stage in STAGES:
+        fingerprint(stage)
+
+    return fingerprints
+
+
+def table_fingerprints() -> Dict[str, str]:
+    """
+    Return the fingerprint of each table
+    """
+    from data_generator.pipeline import STAGE_TABLES
+    from omop.tables import TABLES
+
+    stages = stage_fingerprints()
+
+    return {
+        table: _hash(
+            table,
+            _describe(cls),
+            *(
+                stages[stage]
+                for stage in sorted(stages)
+                if STAGE_TABLES.get(stage) == table
+            ),
+        )
+        for table, cls in TABLES.items()
+    }
+
+
+@dataclasses.dataclass
+class Manifest:
+    """
+    Seed, person ids and table fingerprints of a generation run
+    """
+
+    seed: int
+    first_person_id: int
+    n_person: int
+    tables: Dict[str, str]
+    # format of the files of a run written with FileSink (None: written to the database)
+    file_format: Optional[str] = None
+    # last day of the visit window of the run (ISO format, see params.VISIT_END_DATE)
+    visit_end_date: Optional[str] = None
+
+    @property
+    def person_ids(self) -> range:
+        """
+        Return all person ids of the run
+        """
+        return range(self.first_person_id, self.first_person_id + self.n_person)
+
+    def changed_tables(self, fingerprints: Dict[str, str]) -> List[str]:
+        """
+        Return the tables (in load order) whose fingerprint differs from `fingerprints`.
+
+        If the person table changed, all tables are returned, because the rows of the
+        other tables must be deleted before the persons can be replaced.
+        """
+        changed = [
+            table
+            for table in TABLE_NAMES
+            if self.tables.get(table) != fingerprints.get(table)
+        ]
+        if "person" in changed:
+            return list(TABLE_NAMES)
+        return changed
+
+    def save(self, path: Union[str, Path]) -> None:
+        """
+        Write the manifest to a file (atomically, i.e. the file is never left incomplete)
+        """
+        tmp = Path(f"{path}.tmp")
+        tmp.write_text(json.dumps(dataclasses.asdict(self), indent=2))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "Manifest":
+        """
+        Read a manifest from a file
+        """
+        return cls(**json.loads(Path(path).read_text()))
@@ -0,0 +1,628 @@
+"""
+Expected results of criteria on generated data.
+
+The execution engine evaluates the criteria of the recommendations on the CDM and
+returns, for each person, the intervals in which they hold. This module computes the
+same results directly from the generated rows, such that the output of the engine can
+be compared with them automatically:
+
+    python -m data_generator.oracle data --format parquet
+
+writes `data/expected/intervals.parquet` (criterion, person_id, interval_start,
+interval_end) and `data/expected/persons.parquet` (criterion, person_id, satisfied for
+every person of the run).
+
+A criterion (`data_generator.criteria.Criterion`) holds during each row of its table
+with its concept, a value in its value range (`value_as_number` of measurements,
+`quantity` of drug exposures) and a start within its time window (hours after the
+start of a visit). Intervals are closed; rows without an end (measurements,
+observations) are points. A `Combination` holds in the intervals in which all (or any)
+of its criteria hold, e.g. a Horowitz index below 150 mmHg while ventilated and under
+heparin (`DEFAULT_COMBINATIONS`).
+
+All persons are laid out one after another on a single time axis (`Timeline`), such
+that the intervals of all persons are sorted arrays of one dimension and each operation
+on them (merging, intersection, union, point lookup) is a sort or a binary search over
+all persons at once.
+"""
+import argparse
+import dataclasses
+import json
+import logging
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from data_generator.criteria import Criterion
+from omop import concepts
+from omop.constants import FILE_FORMATS
+from omop.reader import Columns, database_batches, file_batches
+
+# reads the given columns of a table in batches (see `omop.reader`)
+Batches = Callable[[str, Sequence[str]], Iterable[Columns]]
+
+DEFAULT_OUTPUT_DIR = "expected"
+
+ALL = "all"
+ANY = "any"
+
+# concept, start, end and value columns of the tables of criteria
+EVENT_COLUMNS: Dict[str, Tuple[str, str, Optional[str], Optional[str]]] = {
+    "measurement": (
+        "measurement_concept_id",
+        "measurement_datetime",
+        None,
+        "value_as_number",
+    ),
+    "drug_exposure": (
+        "drug_concept_id",
+        "drug_exposure_start_datetime",
+        "drug_exposure_end_datetime",
+        "quantity",
+    ),
+    "procedure_occurrence": (
+        "procedure_concept_id",
+        "procedure_datetime",
+        "procedure_end_datetime",
+        None,
+    ),
+    "condition_occurrence": (
+        "condition_concept_id",
+        "condition_start_datetime",
+        "condition_end_datetime",
+        None,
+    ),
+    "observation": ("observation_concept_id", "observation_datetime", None, None),
+}
+
+MICROSECONDS_PER_HOUR = 3_600_000_000
+
+
+@dataclasses.dataclass
+class Combination:
+    """
+    Criteria (or combinations) that hold in the same interval (ALL) or of which any
+    holds (ANY)
+    """
+
+    name: str
+    operator: str
+    criteria: List[str]
+
+
+DEFAULT_CRITERIA = [
+    Criterion(
+        name="ventilated",
+        source="",
+        table="procedure_occurrence",
+        concept_id=concepts.ARTIFICIAL_RESPIRATION,
+    ),
+    Criterion(
+        name="prone_positioning",
+        source="",
+        table="procedure_occurrence",
+        concept_id=concepts.PRONE_POSITIONING,
+    ),
+    Criterion(
+        name="horowitz_below_150",
+        source="",
+        table="measurement",
+        concept_id=concepts.LAB_HOROWITZ,
+        value_high=150,
+        high_inclusive=False,
+    ),
+    Criterion(
+        name="heparin",
+        source="",
+        table="drug_exposure",
+        concept_id=concepts.HEPARIN,
+    ),
+]
+
+DEFAULT_COMBINATIONS = [
+    Combination(
+        name="horowitz_below_150_ventilated_heparin",
+        operator=ALL,
+        criteria=["horowitz_below_150", "ventilated", "heparin"],
+    ),
+    Combination(
+        name="horowitz_below_150_prone_positioning",
+        operator=ALL,
+        criteria=["horowitz_below_150", "prone_positioning"],
+    ),
+]
+
+
+class Timeline:
+    """
+    Time axis (int64 microseconds) on which the time span of each person (from its first
+    to its last time) follows that of the previous person, with a gap. Intervals of
+    different persons thus never overlap or touch.
+    """
+
+    def __init__(
+        self, person_id: np.ndarray, first: np.ndarray, last: np.ndarray
+    ) -> None:
+        # person_id: sorted and unique; first and last time of each person
+        self.person_id = person_id
+        self.first = first.astype("datetime64[us]").view(np.int64)
+        self.span = last.astype("datetime64[us]").view(np.int64) - self.first + 1
+        self.offset = np.cumsum(self.span + 1) - (self.span + 1)
+        if len(person_id) and self.offset[-1] + self.span[-1] >= 2**62:
+            raise ValueError("Time spans of the persons are too long for the timeline")
+
+    @classmethod
+    def build(
+        cls, person_ids: Sequence[np.ndarray], times: Sequence[np.ndarray]
+    ) -> "Timeline":
+        """
+        Create the timeline of persons from times of the persons (pairs of arrays of
+        person ids and times, missing times are ignored)
+        """
+        person_id = np.unique(np.concatenate(person_ids))
+        first = np.full(len(person_id), np.iinfo(np.int64).max)
+        last = np.full(len(person_id), np.iinfo(np.int64).min)
+        for ids, t in zip(person_ids, times):
+            known = ~np.isnat(t)
+            rank = np.searchsorted(person_id, ids[known])
+            microseconds = t[known].astype("datetime64[us]").view(np.int64)
+            np.minimum.at(first, rank, microseconds)
+            np.maximum.at(last, rank, microseconds)
+        # persons without any time
+        missing = first > last
+        first[missing] = last[missing] = 0
+        return cls(person_id, first.view("datetime64[us]"), last.view("datetime64[us]"))
+
+    def position(self, person_id: np.ndarray, times: np.ndarray) -> np.ndarray:
+        """
+        Return the positions of times of persons on the timeline (the times must lie
+        within the span of the persons)
+        """
+        rank = np.searchsorted(self.person_id, person_id)
+        microseconds = times.astype("datetime64[us]").view(np.int64)
+        return microseconds - self.first[rank] + self.offset[rank]
+
+    def bounds(self, person_id: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return the first and last position of the span of each person
+        """
+        rank = np.searchsorted(self.person_id, person_id)
+        return self.offset[rank], self.offset[rank] + self.span[rank] - 1
+
+    def times(self, position: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return the persons and times of positions on the timeline
+        """
+        rank = np.searchsorted(self.offset, position, "right") - 1
+        microseconds = position - self.offset[rank] + self.first[rank]
+        return self.person_id[rank], microseconds.view("datetime64[us]")
+
+
+@dataclasses.dataclass
+class Intervals:
+    """
+    Disjoint closed intervals on a timeline, sorted by start
+    """
+
+    start: np.ndarray
+    end: np.ndarray
+
+    def __len__(self) -> int:
+        """
+        Return the number of intervals
+        """
+        return len(self.start)
+
+    @classmethod
+    def merge(cls, start: np.ndarray, end: np.ndarray) -> "Intervals":
+        """
+        Create the intervals of the union of (unsorted, possibly overlapping)
+        intervals: an interval begins where a start lies after the ends of all
+        intervals that start before it
+        """
+        if len(start) == 0:
+            return cls(start.astype(np.int64), end.astype(np.int64))
+        order = np.argsort(start, kind="stable")
+        start, end = start[order], np.maximum.accumulate(end[order])
+        begin = np.flatnonzero(np.r_[True, start[1:] > end[:-1]])
+        last = np.r_[begin[1:] - 1, len(start) - 1]
+        return cls(start[begin], end[last])
+
+    def contains(self, position: np.ndarray) -> np.ndarray:
+        """
+        Return whether the positions lie in any of the intervals
+        """
+        index = np.searchsorted(self.start, position, "right") - 1
+        return (index >= 0) & (position <= self.end[np.maximum(index, 0)])
+
+
+def combine(intervals: Sequence[Intervals], required: int) -> Intervals:
+    """
+    Return the intervals in which at least `required` of the interval sets hold (all:
+    intersection, 1: union).
+
+    The starts (+1) and ends (-1) of all sets are swept in the order of time, starts
+    before ends at the same time (closed intervals). As the intervals of each set are
+    disjoint, the running sum is the number of sets that hold between two successive
+    endpoints.
+    """
+    times = np.concatenate([i.start for i in intervals] + [i.end for i in intervals])
+    n_starts = sum(len(i) for i in intervals)
+    delta = np.where(np.arange(len(times)) < n_starts, 1, -1)
+
+    order = np.lexsort((-delta, times))
+    times = times[order]
+    count = np.cumsum(delta[order])
+
+    covered = np.flatnonzero(count[:-1] >= required)
+    return Intervals.merge(times[covered], times[covered + 1])
+
+
+def _contains_value(criterion: Criterion, value: np.ndarray) -> np.ndarray:
+    """
+    Return whether the values lie in the value range of the criterion (vectorized
+    `Criterion.contains`, missing values do not)
+    """
+    mask = ~np.isnan(value)
+    if criterion.value_low is not None:
+        if criterion.low_inclusive:
+            mask &= value >= criterion.value_low
+        else:
+            mask &= value > criterion.value_low
+    if criterion.value_high is not None:
+        if criterion.high_inclusive:
+            mask &= value <= criterion.value_high
+        else:
+            mask &= value < criterion.value_high
+    return mask
+
+
+def load_events(batches: Batches, criteria: Sequence[Criterion]) -> Dict[str, Columns]:
+    """
+    Read the rows of the concepts of the criteria (person_id, concept_id, start, end
+    and value) of each table
+    """
+    events = {}
+
+    for table, (concept, start, end, value) in EVENT_COLUMNS.items():
+        concept_ids = np.array(
+            sorted({c.concept_id for c in criteria if c.table == table}),
+            dtype=np.int64,
+        )
+        if len(concept_ids) == 0:
+            continue
+
+        columns = ["person_id", concept, start]
+        columns += [c for c in (end, value) if c is not None]
+        parts: Dict[str, List[np.ndarray]] = {c: [] for c in columns}
+        for batch in batches(table, columns):
+            rows = np.isin(batch[concept], concept_ids) & ~np.isnat(batch[start])
+            for c in columns:
+                parts[c].append(batch[c][rows])
+
+        data = {c: np.concatenate(p) if p else np.empty(0) for c, p in parts.items()}
+        person_id = data["person_id"].astype(np.int64)
+        start_datetime = data[start].astype("datetime64[us]")
+        end_datetime = start_datetime
+        if end is not None:
+            end_datetime = data[end].astype("datetime64[us]")
+            # missing or earlier ends: the row is a point in time
+            end_datetime = np.where(
+                np.isnat(end_datetime) | (end_datetime < start_datetime),
+                start_datetime,
+                end_datetime,
+            )
+        events[table] = {
+            "person_id": person_id,
+            "concept_id": data[concept].astype(np.int64),
+            "start": start_datetime,
+            "end": end_datetime,
+            "value": (
+                data[value].astype(np.float64)
+                if value is not None
+                else np.full(len(person_id), np.nan)
+            ),
+        }
+
+    return events
+
+
+def load_visits(batches: Batches) -> Columns:
+    """
+    Read the person and start of the visits (the start of the day, if the datetime is
+    missing)
+    """
+    columns = ["person_id", "visit_start_date", "visit_start_datetime"]
+    parts = list(batches("visit_occurrence", columns))
+    if not parts:
+        return {
+            "person_id": np.empty(0, dtype=np.int64),
+            "start": np.empty(0, dtype="datetime64[us]"),
+        }
+    data = {c: np.concatenate([p[c] for p in parts]) for c in columns}
+    start = data["visit_start_datetime"].astype("datetime64[us]")
+    start = np.where(
+        np.isnat(start), data["visit_start_date"].astype("datetime64[us]"), start
+    )
+    return {"person_id": data["person_id"].astype(np.int64), "start": start}
+
+
+def load_persons(batches: Batches) -> np.ndarray:
+    """
+    Read the ids of all persons
+    """
+    parts = [b["person_id"] for b in batches("person", ["person_id"])]
+    if not parts:
+        return np.empty(0, dtype=np.int64)
+    return np.unique(np.concatenate(parts)).astype(np.int64)
+
+
+class Oracle:
+    """
+    Evaluates criteria and combinations of criteria on the rows of a run
+    """
+
+    def __init__(
+        self,
+        criteria: Sequence[Criterion] = DEFAULT_CRITERIA,
+        combinations: Sequence[Combination] = DEFAULT_COMBINATIONS,
+    ) -> None:
+        self.criteria = {c.name: c for c in criteria}
+        self.combinations = {c.name: c for c in combinations}
+
+        if len(self.criteria) != len(criteria):
+            raise ValueError("The names of the criteria are not unique")
+        for combination in combinations:
+            if combination.name in self.criteria:
+                raise ValueError(f"{combination.name} is a criterion and a combination")
+            if combination.operator not in (ALL, ANY):
+                raise ValueError(f"Unknown operator {combination.operator}")
+            for name in combination.criteria:
+                if name not in self.criteria and name not in self.combinations:
+                    raise ValueError(f"Unknown criterion {name} in {combination.name}")
+
+    def evaluate(self, batches: Batches) -> Tuple[Columns, Columns]:
+        """
+        Evaluate all criteria and combinations and return the intervals (criterion,
+        person_id, interval_start, interval_end) and the results per person
+        (criterion, person_id, satisfied) as columns
+        """
+        persons = load_persons(batches)
+        visits = load_visits(batches)
+        events = load_events(batches, list(self.criteria.values()))
+        logging.info(
+            f"Read {len(persons):,} persons, {len(visits['person_id']):,} visits and "
+            f"{sum(len(e['person_id']) for e in events.values()):,} rows of criteria"
+        )
+
+        timeline = Timeline.build(
+            [persons, visits["person_id"]]
+            + [e["person_id"] for e in events.values()] * 2,
+            [np.full(len(persons), np.datetime64("NaT", "us")), visits["start"]]
+            + [e["start"] for e in events.values()]
+            + [e["end"] for e in events.values()],
+        )
+
+        results: Dict[str, Intervals] = {}
+        for name, criterion in self.criteria.items():
+            results[name] = self._criterion(criterion, events, visits, timeline)
+        for name in self.combinations:
+            self._combination(name, results)
+
+        return self._columns(results, timeline, persons)
+
+    def _criterion(
+        self,
+        criterion: Criterion,
+        events: Dict[str, Columns],
+        visits: Columns,
+        timeline: Timeline,
+    ) -> Intervals:
+        if criterion.table not in EVENT_COLUMNS:
+            raise ValueError(f"Unknown table {criterion.table} of {criterion.name}")
+        rows = events[criterion.table]
+
+        mask = rows["concept_id"] == criterion.concept_id
+        if criterion.has_value:
+            mask &= _contains_value(criterion, rows["value"])
+
+        person_id = rows["person_id"][mask]
+        start = timeline.position(person_id, rows["start"][mask])
+        end = timeline.position(person_id, rows["end"][mask])
+
+        if criterion.has_window:
+            window = self._window(criterion, visits, timeline)
+            inside = window.contains(start)
+            start, end = start[inside], end[inside]
+
+        return Intervals.merge(start, end)
+
+    def _window(
+        self, criterion: Criterion, visits: Columns, timeline: Timeline
+    ) -> Intervals:
+        """
+        Return the time windows of a criterion (hours after the start of each visit)
+        """
+        person_id = visits["person_id"]
+        visit_start = timeline.position(person_id, visits["start"])
+        start = visit_start + round(
+            (criterion.window_start or 0.0) * MICROSECONDS_PER_HOUR
+        )
+        if criterion.window_end is None:
+            end = np.full(len(person_id), np.iinfo(np.int64).max // 2)
+        else:
+            end = visit_start + round(criterion.window_end * MICROSECONDS_PER_HOUR)
+        # windows are clipped to the span of the person (without events outside of
+        # it, the result is the same)
+        first, last = timeline.bounds(person_id)
+        valid = (start <= end) & (start <= last) & (end >= first)
+        return Intervals.merge(
+            np.maximum(start, first)[valid], np.minimum(end, last)[valid]
+        )
+
+    def _combination(self, name: str, results: Dict[str, Intervals]) -> Intervals:
+        if name not in results:
+            combination = self.combinations[name]
+            parts = [
+                results[c] if c in results else self._combination(c, results)
+                for c in combination.criteria
+            ]
+            required = len(parts) if combination.operator == ALL else 1
+            results[name] = combine(parts, required)
+        return results[name]
+
+    def _columns(
+        self, results: Dict[str, Intervals], timeline: Timeline, persons: np.ndarray
+    ) -> Tuple[Columns, Columns]:
+        names = list(self.criteria) + list(self.combinations)
+
+        person_id, interval_start, interval_end, criterion = [], [], [], []
+        satisfied = []
+        for name in names:
+            intervals = results[name]
+            ids, start = timeline.times(intervals.start)
+            _, end = timeline.times(intervals.end)
+            person_id.append(ids)
+            interval_start.append(start)
+            interval_end.append(end)
+            criterion.append(np.full(len(ids), name, dtype=object))
+            satisfied.append(np.isin(persons, ids))
+
+        intervals_columns = {
+            "criterion": np.concatenate(criterion),
+            "person_id": np.concatenate(person_id),
+            "interval_start": np.concatenate(interval_start),
+            "interval_end": np.concatenate(interval_end),
+        }
+        person_columns = {
+            "criterion": np.repeat(np.array(names, dtype=object), len(persons)),
+            "person_id": np.tile(persons, len(names)),
+            "satisfied": np.concatenate(satisfied),
+        }
+        return intervals_columns, person_columns
+
+
+def load_criteria(path: Union[str, Path]) -> Tuple[List[Criterion], List[Combination]]:
+    """
+    Load criteria and combinations from a JSON file with the lists "criteria" (fields of
+    `Criterion`, e.g. the criteria file of a recommendation-driven run, see
+    `data_generator.criteria.CriteriaPlan`) and "combinations" (optional)
+    """
+    data = json.loads(Path(path).read_text())
+    criteria = [Criterion(**c) for c in data["criteria"]]
+
+    # criteria of the recommendations may share a name
+    seen: Dict[str, int] = {}
+    for criterion in criteria:
+        n = seen.get(criterion.name, 0)
+        seen[criterion.name] = n + 1
+        if n:
+            criterion.name = f"{criterion.name} ({n + 1})"
+
+    combinations = [Combination(**c) for c in data.get("combinations", [])]
+    return criteria, combinations
+
+
+def write_results(
+    directory: Union[str, Path],
+    intervals: Columns,
+    persons: Columns,
+    file_format: str = "parquet",
+) -> List[Path]:
+    """
+    Write the expected intervals and results per person to `directory` (as
+    `intervals.parquet` and `persons.parquet`, or gzip compressed CSV files)
+    """
+    import pyarrow as pa
+    import pyarrow.csv as pv
+    import pyarrow.parquet as pq
+
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    suffix = "parquet" if file_format == "parquet" else "csv.gz"
+
+    paths = []
+    for name, columns in (("intervals", intervals), ("persons", persons)):
+        table = pa.table(
+            {
+                column: pa.array(
+                    data, type=pa.string() if data.dtype == object else None
+                )
+                for column, data in columns.items()
+            }
+        )
+        path = directory / f"{name}.{suffix}"
+        if file_format == "parquet":
+            pq.write_table(table, path)
+        else:
+            with pa.CompressedOutputStream(str(path), "gzip") as f:
+                pv.write_csv(table, f)
+        paths.append(path)
+
+    return paths
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO
+    )
+
+    parser = argparse.ArgumentParser(
+        description="Compute the expected results of criteria on generated data"
+    )
+    parser.add_argument(
+        "directory",
+        nargs="?",
+        help="Output directory of the generator (default: read the database)",
+    )
+    parser.add_argument(
+        "--format",
+        help="File format of the data and the results (default: parquet)",
+        choices=FILE_FORMATS,
+        default="parquet",
+    )
+    parser.add_argument(
+        "--criteria",
+        help="JSON file with the criteria and combinations, e.g. the criteria file of "
+        "a run with --recommendations (default: DEFAULT_CRITERIA and "
+        "DEFAULT_COMBINATIONS)",
+    )
+    parser.add_argument(
+        "--output-dir",
+        help=f"Directory of the results (default: {DEFAULT_OUTPUT_DIR} in the "
+        "directory of the data)",
+    )
+    args = parser.parse_args()
+
+    if args.criteria is not None:
+        oracle = Oracle(*load_criteria(args.criteria))
+    else:
+        oracle = Oracle()
+
+    start = time.perf_counter()
+    if args.directory is not None:
+
+        def batches(table: str, columns: Sequence[str]) -> Iterable[Columns]:
+            return file_batches(args.directory, table, columns, args.format)
+
+        intervals, persons = oracle.evaluate(batches)
+        output_dir = args.output_dir or Path(args.directory) / DEFAULT_OUTPUT_DIR
+    else:
+        # .credentials.json in the working directory, as for the generator
+        from random_data_generator import connect_db
+
+        with connect_db() as con, con.cursor() as cursor:
+            intervals, persons = oracle.evaluate(
+                lambda table, columns: database_batches(cursor, table, columns)
+            )
+        output_dir = args.output_dir or DEFAULT_OUTPUT_DIR
+
+    for path in write_results(output_dir, intervals, persons, args.format):
+        logging.info(f"Wrote {path}")
+    logging.info(
+        f"Evaluated {len(oracle.criteria) + len(oracle.combinations)} criteria "
+        f"({len(intervals['person_id']):,} intervals) in "
+        f"{time.perf_counter() - start:.1f} s"
+    )
@@ -2,7 +2,8 @@
 Parameter configuration for data generation.
 """
 import datetime
-from typing import Callable, Final, TypedDict
+import os
+from typing import Any, Callable, Dict, Final, Iterable, Optional, Sequence, TypedDict
 
 import numpy as np
 
@@ -10,11 +11,18 @@ from omop import concepts
 
 BIRTHYEAR_RANGE = range(1920, 2003)
 
-# regarding visits, creating a list of all dates from 2020 and 2021
-VISIT_START_DATE = datetime.datetime.today() - datetime.timedelta(
-    days=7
+# regarding visits, creating a list of all dates of the last VISIT_DAYS days (the window
+# ends today, unless the end date of a previous run is given in OMOP_VISIT_END_DATE, such
+# that its tables can be regenerated or its generation continued on another day)
+VISIT_DAYS = 7
+VISIT_END_DATE = (
+    datetime.date.fromisoformat(os.environ["OMOP_VISIT_END_DATE"])
+    if os.environ.get("OMOP_VISIT_END_DATE")
+    else datetime.date.today()
+)  # datetime.date(2021, 12, 31)
+VISIT_START_DATE = VISIT_END_DATE - datetime.timedelta(
+    days=VISIT_DAYS
 )  # datetime.date(2020, 1, 1)
-VISIT_END_DATE = datetime.datetime.today()  # datetime.date(2021, 12, 31)
 
 
 # regarding person
@@ -27,7 +35,10 @@ GENDER_LIST = {
 class ParameterGenerator(TypedDict):
     """
     Helper class for type hinting a dictionary that contains
-    name, unit and a function to generate a random value.
+    name, unit and a function to generate random values.
+
+    `sample_func(rng, size=None)` draws from the random number generator `rng` and
+    returns a single value if `size` is None and an array of `size` values otherwise.
     """
 
     name: str
@@ -40,24 +51,32 @@ WEIGHT: dict[int, dict[int, ParameterGenerator]] = {
         concepts.WEIGHT: {
             "name": "Weight",
             "unit": concepts.UNIT_KG,
-            "sample_func": lambda: np.random.normal(loc=100, scale=15),
+            "sample_func": lambda rng, size=None: rng.normal(
+                loc=100, scale=15, size=size
+            ),
         },
         concepts.IDEAL_BODY_WEIGHT: {
             "name": "Ideal Body Weight",
             "unit": concepts.UNIT_KG,
-            "sample_func": lambda: np.random.normal(loc=80, scale=5),
+            "sample_func": lambda rng, size=None: rng.normal(
+                loc=80, scale=5, size=size
+            ),
         },
     },
     concepts.GENDER_FEMALE: {
         concepts.WEIGHT: {
             "name": "Weight",
             "unit": concepts.UNIT_KG,
-            "sample_func": lambda: np.random.normal(loc=80, scale=15),
+            "sample_func": lambda rng, size=None: rng.normal(
+                loc=80, scale=15, size=size
+            ),
         },
         concepts.IDEAL_BODY_WEIGHT: {
             "name": "Ideal Body Weight",
             "unit": concepts.UNIT_KG,
-            "sample_func": lambda: np.random.normal(loc=60, scale=5),
+            "sample_func": lambda rng, size=None: rng.normal(
+                loc=60, scale=5, size=size
+            ),
         },
     },
 }
@@ -85,21 +104,21 @@ OBSERVATION_LIST = {
     concepts.ALLERGY_HEPARINOID: "Allergy to heparinoid",
 }
 
-LABORATORY_LIST = {
+LABORATORY_LIST: dict[int, ParameterGenerator] = {
     concepts.LAB_DDIMER: {
         "name": "Fibrin D-dimer DDU [Mass/volume] in Platelet poor plasma",
         "unit": concepts.UNIT_UG_PER_L,
-        "sample_func": lambda: np.random.binomial(40, 0.45) / 10,
+        "sample_func": lambda rng, size=None: rng.binomial(40, 0.45, size=size) / 10,
     },
     concepts.LAB_APTT: {
         "name": "aPTT in Blood by Coagulation assay",
         "unit": concepts.UNIT_SECOND,
-        "sample_func": lambda: np.random.normal(loc=50, scale=10),
+        "sample_func": lambda rng, size=None: rng.normal(loc=50, scale=10, size=size),
     },
     concepts.LAB_HOROWITZ: {
         "name": "Horowitz index in Arterial blood",
         "unit": concepts.UNIT_MM_HG,
-        "sample_func": lambda: np.random.normal(loc=200, scale=50),
+        "sample_func": lambda rng, size=None: rng.normal(loc=200, scale=50, size=size),
     },
 }
 
@@ -121,6 +140,69 @@ DRUG_LIST = {
     concepts.FONDAPARINUX: "fondaparinux",
 }
 
+
+class DrugDosing(TypedDict):
+    """
+    Helper class for type hinting the dosing of a drug.
+
+    A drug is either given as continuous infusion with changing rates (`dose` per hour
+    for `duration_hours`) or as boluses (`dose` each, `duration_hours` is zero). Each
+    administration starts `gap_hours` after the end of the previous one.
+    """
+
+    continuous: bool
+    dose: range
+    gap_hours: range
+    duration_hours: range
+
+
+DRUG_DOSING: Dict[int, DrugDosing] = {
+    # IE/h
+    concepts.HEPARIN: {
+        "continuous": True,
+        "dose": range(200, 900, 100),
+        "gap_hours": range(2),
+        "duration_hours": range(1, 12),
+    },
+    # mg/h
+    concepts.ARGATROBAN: {
+        "continuous": True,
+        "dose": range(5, 10, 1),
+        "gap_hours": range(2),
+        "duration_hours": range(1, 12),
+    },
+    concepts.DALTEPARIN: {
+        "continuous": False,
+        "dose": range(3000, 15000, 1000),
+        "gap_hours": range(4, 20),
+        "duration_hours": range(1),
+    },
+    concepts.NADROPARIN: {
+        "continuous": False,
+        "dose": range(3000, 15000, 1000),
+        "gap_hours": range(4, 20),
+        "duration_hours": range(1),
+    },
+    concepts.CERTOPARIN: {
+        "continuous": False,
+        "dose": range(1000, 4000, 500),
+        "gap_hours": range(4, 20),
+        "duration_hours": range(1),
+    },
+    concepts.ENOXAPARIN: {
+        "continuous": False,
+        "dose": range(10, 120, 10),
+        "gap_hours": range(4, 20),
+        "duration_hours": range(1),
+    },
+    concepts.FONDAPARINUX: {
+        "continuous": False,
+        "dose": range(1, 4, 1),
+        "gap_hours": range(4, 20),
+        "duration_hours": range(1),
+    },
+}
+
 VISIT_CONCEPTS = {
     concepts.INPATIENT_VISIT: "Inpatient visit",
     concepts.INTENSIVE_CARE: "Intensive care",
@@ -145,3 +227,209 @@ VENTILATION_PARAMS = {
 }
 COND_WEIGHTS: Final = [0.3, 0.1, 0.05, 0.15, 0.15, 0.25]
 OBS_WEIGHTS: Final = [0.7, 0.3]
+
+
+class SeriesParameter(TypedDict):
+    """
+    Helper class for type hinting the parameters of a ventilator time series.
+
+    Values fluctuate around `mean` with standard deviation `sd` and are autocorrelated
+    with correlation time `tau_hours` (i.e. the correlation of two values decays as
+    exp(-dt / tau_hours)). They are rounded to multiples of `step` and clipped to
+    [`minimum`, `maximum`].
+    """
+
+    unit: int
+    mean: float
+    sd: float
+    tau_hours: float
+    step: float
+    minimum: float
+    maximum: float
+
+
+# minutes between the values of the ventilator time series (see data_generator.timeseries);
+# if not set, ventilation parameters are created 24 (oxygen therapy: 2) times per day
+VENTILATION_SAMPLING_INTERVAL: Optional[float] = (
+    float(os.environ["OMOP_VENTILATION_INTERVAL"])
+    if os.environ.get("OMOP_VENTILATION_INTERVAL")
+    else None
+)
+
+# bounds (and steps) as in VENTILATION_PARAMS
+VENTILATION_SERIES: dict[int, dict[int, SeriesParameter]] = {
+    concepts.ARTIFICIAL_RESPIRATION: {
+        concepts.INHALED_OXYGEN_CONCENTRATION: {
+            "unit": concepts.UNIT_PERCENT,
+            "mean": 50.0,
+            "sd": 15.0,
+            "tau_hours": 6.0,
+            "step": 5.0,
+            "minimum": 20.0,
+            "maximum": 95.0,
+        },
+        concepts.TIDAL_VOLUME: {
+            "unit": concepts.UNIT_ML,
+            "mean": 450.0,
+            "sd": 80.0,
+            "tau_hours": 2.0,
+            "step": 1.0,
+            "minimum": 200.0,
+            "maximum": 1199.0,
+        },
+        concepts.PRESSURE_MAX: {
+            "unit": concepts.UNIT_CM_H2O,
+            "mean": 25.0,
+            "sd": 5.0,
+            "tau_hours": 4.0,
+            "step": 1.0,
+            "minimum": 12.0,
+            "maximum": 39.0,
+        },
+        concepts.PEEP: {
+            "unit": concepts.UNIT_CM_H2O,
+            "mean": 16.0,
+            "sd": 4.0,
+            "tau_hours": 12.0,
+            "step": 1.0,
+            "minimum": 12.0,
+            "maximum": 39.0,
+        },
+    },
+    concepts.OXYGEN_THERAPY: {
+        concepts.INHALED_OXYGEN_CONCENTRATION: {
+            "unit": concepts.UNIT_PERCENT,
+            "mean": 30.0,
+            "sd": 5.0,
+            "tau_hours": 12.0,
+            "step": 5.0,
+            "minimum": 20.0,
+            "maximum": 45.0,
+        }
+    },
+}
+
+
+class CategoricalSampler:
+    """
+    Draws values with fixed weights (uniform, if no weights are given) using the alias method.
+
+    The alias table is built on the first draw; afterwards, each draw costs one uniform
+    random number and two array lookups, independent of the number of values. Draws
+    can be batched (`size`), also without replacement (`draw_distinct`).
+    """
+
+    def __init__(
+        self, values: Iterable[Any], weights: Optional[Sequence[float]] = None
+    ) -> None:
+        self.values = np.asarray(list(values))
+        self.weights = None if weights is None else np.asarray(weights, dtype=float)
+
+        if self.weights is not None and len(self.weights) != len(self.values):
+            raise ValueError("values and weights must have the same length")
+
+        self._prob: Optional[np.ndarray] = None
+        self._alias: Optional[np.ndarray] = None
+        # python lists of the same, for single draws without numpy overhead
+        self._table: list[tuple[float, int]] = []
+        self._value_list: list[Any] = self.values.tolist()
+
+    def __len__(self) -> int:
+        """
+        Return the number of values
+        """
+        return len(self.values)
+
+    def _build(self) -> None:
+        """
+        Build the alias table (Vose's method)
+        """
+        n = len(self.values)
+        weights = np.ones(n) if self.weights is None else self.weights
+        scaled = weights * (n / weights.sum())
+
+        prob = np.ones(n)
+        alias = np.arange(n)
+        small = [i for i in range(n) if scaled[i] < 1.0]
+        large = [i for i in range(n) if scaled[i] >= 1.0]
+
+        while small and large:
+            s, g = small.pop(), large.pop()
+            prob[s] = scaled[s]
+            alias[s] = g
+            scaled[g] -= 1.0 - scaled[s]
+            (small if scaled[g] < 1.0 else large).append(g)
+
+        self._prob = prob
+        self._alias = alias
+        self._table = list(zip(prob.tolist(), alias.tolist()))
+
+    def draw_index(self, rng: np.random.Generator, size: Optional[int] = None) -> Any:
+        """
+        Draw the index (or an array of `size` indices) of values
+        """
+        if self._prob is None:
+            self._build()
+        assert self._prob is not None and self._alias is not None
+
+        if size is None:
+            x = rng.random() * len(self._table)
+            j = int(x)
+            prob, alias = self._table[j]
+            return j if x - j < prob else alias
+
+        u = rng.random(size) * len(self.values)
+        i = u.astype(np.int64)
+        return np.where(u - i < self._prob[i], i, self._alias[i])
+
+    def draw(self, rng: np.random.Generator, size: Optional[int] = None) -> Any:
+        """
+        Draw a single value (or an array of `size` values)
+        """
+        index = self.draw_index(rng, size)
+        return self._value_list[index] if size is None else self.values[index]
+
+    def draw_distinct(
+        self, rng: np.random.Generator, k: int, size: Optional[int] = None
+    ) -> np.ndarray:
+        """
+        Draw `k` different values (or `size` rows of `k` different values each).
+
+        The values are drawn without replacement in proportion to their weights, i.e.
+        with the same distribution as `rng.choice(values, k, replace=False, p=weights)`
+        (using the exponential sort keys of Efraimidis and Spirakis, which allows to
+        draw for many patients at once).
+        """
+        if not 0 <= k <= len(self.values):
+            raise ValueError(f"k must be between 0 and {len(self.values)}")
+
+        n = 1 if size is None else size
+        weights = np.ones(len(self.values)) if self.weights is None else self.weights
+        keys = rng.standard_exponential((n, len(self.values))) / weights
+        index = np.argsort(keys, axis=1)[:, :k]
+
+        return self.values[index[0] if size is None else index]
+
+
+# weighted draws of the concepts above, see `sampler`
+_SAMPLER_SPECS: Dict[str, Callable[[], CategoricalSampler]] = {
+    "gender": lambda: CategoricalSampler(GENDER_LIST),
+    "visit_concept": lambda: CategoricalSampler(VISIT_CONCEPTS),
+    "ventilation": lambda: CategoricalSampler(VENTILATION_BIN),
+    "drug": lambda: CategoricalSampler(DRUG_LIST),
+    "condition": lambda: CategoricalSampler(CONDITION_LIST, COND_WEIGHTS),
+    "observation": lambda: CategoricalSampler(OBSERVATION_LIST, OBS_WEIGHTS),
+}
+
+SAMPLERS: Dict[str, CategoricalSampler] = {}
+
+
+def sampler(name: str) -> CategoricalSampler:
+    """
+    Return the sampler of the given name (created on first use)
+    """
+    if name not in SAMPLERS:
+        if name not in _SAMPLER_SPECS:
+            raise KeyError(f"Unknown sampler {name}")
+        SAMPLERS[name] = _SAMPLER_SPECS[name]()
+    return SAMPLERS[name]
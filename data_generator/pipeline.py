@@ -0,0 +1,440 @@
+"""
+Generation of complete patients, optionally distributed over several processes.
+
+Reproducibility does not depend on the order in which patients are generated: each
+patient and each generation stage draws from its own random number stream, derived
+from the run seed and the index of the patient within the run (see
+`data_generator.streams`). Thus, the same seed yields the same data regardless of the
+number of worker processes.
+
+Memory usage is bounded independently of the number of patients: patients are
+generated and passed on in chunks of about `batch_size` rows (with several worker
+processes, each chunk is a shard of as many patients as are expected to create
+`batch_size` rows, see `shard_size`) and at most `max_pending` shards are generated
+ahead of the consumer.
+"""
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import islice
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Collection,
+    Deque,
+    Dict,
+    Final,
+    FrozenSet,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
+import numpy as np
+
+from data_generator import parameter as params
+from data_generator.criteria import case_row
+from data_generator.generator import (
+    create_cond,
+    create_obs,
+    create_person,
+    create_prone_positioning_procedure,
+    create_vent_params_measurements,
+    create_vent_params_procedure,
+    create_visit,
+    create_weight_measurements,
+    drug_exposure_columns,
+    lab_values_columns,
+)
+from data_generator.instrumentation import STATS
+from data_generator.streams import STAGES, patient_streams
+from data_generator.timeseries import ventilation_series
+from omop.buffer import TableBuffer, create_buffers
+from omop.constants import DEFAULT_BATCH_SIZE
+
+if TYPE_CHECKING:
+    from data_generator.criteria import Case, CriteriaPlan, Criterion
+
+# table written by each generation stage
+STAGE_TABLES: Final = {
+    "person": "person",
+    "visit": "visit_occurrence",
+    "drugs": "drug_exposure",
+    "ventilation_procedure": "procedure_occurrence",
+    "ventilation_measurements": "measurement",
+    "lab_values": "measurement",
+    "prone_positioning": "procedure_occurrence",
+    "conditions": "condition_occurrence",
+    "observations": "observation",
+    "weight": "measurement",
+}
+
+# stages whose results are used by a stage
+STAGE_DEPENDENCIES: Final = {
+    "drugs": ("visit",),
+    "ventilation_procedure": ("visit",),
+    "ventilation_measurements": ("visit", "ventilation_procedure"),
+    "lab_values": ("visit",),
+    "prone_positioning": ("visit",),
+    "conditions": ("visit",),
+    "observations": ("visit",),
+    "weight": ("person", "visit"),
+    "criteria": ("visit",),
+}
+
+# stages of the patients of a recommendation-driven run (see data_generator.criteria),
+# which only consist of their person, their visit and the row of their case
+CRITERIA_STAGES: Final = frozenset({"person", "visit", "criteria"})
+
+
+def random_seed() -> int:
+    """
+    Return a fresh random seed (used if no seed is given by the user)
+    """
+    entropy = np.random.SeedSequence().entropy
+    assert isinstance(entropy, int)  # drawn from the OS if not given
+    return entropy % 2**63
+
+
+def required_stages(tables: Optional[Collection[str]] = None) -> FrozenSet[str]:
+    """
+    Return the stages that must be run to generate `tables` (all stages, if None),
+    including the stages whose results they use
+    """
+    if tables is None:
+        return frozenset(STAGES)
+
+    stages = set()
+    todo = [stage for stage, table in STAGE_TABLES.items() if table in tables]
+    while todo:
+        stage = todo.pop()
+        if stage not in stages:
+            stages.add(stage)
+            todo.extend(STAGE_DEPENDENCIES.get(stage, ()))
+
+    return frozenset(stages)
+
+
+def generate_patient(
+    person_id: int,
+    buffers: Dict[str, TableBuffer],
+    streams: Dict[str, np.random.Generator],
+    stages: FrozenSet[str] = frozenset(STAGES),
+    case: Optional[Tuple["Criterion", "Case"]] = None,
+) -> None:
+    """
+    Create all data of a single patient and append it to the buffers of the respective tables
+
+    Each stage draws from its own random number generator in `streams` (see
+    `data_generator.streams.patient_streams`), hence running only some of the `stages`
+    (see `required_stages`) yields the same rows for them as running all stages. The
+    wall time of each stage is recorded in `STATS`.
+
+    If a `case` of a criterion is given, the "criteria" stage creates the row of the case
+    (see `data_generator.criteria.case_row`).
+    """
+
+    # create person
+    if "person" in stages:
+        with STATS.stage("person"):
+            person = create_person(person_id, streams["person"])
+            buffers["person"].append_row(person)
+
+    # create visit
+    if "visit" in stages:
+        with STATS.stage("visit"):
+            visit = create_visit(person_id, streams["visit"])
+            buffers["visit_occurrence"].append_row(visit)
+
+    # create drugs
+    if "drugs" in stages:
+        with STATS.stage("drugs"):
+            buffers["drug_exposure"].extend(
+                person_id=person_id,
+                **drug_exposure_columns(visit, streams["drugs"], n_administrations=10),
+            )
+
+    # create first procedure
+    if "ventilation_procedure" in stages:
+        with STATS.stage("ventilation_procedure"):
+            prod = create_vent_params_procedure(
+                person_id, visit, streams["ventilation_procedure"]
+            )
+
+    # create measurements
+    if "ventilation_measurements" in stages:
+        with STATS.stage("ventilation_measurements"):
+            if params.VENTILATION_SAMPLING_INTERVAL is None:
+                buffers["measurement"].append_rows(
+                    create_vent_params_measurements(
+                        person_id, prod, visit, streams["ventilation_measurements"]
+                    )
+                )  # REALLY USE THE FIRST PROD HERE??
+            elif prod is not None:
+                for columns in ventilation_series(
+                    prod,
+                    streams["ventilation_measurements"],
+                    params.VENTILATION_SAMPLING_INTERVAL,
+                ):
+                    buffers["measurement"].extend(person_id=person_id, **columns)
+
+    if "lab_values" in stages:
+        with STATS.stage("lab_values"):
+            buffers["measurement"].extend(
+                person_id=person_id, **lab_values_columns(visit, streams["lab_values"])
+            )
+
+    # create rest of procedures
+    if "ventilation_procedure" in stages and prod is not None:
+        buffers["procedure_occurrence"].append_row(prod)
+
+    if "prone_positioning" in stages:
+        with STATS.stage("prone_positioning"):
+            buffers["procedure_occurrence"].append_rows(
+                create_prone_positioning_procedure(
+                    person_id, visit, streams["prone_positioning"], max_occurrences=5
+                )
+            )
+
+    # create list of condition_occurrences
+    if "conditions" in stages:
+        with STATS.stage("conditions"):
+            buffers["condition_occurrence"].append_rows(
+                create_cond(person_id, visit, streams["conditions"], max_occurrences=4)
+            )
+
+    # create list of observations
+    if "observations" in stages:
+        with STATS.stage("observations"):
+            buffers["observation"].append_rows(
+                create_obs(
+                    person_id,
+                    visit,
+                    streams["observations"],
+                    max_occurrences=2,
+                    probability_threshold=0.5,
+                )
+            )
+
+    # create the row of the case of a recommendation-driven run
+    if "criteria" in stages and case is not None:
+        with STATS.stage("criteria"):
+            criterion, patient_case = case
+            row = case_row(criterion, patient_case, visit, streams["criteria"])
+            if row is not None:
+                buffers[criterion.table].append(person_id=person_id, **row)
+
+    # create measurements for weight and ideal weight
+    if "weight" in stages:
+        with STATS.stage("weight"):
+            buffers["measurement"].append_rows(
+                create_weight_measurements(person_id, person, visit, streams["weight"])
+            )
+
+    STATS.add_patients(1)
+
+
+def _select(
+    buffers: Dict[str, TableBuffer], tables: Optional[Collection[str]]
+) -> Dict[str, TableBuffer]:
+    """
+    Return the buffers of `tables` (all buffers, if None)
+    """
+    if tables is None:
+        return buffers
+    return {table: buffers[table] for table in buffers if table in tables}
+
+
+def _patient_stages(
+    tables: Optional[Collection[str]], criteria: Optional["CriteriaPlan"]
+) -> FrozenSet[str]:
+    """
+    Return the stages that are run for each patient
+    """
+    return required_stages(tables) if criteria is None else CRITERIA_STAGES
+
+
+def generate_shard(
+    person_ids: range,
+    seed: int,
+    first_index: int,
+    tables: Optional[Collection[str]] = None,
+    criteria: Optional["CriteriaPlan"] = None,
+) -> Dict[str, TableBuffer]:
+    """
+    Create all patients of a shard.
+
+    `first_index` is the index of the first patient of the shard within the run and
+    is used to derive the seed of each patient. If `tables` is given, only the rows
+    of these tables are created. If `criteria` is given, each patient covers the case
+    of its index in the plan.
+    """
+    stages = _patient_stages(tables, criteria)
+    buffers = create_buffers()
+    for index, person_id in enumerate(person_ids, start=first_index):
+        generate_patient(
+            person_id,
+            buffers,
+            patient_streams(seed, index),
+            stages,
+            None if criteria is None else criteria.case(index),
+        )
+    return _select(buffers, tables)
+
+
+def generate_chunks(
+    person_ids: range,
+    seed: int,
+    first_index: int = 0,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    tables: Optional[Collection[str]] = None,
+    criteria: Optional["CriteriaPlan"] = None,
+) -> Iterator[Dict[str, TableBuffer]]:
+    """
+    Create the patients in `person_ids` and yield their rows in chunks.
+
+    A chunk is yielded as soon as it contains at least `batch_size` rows (in all tables).
+    If `tables` is given, only the rows of these tables are created. If `criteria` is
+    given, each patient covers the case of its index in the plan.
+    """
+    stages = _patient_stages(tables, criteria)
+    buffers = create_buffers()
+    n_rows = 0
+
+    for index, person_id in enumerate(person_ids, start=first_index):
+        generate_patient(
+            person_id,
+            buffers,
+            patient_streams(seed, index),
+            stages,
+            None if criteria is None else criteria.case(index),
+        )
+
+        n_rows = sum(len(buffer) for buffer in _select(buffers, tables).values())
+        if n_rows >= batch_size:
+            yield _select(buffers, tables)
+            buffers = create_buffers()
+            n_rows = 0
+
+    if n_rows:
+        yield _select(buffers, tables)
+
+
+def _generate_shard_task(
+    person_ids: range,
+    seed: int,
+    first_index: int,
+    tables: Optional[Collection[str]] = None,
+    criteria: Optional["CriteriaPlan"] = None,
+) -> Tuple[Dict[str, TableBuffer], Dict[str, Any]]:
+    """
+    Create all patients of a shard in a worker process and return their rows together
+    with the statistics of the generation
+    """
+    STATS.reset()
+    buffers = generate_shard(person_ids, seed, first_index, tables, criteria)
+    return buffers, STATS.snapshot()
+
+
+def shard_size(
+    batch_size: int,
+    tables: Optional[Collection[str]] = None,
+    criteria: Optional["CriteriaPlan"] = None,
+) -> int:
+    """
+    Return the number of patients of a shard that are expected to create about
+    `batch_size` rows (at least one patient), based on the mean number of rows per
+    patient of `data_generator.plan`
+    """
+    from data_generator.plan import expected_rows
+
+    if criteria is not None:
+        rows_per_patient = float(len(CRITERIA_STAGES))
+    else:
+        n_person = 1000
+        rows = expected_rows(n_person, tables, params.VENTILATION_SAMPLING_INTERVAL)
+        rows_per_patient = sum(rows.values()) / n_person
+
+    return max(1, int(batch_size / max(rows_per_patient, 1.0)))
+
+
+def split_range(person_ids: range, shard_size: int) -> List[Tuple[range, int]]:
+    """
+    Split `person_ids` into contiguous shards of at most `shard_size` patients.
+
+    Returns a list of tuples (shard, index of the first patient of the shard).
+    """
+    return [
+        (person_ids[start : start + shard_size], start)
+        for start in range(0, len(person_ids), shard_size)
+    ]
+
+
+def generate(
+    person_ids: range,
+    seed: int,
+    workers: int = 1,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    max_pending: Optional[int] = None,
+    first_index: int = 0,
+    tables: Optional[Collection[str]] = None,
+    criteria: Optional["CriteriaPlan"] = None,
+) -> Iterator[Dict[str, TableBuffer]]:
+    """
+    Create all patients in `person_ids` using `workers` processes and yield their rows in chunks.
+
+    `first_index` is the index of the first patient within the run (e.g. when a run is
+    generated in several parts). If `tables` is given, only the rows of these tables
+    are created (and only the stages needed for them are run). If `criteria` is given,
+    the patients cover the cases of the plan (see `data_generator.criteria`).
+
+    Chunks are yielded in the order of `person_ids` and contain about `batch_size` rows
+    (at least one patient). With several workers, each chunk is one shard of the patients
+    that are expected to create `batch_size` rows (see `shard_size`) and at most
+    `max_pending` (default: two per worker) shards are generated ahead of the consumer,
+    i.e. generation pauses while the consumer (e.g. the database) is busy and about
+    `max_pending * batch_size` rows are held in memory.
+    """
+    if workers <= 1:
+        yield from generate_chunks(
+            person_ids,
+            seed,
+            first_index=first_index,
+            batch_size=batch_size,
+            tables=tables,
+            criteria=criteria,
+        )
+        return
+
+    if max_pending is None:
+        max_pending = 2 * workers
+
+    shards = iter(split_range(person_ids, shard_size(batch_size, tables, criteria)))
+    pending: Deque[Future] = deque()
+
+    executor = ProcessPoolExecutor(max_workers=workers)
+
+    def submit_next() -> None:
+        for shard, shard_index in islice(shards, 1):
+            pending.append(
+                executor.submit(
+                    _generate_shard_task,
+                    shard,
+                    seed,
+                    first_index + shard_index,
+                    tables,
+                    criteria,
+                )
+            )
+
+    try:
+        for _ in range(max(max_pending, 1)):
+            submit_next()
+
+        while pending:
+            buffers, stats = pending.popleft().result()
+            STATS.merge(stats)
+            submit_next()
+            yield buffers
+    finally:
+        executor.shutdown(cancel_futures=True)
@@ -0,0 +1,109 @@
+"""
+Planning of generation runs.
+
+Estimates the number of rows that a run creates in each table without importing the
+generator (or numpy), e.g. for `random_data_generator.py --plan`. The estimates are
+based on the mean number of rows per patient of each table, which were measured with
+the default parameters (`calibrate`) and must be updated when the distributions in
+`data_generator.parameter` or the generator functions change:
+
+    python -m data_generator.plan
+"""
+import json
+from typing import Any, Collection, Dict, Optional
+
+from omop.constants import TABLE_NAMES
+
+# mean number of rows per patient of each table (ventilation parameters 24 times per day)
+ROWS_PER_PATIENT: Dict[str, float] = {
+    "person": 1.0,
+    "visit_occurrence": 1.0,
+    "drug_exposure": 8.72,
+    "procedure_occurrence": 2.0,
+    "measurement": 503.75,
+    "condition_occurrence": 2.5,
+    "observation": 0.76,
+}
+
+# mean number of ventilation parameter measurements per patient (part of "measurement")
+VENTILATION_ROWS_PER_PATIENT = 347.86
+
+# mean duration of the ventilation episodes of a patient in minutes, multiplied by the
+# number of parameters of the episode (`params.VENTILATION_SERIES`), i.e. the number
+# of time series rows per patient at a sampling interval of one minute
+VENTILATION_SERIES_MINUTES_PER_PATIENT = 25423.3
+
+
+def expected_rows(
+    n_person: int,
+    tables: Optional[Collection[str]] = None,
+    ventilation_interval: Optional[float] = None,
+) -> Dict[str, int]:
+    """
+    Return the expected number of rows of each table (in load order) for `n_person`
+    patients, optionally only for `tables`.
+
+    If `ventilation_interval` is given, the ventilation parameters are expected as time
+    series with one value every `ventilation_interval` minutes (see
+    `data_generator.timeseries`).
+    """
+    rows_per_patient = dict(ROWS_PER_PATIENT)
+
+    if ventilation_interval is not None:
+        if ventilation_interval <= 0:
+            raise ValueError("ventilation_interval must be positive")
+        rows_per_patient["measurement"] += (
+            VENTILATION_SERIES_MINUTES_PER_PATIENT / ventilation_interval
+            - VENTILATION_ROWS_PER_PATIENT
+        )
+
+    return {
+        table: round(n_person * rows_per_patient[table])
+        for table in TABLE_NAMES
+        if tables is None or table in tables
+    }
+
+
+def calibrate(n_person: int = 20000, seed: int = 0) -> Dict[str, Any]:
+    """
+    Generate `n_person` patients with the default parameters and return the mean number
+    of rows per patient (the values of the constants of this module)
+    """
+    import numpy as np
+
+    from data_generator import parameter as params
+    from data_generator.pipeline import generate_patient, generate_shard
+    from data_generator.streams import patient_streams
+    from omop.buffer import create_buffers
+
+    if params.VENTILATION_SAMPLING_INTERVAL is not None:
+        raise ValueError("calibrate with ventilation parameters 24 times per day")
+
+    buffers = generate_shard(range(n_person), seed, first_index=0)
+    rows_per_patient = {table: len(buffers[table]) / n_person for table in TABLE_NAMES}
+
+    # ventilation stages only (with the same streams as above)
+    stages = frozenset({"visit", "ventilation_procedure", "ventilation_measurements"})
+    buffers = create_buffers()
+    for index in range(n_person):
+        generate_patient(index, buffers, patient_streams(seed, index), stages)
+
+    procedures = buffers["procedure_occurrence"].columns()
+    n_parameters = [
+        len(params.VENTILATION_SERIES.get(int(concept), {}))
+        for concept in procedures["procedure_concept_id"]
+    ]
+    minutes = (
+        procedures["procedure_end_datetime"] - procedures["procedure_datetime"]
+    ) / np.timedelta64(1, "m")
+
+    return {
+        "ROWS_PER_PATIENT": rows_per_patient,
+        "VENTILATION_ROWS_PER_PATIENT": len(buffers["measurement"]) / n_person,
+        "VENTILATION_SERIES_MINUTES_PER_PATIENT": float(minutes @ n_parameters)
+        / n_person,
+    }
+
+
+if __name__ == "__main__":
+    print(json.dumps(calibrate(), indent=2))
@@ -0,0 +1,267 @@
+"""
+Download of the CELIDA recommendations package.
+
+The FHIR resources of the recommendations are released as a tarball on GitHub. Each
+release is downloaded only once into a local cache:
+
+    fhir-recommendations/
+        index.json                  release version -> sha256 of its tarball
+        packages/<sha256>.tgz       downloaded tarballs (content-addressed)
+        <version>/package/example   extracted FHIR resources of a release
+
+Tarballs are streamed to disk in chunks (never held in memory as a whole) and only the
+members below `package/example` are extracted. A release is extracted to a temporary
+directory that is renamed when it is complete, so an interrupted download or extraction
+is never mistaken for a cached release (and its partial files are removed). With
+`offline=True`, releases are only served from the cache (the latest cached release, if
+no version is given).
+
+`base_url` can point to any server with the layout of GitHub releases
+(`<base_url>/download/<version>/<package name>`), e.g. a local `python -m http.server`.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tarfile
+from pathlib import Path, PurePosixPath
+from typing import Any, Dict, Optional, Union
+
+GH_RELEASE_BASE = "https://github.com/CODEX-CELIDA/celida-recommendations/releases"
+PACKAGE_NAME_TEMPLATE = (
+    "recommendations.celida.codex.netzwerk-universitaetsmedizin.de-{version}.tgz"
+)
+DEFAULT_CACHE_DIR = Path("fhir-recommendations")
+INDEX_FILE = "index.json"
+
+# members of the tarball that are extracted
+EXTRACT_PREFIX = "package/example"
+
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+REQUEST_TIMEOUT = 60
+
+
+def package_name(version: str) -> str:
+    """
+    Return the file name of the package of a release (version is the tag, e.g. v1.2.0)
+    """
+    return PACKAGE_NAME_TEMPLATE.format(version=version.removeprefix("v"))
+
+
+def latest_version(base_url: str = GH_RELEASE_BASE) -> str:
+    """
+    Return the version (tag) of the latest release, i.e. the target of the redirect of
+    `<base_url>/latest`
+    """
+    import requests
+
+    response = requests.head(
+        base_url + "/latest", allow_redirects=True, timeout=REQUEST_TIMEOUT
+    )
+    response.raise_for_status()
+    if not response.history:
+        raise ValueError(
+            "No redirect for recommendation URL, can't load latest package"
+        )
+
+    return response.url.rstrip("/").split("/")[-1]
+
+
+class RecommendationCache:
+    """
+    Local cache of downloaded and extracted recommendation packages
+    """
+
+    def __init__(self, path: Union[str, Path] = DEFAULT_CACHE_DIR) -> None:
+        self.path = Path(path).absolute()
+        self.index_path = self.path / INDEX_FILE
+
+    def index(self) -> Dict[str, Any]:
+        """
+        Return the index of the cache (sha256 of the tarball of each version and the
+        latest version that was downloaded)
+        """
+        if not self.index_path.exists():
+            return {"latest": None, "versions": {}}
+        return json.loads(self.index_path.read_text())
+
+    def _save_index(self, index: Dict[str, Any]) -> None:
+        tmp = self.index_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(index, indent=2))
+        os.replace(tmp, self.index_path)
+
+    def tarball(self, version: str) -> Optional[Path]:
+        """
+        Return the cached tarball of a version (None, if it is not cached)
+        """
+        sha256 = self.index()["versions"].get(version)
+        if sha256 is None:
+            return None
+        path = self.path / "packages" / f"{sha256}.tgz"
+        return path if path.exists() else None
+
+    def example_dir(self, version: str) -> Path:
+        """
+        Return the directory of the extracted FHIR resources of a version
+        """
+        return self.path / version / EXTRACT_PREFIX
+
+    def download(self, version: str, base_url: str = GH_RELEASE_BASE) -> Path:
+        """
+        Download the tarball of a version (in chunks) and return its path in the cache
+        """
+        import requests
+
+        url = f"{base_url}/download/{version}/{package_name(version)}"
+        packages = self.path / "packages"
+        packages.mkdir(parents=True, exist_ok=True)
+        tmp = packages / f"{version}.download"
+
+        sha256 = hashlib.sha256()
+        try:
+            with requests.get(url, stream=True, timeout=REQUEST_TIMEOUT) as response:
+                response.raise_for_status()
+                with open(tmp, "wb") as f:
+                    for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                        sha256.update(chunk)
+                        f.write(chunk)
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+
+        path = packages / f"{sha256.hexdigest()}.tgz"
+        os.replace(tmp, path)
+
+        index = self.index()
+        index["versions"][version] = sha256.hexdigest()
+        self._save_index(index)
+
+        return path
+
+    def extract(self, version: str, tarball: Path) -> Path:
+        """
+        Extract the members below `EXTRACT_PREFIX` of the tarball of a version and
+        return the directory of the FHIR resources
+        """
+        target = self.path / version
+        tmp = self.path / f"{version}.extract"
+        shutil.rmtree(tmp, ignore_errors=True)
+
+        try:
+            self._extract_members(tarball, tmp)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+
+        shutil.rmtree(target, ignore_errors=True)
+        os.replace(tmp, target)
+
+        return self.example_dir(version)
+
+    @staticmethod
+    def _extract_members(tarball: Path, directory: Path) -> None:
+        """
+        Extract the files below `EXTRACT_PREFIX` of a tarball to a directory
+        """
+        n_files = 0
+
+        # read as a stream, i.e. each member is read once and in order
+        with tarfile.open(tarball, "r|gz") as tar:
+            for member in tar:
+                name = PurePosixPath(member.name)
+                if name.is_absolute() or ".." in name.parts:
+                    raise ValueError(f"Unsafe path {member.name} in {tarball}")
+                if not name.is_relative_to(EXTRACT_PREFIX) or not member.isfile():
+                    continue
+                path = directory.joinpath(*name.parts)
+                path.parent.mkdir(parents=True, exist_ok=True)
+                with open(path, "wb") as f:
+                    shutil.copyfileobj(tar.extractfile(member), f)  # type: ignore[arg-type]
+                n_files += 1
+
+        if not n_files:
+            raise ValueError(f"{tarball} contains no files below {EXTRACT_PREFIX}")
+
+    def fetch(
+        self,
+        version: Optional[str] = None,
+        offline: bool = False,
+        base_url: str = GH_RELEASE_BASE,
+    ) -> Path:
+        """
+        Return the directory of the FHIR resources of a release (default: the latest
+        release), downloading and extracting it only if it is not cached yet
+        """
+        if version is None:
+            if offline:
+                version = self.index()["latest"]
+                if version is None:
+                    raise FileNotFoundError(
+                        f"No recommendations in the cache {self.path} (offline)"
+                    )
+            else:
+                version = latest_version(base_url)
+
+        example_dir = self.example_dir(version)
+        if example_dir.exists():
+            logging.info(f"Using cached recommendations {version}")
+        else:
+            tarball = self.tarball(version)
+            if tarball is None:
+                if offline:
+                    raise FileNotFoundError(
+                        f"Recommendations {version} are not in the cache {self.path} "
+                        "(offline)"
+                    )
+                logging.info(f"Downloading recommendations {version}")
+                tarball = self.download(version, base_url)
+            self.extract(version, tarball)
+
+        if not offline:
+            index = self.index()
+            index["latest"] = version
+            self._save_index(index)
+
+        return example_dir
+
+
+def fetch_recommendations(
+    version: Optional[str] = None,
+    cache_dir: Union[str, Path] = DEFAULT_CACHE_DIR,
+    offline: bool = False,
+    base_url: str = GH_RELEASE_BASE,
+) -> Path:
+    """
+    Return the directory of the FHIR resources of a release of the recommendations
+    (default: the latest release), see `RecommendationCache.fetch`
+    """
+    return RecommendationCache(cache_dir).fetch(version, offline, base_url)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO
+    )
+
+    parser = argparse.ArgumentParser(
+        description="Download the CELIDA recommendations (FHIR resources)"
+    )
+    parser.add_argument("--version", help="Release (tag), default: latest release")
+    parser.add_argument(
+        "--cache-dir",
+        help=f"Cache directory (default: {DEFAULT_CACHE_DIR})",
+        default=DEFAULT_CACHE_DIR,
+    )
+    parser.add_argument(
+        "--offline", help="Only use the cache, do not connect", action="store_true"
+    )
+    parser.add_argument(
+        "--base-url", help="URL of the releases", default=GH_RELEASE_BASE
+    )
+    args = parser.parse_args()
+
+    print(
+        fetch_recommendations(args.version, args.cache_dir, args.offline, args.base_url)
+    )
@@ -0,0 +1,254 @@
+"""
+Distributed generation in shards.
+
+A run that is too large for one machine is split into shards of consecutive patients:
+
+1. A coordinator writes the shard manifest (`ShardManifest`, `shards.json` in a shared
+   output directory) with the seed, the block of person ids, the end of the visit
+   window and the range of patients of each shard.
+2. Each node generates one shard to files in its own subdirectory of the output
+   directory (`shard-00000`, ...). A patient draws from the random number streams of
+   its index within the whole run (see `data_generator.streams`), so the shards
+   together are identical to a run on a single machine. When a shard is complete, its
+   manifest (`data_generator.manifest.Manifest`) is written to its directory.
+3. The merge step checks that the shards do not overlap, that every shard is complete
+   and was generated with the same seed and the same generator code and parameters,
+   and bulk-loads the files of each shard into the CDM (see `load_shard`).
+"""
+import dataclasses
+import gzip
+import io
+import json
+import os
+from pathlib import Path
+from typing import Any, List, Optional, Union
+
+from omop.constants import TABLE_NAMES
+
+SHARD_MANIFEST_FILE = "shards.json"
+
+
+@dataclasses.dataclass
+class Shard:
+    """
+    Consecutive patients of a distributed run
+    """
+
+    index: int
+    # index of the first patient of the shard within the run
+    first_index: int
+    n_person: int
+
+    @property
+    def directory(self) -> str:
+        """
+        Return the name of the directory of the shard (within the output directory)
+        """
+        return f"shard-{self.index:05d}"
+
+
+@dataclasses.dataclass
+class ShardManifest:
+    """
+    Seed, person ids, file format and shards of a distributed run
+    """
+
+    seed: int
+    first_person_id: int
+    n_person: int
+    file_format: str
+    shards: List[Shard]
+    # last day of the visit window of the run (ISO format, see params.VISIT_END_DATE)
+    visit_end_date: Optional[str] = None
+
+    def __post_init__(self) -> None:
+        """
+        Convert the shards read from JSON to `Shard` objects
+        """
+        self.shards = [
+            s if isinstance(s, Shard) else Shard(**s)  # type: ignore[arg-type]
+            for s in self.shards
+        ]
+
+    @classmethod
+    def split(
+        cls,
+        seed: int,
+        first_person_id: int,
+        n_person: int,
+        n_shards: int,
+        file_format: str,
+        visit_end_date: Optional[str] = None,
+    ) -> "ShardManifest":
+        """
+        Split a run into `n_shards` shards of (almost) equal size
+        """
+        if n_shards < 1:
+            raise ValueError("n_shards must be positive")
+
+        bounds = [n_person * i // n_shards for i in range(n_shards + 1)]
+        shards = [
+            Shard(index=i, first_index=start, n_person=stop - start)
+            for i, (start, stop) in enumerate(zip(bounds[:-1], bounds[1:]))
+        ]
+
+        return cls(seed, first_person_id, n_person, file_format, shards, visit_end_date)
+
+    @property
+    def person_ids(self) -> range:
+        """
+        Return all person ids of the run
+        """
+        return range(self.first_person_id, self.first_person_id + self.n_person)
+
+    def person_ids_of(self, shard: Shard) -> range:
+        """
+        Return the person ids of a shard
+        """
+        return self.person_ids[shard.first_index : shard.first_index + shard.n_person]
+
+    def shard(self, index: int) -> Shard:
+        """
+        Return the shard with the given index
+        """
+        for shard in self.shards:
+            if shard.index == index:
+                return shard
+        raise KeyError(f"No shard {index} in the shard manifest")
+
+    def check(self) -> None:
+        """
+        Check that the shards do not overlap and cover all patients of the run
+        """
+        indexes = [shard.index for shard in self.shards]
+        if len(set(indexes)) != len(indexes):
+            raise ValueError("Shard indexes are not unique")
+
+        expected_start = 0
+        for shard in sorted(self.shards, key=lambda s: s.first_index):
+            if shard.n_person < 0:
+                raise ValueError(f"Shard {shard.index} has a negative size")
+            if shard.first_index < expected_start:
+                raise ValueError(f"Shard {shard.index} overlaps the previous shard")
+            if shard.first_index > expected_start:
+                raise ValueError(
+                    f"Patients {expected_start} - {shard.first_index - 1} are not "
+                    "in any shard"
+                )
+            expected_start = shard.first_index + shard.n_person
+
+        if expected_start != self.n_person:
+            raise ValueError(
+                f"The shards contain {expected_start} instead of {self.n_person} patients"
+            )
+
+    def save(self, path: Union[str, Path]) -> None:
+        """
+        Write the shard manifest to a file (atomically, i.e. the file is never left
+        incomplete)
+        """
+        tmp = Path(f"{path}.tmp")
+        tmp.write_text(json.dumps(dataclasses.asdict(self), indent=2))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "ShardManifest":
+        """
+        Read a shard manifest from a file
+        """
+        return cls(**json.loads(Path(path).read_text()))
+
+
+def check_shards(output_dir: Union[str, Path], shard_manifest: ShardManifest) -> None:
+    """
+    Check that all shards of a run are complete and consistent, i.e. that the shards
+    do not overlap and that each shard was generated with the seed and person ids of
+    the shard manifest and with the same generator code and parameters
+    """
+    from data_generator.manifest import MANIFEST_FILE_NAME, Manifest
+
+    shard_manifest.check()
+
+    fingerprints = None
+    for shard in shard_manifest.shards:
+        path = Path(output_dir) / shard.directory / MANIFEST_FILE_NAME
+        if not path.exists():
+            raise ValueError(f"Shard {shard.index} is not complete ({path} is missing)")
+
+        manifest = Manifest.load(path)
+        if manifest.seed != shard_manifest.seed:
+            raise ValueError(f"Shard {shard.index} was generated with another seed")
+        if manifest.visit_end_date != shard_manifest.visit_end_date:
+            raise ValueError(
+                f"Shard {shard.index} was generated with another visit window"
+            )
+        if manifest.person_ids != shard_manifest.person_ids_of(shard):
+            raise ValueError(
+                f"Shard {shard.index} contains other person ids than in the shard "
+                "manifest"
+            )
+
+        if fingerprints is None:
+            fingerprints = manifest.tables
+        elif manifest.tables != fingerprints:
+            raise ValueError(
+                f"Shard {shard.index} was generated with other generator code or "
+                "parameters than the first shard"
+            )
+
+
+def _table_files(directory: Path, table: str, file_format: str) -> List[Path]:
+    suffix = "parquet" if file_format == "parquet" else "csv.gz"
+    return sorted((directory / table).glob(f"part-*.{suffix}"))
+
+
+def load_shard(cursor: Any, directory: Union[str, Path], file_format: str) -> int:
+    """
+    Load the files of a shard (written by `omop.sink.FileSink`) into the tables of the
+    CDM (in load order) and return the number of rows.
+
+    CSV files are streamed to COPY as they are; Parquet files are read in batches and
+    sent in the binary COPY format.
+    """
+    n_rows = 0
+
+    for table in TABLE_NAMES:
+        for path in _table_files(Path(directory), table, file_format):
+            if file_format == "csv":
+                n_rows += _load_csv(cursor, table, path)
+            else:
+                n_rows += _load_parquet(cursor, table, path)
+
+    return n_rows
+
+
+def _load_csv(cursor: Any, table: str, path: Path) -> int:
+    with gzip.open(path, "rb") as f:
+        columns = f.readline().decode().strip()
+        cursor.copy_expert(f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)", f)
+    return cursor.rowcount
+
+
+def _load_parquet(cursor: Any, table: str, path: Path) -> int:
+    import pyarrow.parquet as pq
+
+    from omop.buffer import TableBuffer
+    from omop.pgcopy import copy_binary
+
+    n_rows = 0
+    for batch in pq.ParquetFile(path).iter_batches():
+        buffer = TableBuffer(table, capacity=batch.num_rows)
+        buffer.extend(
+            **{
+                name: column.to_numpy(zero_copy_only=False)
+                for name, column in zip(batch.schema.names, batch.columns)
+            }
+        )
+        cursor.copy_expert(
+            f"COPY {table} ({', '.join(buffer.column_names)}) FROM STDIN "
+            "WITH (FORMAT binary)",
+            io.BytesIO(copy_binary(buffer)),
+        )
+        n_rows += len(buffer)
+
+    return n_rows
@@ -0,0 +1,50 @@
+"""
+Random number streams.
+
+Every patient and every generation stage draws from its own random number generator
+(`numpy.random.Generator`). The generators are derived from the seed of the run, the
+index of the patient within the run and the stage, i.e. the stream of a stage is
+
+    np.random.SeedSequence(seed).spawn(index + 1)[index].spawn(len(STAGES))[STAGES[stage]]
+
+(which is computed directly from its spawn key). Thus, the data of a patient does not
+depend on any other patient, and a stage does not depend on the number of draws of
+any other stage: patients can be generated in any order and in any process, and a
+single stage can be regenerated without the others.
+
+New stages must be added to the end of `STAGES`, so that existing streams keep their
+keys.
+"""
+from typing import Dict, Final
+
+import numpy as np
+
+# generation stages and the spawn keys of their streams
+STAGES: Final = {
+    "person": 0,
+    "visit": 1,
+    "drugs": 2,
+    "ventilation_procedure": 3,
+    "ventilation_measurements": 4,
+    "lab_values": 5,
+    "prone_positioning": 6,
+    "conditions": 7,
+    "observations": 8,
+    "weight": 9,
+    "criteria": 10,
+}
+
+
+def stage_rng(seed: int, index: int, stage: str) -> np.random.Generator:
+    """
+    Return the random number generator of a stage for the patient at `index` of a run
+    """
+    sequence = np.random.SeedSequence(seed, spawn_key=(index, STAGES[stage]))
+    return np.random.Generator(np.random.PCG64(sequence))
+
+
+def patient_streams(seed: int, index: int) -> Dict[str, np.random.Generator]:
+    """
+    Return the random number generators of all stages for the patient at `index` of a run
+    """
+    return {stage: stage_rng(seed, index, stage) for stage in STAGES}
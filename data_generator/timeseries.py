@@ -0,0 +1,116 @@
+"""
+High-frequency ventilator time series.
+
+Creates the ventilation parameters (`params.VENTILATION_SERIES`) of a ventilation or
+oxygen therapy episode at a fixed sampling interval (e.g. every minute) as columns of
+the measurement table. Values follow a stationary AR(1) process per parameter, i.e.
+they are autocorrelated instead of independent draws.
+
+Long episodes are generated in chunks of at most `chunk_size` samples (per parameter)
+without creating any python object per sample, such that the columns can be appended
+to a `TableBuffer` (and written to a sink) directly. The result does not depend on the
+chunk size.
+"""
+from typing import TYPE_CHECKING, Any, Dict, Iterator, Optional
+
+import numpy as np
+
+from data_generator import parameter as params
+
+if TYPE_CHECKING:
+    from omop.tables import ProcedureOccurrence
+
+DEFAULT_CHUNK_SIZE = 65536
+
+MICROSECONDS_PER_MINUTE = 60 * 1_000_000
+
+
+def ar1(innovations: np.ndarray, phi: float, initial: float) -> np.ndarray:
+    """
+    Return x with x[t] = phi * x[t - 1] + innovations[t] and x[-1] = `initial`.
+
+    The recursion is evaluated as a prefix scan (log2(n) vectorized steps) instead of a
+    python loop over the samples.
+    """
+    x = innovations.astype(np.float64)
+    if not len(x):
+        return x
+
+    x[0] += phi * initial
+
+    shift = 1
+    coefficient = phi
+    while shift < len(x):
+        x[shift:] = x[shift:] + coefficient * x[:-shift]
+        shift *= 2
+        coefficient *= coefficient
+
+    return x
+
+
+def ventilation_series(
+    prod: "ProcedureOccurrence",
+    rng: np.random.Generator,
+    interval: float,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Create the ventilation parameters of an episode every `interval` minutes and yield
+    them as chunks of measurement columns (without person_id)
+
+    Yielded columns are measurement_concept_id and unit_concept_id (scalars),
+    measurement_date, measurement_datetime and value_as_number.
+    """
+    if interval <= 0:
+        raise ValueError("interval must be positive")
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be positive")
+
+    series = params.VENTILATION_SERIES.get(prod.procedure_concept_id)
+    if series is None:
+        return
+
+    start = np.datetime64(prod.procedure_datetime, "us")
+    end = np.datetime64(prod.procedure_end_datetime, "us")
+    step = int(interval * MICROSECONDS_PER_MINUTE)
+    n_samples = max(int((end - start) // np.timedelta64(step, "us")), 0)
+
+    # one generator per parameter, so that the values do not depend on the chunk size
+    seeds = rng.integers(2**63, size=len(series))
+    generators = [np.random.Generator(np.random.PCG64(int(seed))) for seed in seeds]
+
+    phi = {
+        concept: np.exp(-interval / (60 * parameter["tau_hours"]))
+        for concept, parameter in series.items()
+    }
+    state: Dict[int, Optional[float]] = {concept: None for concept in series}
+
+    for offset in range(0, n_samples, chunk_size):
+        n = min(chunk_size, n_samples - offset)
+        measurement_datetime = start + (
+            np.arange(offset, offset + n, dtype=np.int64) * step
+        ).astype("timedelta64[us]")
+        measurement_date = measurement_datetime.astype("datetime64[D]")
+
+        for (concept, parameter), generator in zip(series.items(), generators):
+            # standardized AR(1) process with unit variance, starting in its stationary
+            # distribution
+            previous = state[concept]
+            if previous is None:
+                previous = generator.standard_normal()
+            innovations = generator.standard_normal(n) * np.sqrt(1 - phi[concept] ** 2)
+            x = ar1(innovations, phi[concept], previous)
+            state[concept] = float(x[-1])
+
+            values = parameter["mean"] + parameter["sd"] * x
+            values = np.round(values / parameter["step"]) * parameter["step"]
+
+            yield {
+                "measurement_concept_id": np.int64(concept),
+                "measurement_date": measurement_date,
+                "measurement_datetime": measurement_datetime,
+                "value_as_number": np.clip(
+                    values, parameter["minimum"], parameter["maximum"]
+                ),
+                "unit_concept_id": np.int64(parameter["unit"]),
+            }
@@ -0,0 +1,530 @@
+"""
+Consistency checks of generated data.
+
+The tables of a run are read as batches of numpy columns (from the files written by
+`omop.sink.FileSink` or from the database) and every row is checked with vectorized
+code, i.e. without a python object per row:
+
+- `end_before_start`: a visit, drug exposure, procedure or condition ends before it
+  starts
+- `date_mismatch`: a date column is not the date of its datetime column
+- `outside_visit`: an event starts or ends outside of the visits of its person
+- `domain`: a concept is not of the domain of its column (e.g. a drug in
+  `measurement_concept_id`); the domains are taken from `omop.concepts.DOMAINS` or
+  from the concept cache (`omop.vocabulary`)
+- `unit`: a measurement has another unit than the generator uses for its concept
+  (`params.LABORATORY_LIST`, `params.VENTILATION_PARAMS`, ...)
+
+    python -m data_generator.validate data --format parquet
+
+Only the visits are held in memory (sorted by person and start, see `VisitIndex`), all
+other tables are checked batch by batch, so memory usage does not depend on the number
+of measurements. The violations of each check and column are summarized (number of
+rows and a few example persons); the exit code is 1 if there is any violation.
+"""
+import argparse
+import dataclasses
+import json
+import logging
+import sys
+import time
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+import numpy as np
+
+from omop.buffer import table_schema
+from omop.constants import FILE_FORMATS, TABLE_NAMES
+from omop.reader import Columns, database_batches, file_batches
+
+# maps concept ids to their domains (missing concepts are left out)
+DomainLookup = Callable[[List[int]], Dict[int, str]]
+
+# (start, end) columns of the tables whose rows are intervals
+INTERVALS: Dict[str, Tuple[Tuple[str, str], ...]] = {
+    "visit_occurrence": (
+        ("visit_start_date", "visit_end_date"),
+        ("visit_start_datetime", "visit_end_datetime"),
+    ),
+    "drug_exposure": (
+        ("drug_exposure_start_date", "drug_exposure_end_date"),
+        ("drug_exposure_start_datetime", "drug_exposure_end_datetime"),
+    ),
+    "procedure_occurrence": (
+        ("procedure_date", "procedure_end_date"),
+        ("procedure_datetime", "procedure_end_datetime"),
+    ),
+    "condition_occurrence": (
+        ("condition_start_date", "condition_end_date"),
+        ("condition_start_datetime", "condition_end_datetime"),
+    ),
+}
+
+# (date, datetime) columns of the same point in time
+DATES: Dict[str, Tuple[Tuple[str, str], ...]] = {
+    "visit_occurrence": (
+        ("visit_start_date", "visit_start_datetime"),
+        ("visit_end_date", "visit_end_datetime"),
+    ),
+    "drug_exposure": (
+        ("drug_exposure_start_date", "drug_exposure_start_datetime"),
+        ("drug_exposure_end_date", "drug_exposure_end_datetime"),
+    ),
+    "procedure_occurrence": (
+        ("procedure_date", "procedure_datetime"),
+        ("procedure_end_date", "procedure_end_datetime"),
+    ),
+    "measurement": (("measurement_date", "measurement_datetime"),),
+    "condition_occurrence": (
+        ("condition_start_date", "condition_start_datetime"),
+        ("condition_end_date", "condition_end_datetime"),
+    ),
+    "observation": (("observation_date", "observation_datetime"),),
+}
+
+# (start, end) datetime columns of the events that must lie within a visit
+EVENTS: Dict[str, Tuple[str, Optional[str]]] = {
+    "drug_exposure": ("drug_exposure_start_datetime", "drug_exposure_end_datetime"),
+    "procedure_occurrence": ("procedure_datetime", "procedure_end_datetime"),
+    "measurement": ("measurement_datetime", None),
+    "condition_occurrence": ("condition_start_datetime", "condition_end_datetime"),
+    "observation": ("observation_datetime", None),
+}
+
+# domain of the concepts of each concept column
+CONCEPT_DOMAINS: Dict[str, Dict[str, str]] = {
+    "person": {"gender_concept_id": "Gender"},
+    "visit_occurrence": {
+        "visit_concept_id": "Visit",
+        "visit_type_concept_id": "Type Concept",
+    },
+    "drug_exposure": {
+        "drug_concept_id": "Drug",
+        "drug_type_concept_id": "Type Concept",
+    },
+    "procedure_occurrence": {
+        "procedure_concept_id": "Procedure",
+        "procedure_type_concept_id": "Type Concept",
+    },
+    "measurement": {
+        "measurement_concept_id": "Measurement",
+        "measurement_type_concept_id": "Type Concept",
+        "unit_concept_id": "Unit",
+    },
+    "condition_occurrence": {
+        "condition_concept_id": "Condition",
+        "condition_type_concept_id": "Type Concept",
+    },
+    "observation": {
+        "observation_concept_id": "Observation",
+        "observation_type_concept_id": "Type Concept",
+    },
+}
+
+# number of example persons per violation
+N_EXAMPLES = 5
+
+
+@dataclasses.dataclass
+class Violation:
+    """
+    Rows of a table that fail a check
+    """
+
+    check: str
+    table: str
+    columns: Tuple[str, ...]
+    count: int = 0
+    n_rows: int = 0
+    person_ids: List[int] = dataclasses.field(default_factory=list)
+    detail: str = ""
+
+    def asdict(self) -> Dict[str, Any]:
+        """
+        Return the violation as a JSON serializable dict
+        """
+        return dataclasses.asdict(self)
+
+
+def required_columns(table: str) -> List[str]:
+    """
+    Return the columns of a table that are used by the checks
+    """
+    names = {"person_id"}
+    for pairs in (INTERVALS.get(table, ()), DATES.get(table, ())):
+        for pair in pairs:
+            names.update(pair)
+    names.update(c for c in EVENTS.get(table, ()) if c is not None)
+    names.update(CONCEPT_DOMAINS.get(table, {}))
+    return [c.name for c in table_schema(table) if c.name in names]
+
+
+def concept_domains(vocabulary: Optional[Union[str, Path]] = None) -> DomainLookup:
+    """
+    Return a function that maps concept ids to their domains, using the concept cache
+    (if given) or `omop.concepts.DOMAINS`
+    """
+    if vocabulary is None:
+        from omop.concepts import DOMAINS
+
+        return lambda ids: {c: DOMAINS[c] for c in ids if c in DOMAINS}
+
+    from omop.vocabulary import ConceptCache
+
+    cache = ConceptCache(vocabulary)
+    return lambda ids: {
+        concept_id: concept.domain_id
+        for concept_id, concept in cache.lookup(ids).items()
+    }
+
+
+def expected_units() -> Dict[int, set]:
+    """
+    Return the units the generator uses for each measurement concept
+    """
+    from data_generator import parameter as params
+
+    parameters: List[Dict[int, Any]] = [params.LABORATORY_LIST]
+    parameters += params.VENTILATION_PARAMS.values()
+    parameters += params.VENTILATION_SERIES.values()
+    parameters += params.WEIGHT.values()
+
+    units: Dict[int, set] = {}
+    for parameter in parameters:
+        for concept_id, p in parameter.items():
+            units.setdefault(concept_id, set()).add(p["unit"])
+    return units
+
+
+def _visit_bounds(visits: Columns) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Return the start and end datetimes of the visits (from their dates, if the
+    datetimes are missing)
+    """
+    one_day = np.timedelta64(1, "D")
+    start = visits["visit_start_datetime"]
+    start = np.where(
+        np.isnat(start), visits["visit_start_date"].astype(start.dtype), start
+    )
+    end = visits["visit_end_datetime"]
+    end = np.where(
+        np.isnat(end), (visits["visit_end_date"] + one_day).astype(end.dtype), end
+    )
+    return start, end
+
+
+class VisitIndex:
+    """
+    Visits sorted by person and start, such that the visits of a batch of events are
+    found with one binary search.
+
+    If every person has a single visit, the visit of an event is found by its person.
+    Otherwise, each visit has an integer key, the rank of its person times the time
+    span of all visits plus its start (in seconds since the first start). The visit of
+    an event is then the last visit with a key not greater than that of the event
+    (and, within the same second, not starting after the event).
+    """
+
+    def __init__(self, visits: Columns) -> None:
+        start, end = _visit_bounds(visits)
+        order = np.lexsort((start, visits["person_id"]))
+        self.person_id = visits["person_id"][order]
+        self.start = start[order]
+        self.end = end[order]
+
+        self.persons = np.unique(self.person_id)
+        self.single = len(self.persons) == len(self.person_id)
+        self.first_start = (
+            self.start.min() if len(self.start) else np.datetime64(0, "us")
+        )
+        seconds = self._seconds(self.start)
+        self.span = int(seconds.max()) + 1 if len(seconds) else 1
+        if len(self.persons) * self.span >= 2**62:
+            raise ValueError("Time span of the visits is too long for the index")
+        self.keys = np.searchsorted(self.persons, self.person_id) * self.span + seconds
+
+    def _seconds(self, datetimes: np.ndarray) -> np.ndarray:
+        microseconds = datetimes.astype("datetime64[us]").view(np.int64)
+        return (microseconds - self.first_start.astype(np.int64)) // 1_000_000
+
+    def find(self, person_id: np.ndarray, datetimes: np.ndarray) -> np.ndarray:
+        """
+        Return the index of the visit of each event, i.e. of the last visit of its
+        person that starts at or before the event (-1, if there is none or the time of
+        the event is missing)
+        """
+        if len(self.person_id) == 0:
+            return np.full(len(person_id), -1, dtype=np.int64)
+
+        if self.single:
+            index = np.searchsorted(self.person_id, person_id)
+        else:
+            seconds = np.clip(self._seconds(datetimes), -1, self.span - 1)
+            rank = np.searchsorted(self.persons, person_id)
+            index = np.searchsorted(self.keys, rank * self.span + seconds, "right") - 1
+            # a visit that starts later within the same second
+            index -= (index >= 0) & (self.start[index] > datetimes)
+
+        index = np.minimum(index, len(self.person_id) - 1)
+        clipped = np.maximum(index, 0)
+        # comparisons with NaT (missing times) are False
+        found = (
+            (index >= 0)
+            & (self.person_id[clipped] == person_id)
+            & (self.start[clipped] <= datetimes)
+        )
+        return np.where(found, index, -1)
+
+
+class Validator:
+    """
+    Checks batches of rows of the tables and sums up the violations of each check and
+    column
+    """
+
+    def __init__(
+        self, visits: Optional[Columns] = None, domains: Optional[DomainLookup] = None
+    ) -> None:
+        self.visits = VisitIndex(visits) if visits is not None else None
+        self.domains = domains if domains is not None else concept_domains()
+
+        # concepts that were already looked up, by domain (of the domain or not)
+        self._of_domain: Dict[str, np.ndarray] = {}
+        self._not_of_domain: Dict[str, np.ndarray] = {}
+
+        # a (concept, unit) pair as one integer, such that all rows are checked at once
+        units = expected_units()
+        self._unit_concepts = np.array(sorted(units), dtype=np.int64)
+        self._units = np.array(
+            sorted((c << 32) | u for c, us in units.items() for u in us),
+            dtype=np.int64,
+        )
+
+        self._results: Dict[Tuple[str, str, Tuple[str, ...]], Violation] = {}
+
+    def results(self) -> List[Violation]:
+        """
+        Return the results of each check and column (including those without
+        violations, see `Violation.count`)
+        """
+        return list(self._results.values())
+
+    def _add(
+        self,
+        check: str,
+        table: str,
+        columns: Tuple[str, ...],
+        mask: np.ndarray,
+        person_id: np.ndarray,
+        detail: str = "",
+    ) -> None:
+        key = (check, table, columns)
+        if key not in self._results:
+            self._results[key] = Violation(check, table, columns, detail=detail)
+        result = self._results[key]
+
+        rows = np.flatnonzero(mask)
+        result.count += len(rows)
+        result.n_rows += len(mask)
+        if len(rows) and len(result.person_ids) < N_EXAMPLES:
+            examples = set(result.person_ids)
+            examples.update(np.unique(person_id[rows[: N_EXAMPLES * 100]]).tolist())
+            result.person_ids = sorted(examples)[:N_EXAMPLES]
+
+    def check(self, table: str, columns: Columns) -> None:
+        """
+        Check a batch of rows of a table
+        """
+        person_id = columns["person_id"]
+
+        for start, end in INTERVALS.get(table, ()):
+            # comparisons with NaT (missing end) are False
+            mask = columns[end] < columns[start]
+            self._add("end_before_start", table, (start, end), mask, person_id)
+
+        for date, dt in DATES.get(table, ()):
+            mask = ~np.isnat(columns[dt]) & (
+                columns[date] != columns[dt].astype("datetime64[D]")
+            )
+            self._add("date_mismatch", table, (date, dt), mask, person_id)
+
+        if table in EVENTS and self.visits is not None:
+            self._check_visits(table, columns)
+
+        for column, domain in CONCEPT_DOMAINS.get(table, {}).items():
+            mask = self._wrong_domain(columns[column], domain)
+            self._add(
+                "domain", table, (column,), mask, person_id, detail=f"not {domain}"
+            )
+
+        if table == "measurement":
+            concept_id = columns["measurement_concept_id"]
+            pairs = (concept_id << 32) | columns["unit_concept_id"]
+            mask = ~np.isin(pairs, self._units)
+            # only concepts of the generator parameters are checked
+            rows = np.flatnonzero(mask)
+            mask[rows] = np.isin(concept_id[rows], self._unit_concepts)
+            self._add(
+                "unit",
+                table,
+                ("measurement_concept_id", "unit_concept_id"),
+                mask,
+                person_id,
+            )
+
+    def _check_visits(self, table: str, columns: Columns) -> None:
+        assert self.visits is not None
+
+        start, end = EVENTS[table]
+        person_id = columns["person_id"]
+        event_start = columns[start]
+
+        index = self.visits.find(person_id, event_start)
+        found = index >= 0
+        end_of_visit = self.visits.end[np.maximum(index, 0)]
+
+        mask = ~np.isnat(event_start) & (~found | (event_start > end_of_visit))
+        self._add("outside_visit", table, (start,), mask, person_id)
+
+        if end is not None:
+            # comparisons with NaT (missing end) are False
+            mask = found & (columns[end] > end_of_visit)
+            self._add("outside_visit", table, (end,), mask, person_id)
+
+    def _wrong_domain(self, concept_id: np.ndarray, domain: str) -> np.ndarray:
+        """
+        Return whether the concepts are not of the domain (concepts are only looked up
+        the first time they occur)
+        """
+        empty = np.empty(0, dtype=np.int64)
+        mask = ~np.isin(concept_id, self._of_domain.get(domain, empty))
+        rows = np.flatnonzero(mask)
+
+        new = np.setdiff1d(concept_id[rows], self._not_of_domain.get(domain, empty))
+        if len(new):
+            found = self.domains(new.tolist())
+            of_domain = np.array([found.get(c) == domain for c in new.tolist()])
+            for checked, ids in (
+                (self._of_domain, new[of_domain]),
+                (self._not_of_domain, new[~of_domain]),
+            ):
+                checked[domain] = np.union1d(checked.get(domain, empty), ids)
+            mask[rows] = ~np.isin(concept_id[rows], self._of_domain[domain])
+
+        return mask
+
+
+def _concatenate(batches: Sequence[Columns]) -> Columns:
+    return {name: np.concatenate([b[name] for b in batches]) for name in batches[0]}
+
+
+def validate(
+    batches: Callable[[str], Iterable[Columns]],
+    domains: Optional[DomainLookup] = None,
+) -> List[Violation]:
+    """
+    Check all tables and return the results of each check and column.
+
+    `batches(table)` returns the batches of the columns of a table (see
+    `omop.reader` and `required_columns`). The visits are read first, as the events
+    of all other tables are checked against them.
+    """
+    visit_batches = list(batches("visit_occurrence"))
+    visits = _concatenate(visit_batches) if visit_batches else None
+    validator = Validator(visits, domains)
+
+    for table in TABLE_NAMES:
+        n_rows = 0
+        for columns in visit_batches if table == "visit_occurrence" else batches(table):
+            validator.check(table, columns)
+            n_rows += len(columns["person_id"])
+        logging.info(f"Checked {n_rows:,} rows of {table}")
+
+    return validator.results()
+
+
+def summary(results: List[Violation]) -> str:
+    """
+    Return a table of the violations
+    """
+    lines = []
+    for v in results:
+        if v.count == 0:
+            continue
+        lines.append(
+            f"{v.check:<17} {v.table:<21} {', '.join(v.columns):<55} "
+            f"{v.count:>10,} / {v.n_rows:<11,} {v.detail} "
+            f"(e.g. person_id {', '.join(map(str, v.person_ids))})"
+        )
+    n_violations = sum(v.count for v in results)
+    n_checks = sum(v.count > 0 for v in results)
+    lines.append(f"{n_violations:,} violations in {n_checks} of {len(results)} checks")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO
+    )
+
+    parser = argparse.ArgumentParser(
+        description="Check the consistency of generated OMOP CDM data"
+    )
+    parser.add_argument(
+        "directory",
+        nargs="?",
+        help="Output directory of the generator (default: check the database)",
+    )
+    parser.add_argument(
+        "--format",
+        help="File format (default: parquet)",
+        choices=FILE_FORMATS,
+        default="parquet",
+    )
+    parser.add_argument(
+        "--vocabulary",
+        help="Take the domains of the concepts from this concept cache "
+        "(default: the domains in omop/concepts.py)",
+    )
+    parser.add_argument(
+        "--json", help="Write the results of all checks as JSON to FILE"
+    )
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    domains = concept_domains(args.vocabulary)
+    if args.directory is not None:
+        results = validate(
+            lambda table: file_batches(
+                args.directory, table, required_columns(table), args.format
+            ),
+            domains,
+        )
+    else:
+        # .credentials.json in the working directory, as for the generator
+        from random_data_generator import connect_db
+
+        with connect_db() as con, con.cursor() as cursor:
+            results = validate(
+                lambda table: database_batches(cursor, table, required_columns(table)),
+                domains,
+            )
+    logging.info(f"Checked in {time.perf_counter() - start:.1f} s")
+
+    print(summary(results))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump([v.asdict() for v in results], f, indent=2)
+
+    sys.exit(1 if any(v.count for v in results) else 0)
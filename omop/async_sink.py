@@ -0,0 +1,208 @@
+"""
+ASYNCHRONOUS DATABASE SINK
+
+This module contains a sink that writes OMOP CDM tables to PostgreSQL over a pool of
+connections (using asyncpg), overlapping the generation of patients with the network
+round trips of the database.
+
+The event loop runs in a background thread. Each full batch is handed over to it and
+the generator continues immediately; at most `max_pending` batches are in flight, so
+memory usage stays bounded if the database is slower than the generator. Within a
+batch, the `person` rows are written first (the other tables reference them); all
+other tables are then written in parallel, each over its own connection. The `person`
+rows of the next batch may be written while the other tables of the previous batch
+are still being written.
+
+Each COPY is committed on its own, i.e. unlike with `CopySink` the load is not a
+single transaction and an aborted run leaves the batches written so far.
+"""
+import asyncio
+import io
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import TYPE_CHECKING, Any, Deque, Dict, List, Optional, Tuple
+
+from omop.buffer import TableBuffer
+from omop.constants import COPY_FORMATS, DEFAULT_BATCH_SIZE
+from omop.pgcopy import copy_binary
+from omop.sink import BufferedSink, copy_text
+
+if TYPE_CHECKING:
+    from data_generator.instrumentation import Stats
+
+# tables that are referenced by the other tables and hence written first
+PARENT_TABLES = ("person",)
+
+DEFAULT_POOL_SIZE = 4
+
+# (table, number of rows, seconds) of each COPY
+FlushRecord = Tuple[str, int, float]
+
+
+class AsyncCopySink(BufferedSink):
+    """
+    Buffers rows per table and writes them with COPY over a pool of connections.
+
+    `settings` are the connection parameters (host, port, user, password, database) and
+    `schema` is used as search path of all connections.
+    """
+
+    def __init__(
+        self,
+        settings: Dict[str, Any],
+        schema: str = "cds_cdm",
+        pool_size: int = DEFAULT_POOL_SIZE,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        max_pending: int = 2,
+        stats: Optional["Stats"] = None,
+        copy_format: str = "binary",
+    ) -> None:
+        super().__init__(batch_size=batch_size, stats=stats)
+
+        try:
+            import asyncpg
+        except ImportError:
+            raise ImportError(
+                "Writing over several connections requires asyncpg (pip install asyncpg)"
+            )
+
+        if pool_size < 1:
+            raise ValueError("pool_size must be positive")
+        if max_pending < 1:
+            raise ValueError("max_pending must be positive")
+        if copy_format not in COPY_FORMATS:
+            raise ValueError(
+                f"Unknown COPY format {copy_format}, must be one of {COPY_FORMATS}"
+            )
+
+        self.max_pending = max_pending
+        self.copy_format = copy_format
+        self._futures: Deque["Future[List[FlushRecord]]"] = deque()
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._loop.run_forever, name="AsyncCopySink", daemon=True
+        )
+        self._thread.start()
+
+        # psycopg2 calls the database "dbname", asyncpg "database"
+        settings = dict(settings)
+        if "dbname" in settings:
+            settings["database"] = settings.pop("dbname")
+
+        self._pool, self._parent_lock = self._run(
+            self._connect(asyncpg, settings, schema, pool_size)
+        )
+
+    async def _connect(
+        self, asyncpg: Any, settings: Dict[str, Any], schema: str, pool_size: int
+    ) -> Tuple[Any, asyncio.Lock]:
+        """
+        Open the connection pool (and create the lock, which must belong to the event loop)
+        """
+        pool = await asyncpg.create_pool(
+            **settings,
+            min_size=pool_size,
+            max_size=pool_size,
+            server_settings={"search_path": schema},
+        )
+        return pool, asyncio.Lock()
+
+    def _run(self, coro: Any) -> Any:
+        """
+        Run a coroutine in the event loop and wait for its result
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def _flush_upto(self, table: str) -> None:
+        # a full batch is written asynchronously, together with its preceding tables
+        self._submit(upto=table)
+
+    def _submit(self, upto: Optional[str] = None) -> None:
+        """
+        Hand the pending rows of all tables up to `upto` (all tables, if None) over
+        to the event loop
+        """
+        batch = []
+        for table in self._table_order():
+            pending = self._pending[table]
+            if len(pending):
+                batch.append(pending)
+                self._pending[table] = TableBuffer(table)
+            if table == upto:
+                break
+
+        if not batch:
+            return
+
+        self._futures.append(
+            asyncio.run_coroutine_threadsafe(self._write_batch(batch), self._loop)
+        )
+
+        while len(self._futures) > self.max_pending:
+            self._collect(self._futures.popleft())
+
+    def _collect(self, future: "Future[List[FlushRecord]]") -> None:
+        """
+        Wait for a batch to be written (raising its error, if any) and record its statistics
+        """
+        for table, rows, seconds in future.result():
+            if self.stats is not None:
+                self.stats.add_flush(table, rows, seconds)
+
+    async def _write_batch(self, batch: List[TableBuffer]) -> List[FlushRecord]:
+        parents = [b for b in batch if b.table in PARENT_TABLES]
+        children = [b for b in batch if b.table not in PARENT_TABLES]
+
+        # batches are written in the order they were submitted (the lock is fair), so
+        # the parent rows of all earlier batches exist before any child row is written
+        async with self._parent_lock:
+            records = [await self._copy(buffer) for buffer in parents]
+
+        records += await asyncio.gather(*(self._copy(buffer) for buffer in children))
+
+        return records
+
+    async def _copy(self, buffer: TableBuffer) -> FlushRecord:
+        """
+        Write a buffer to its table with COPY (over any free connection of the pool)
+        """
+        start = time.perf_counter()
+
+        encode = copy_binary if self.copy_format == "binary" else copy_text
+        data = await asyncio.to_thread(encode, buffer)
+
+        async with self._pool.acquire() as con:
+            await con.copy_to_table(
+                buffer.table,
+                source=io.BytesIO(data),
+                columns=buffer.column_names,
+                format=self.copy_format,
+            )
+
+        return buffer.table, len(buffer), time.perf_counter() - start
+
+    def flush(self) -> None:
+        """
+        Submit all pending rows and wait until all batches are written
+        """
+        self._submit()
+
+        while self._futures:
+            self._collect(self._futures.popleft())
+
+    def close(self) -> None:
+        """
+        Write all pending rows, close the connections and stop the event loop
+        """
+        try:
+            self.flush()
+        finally:
+            for future in self._futures:
+                future.cancel()
+            self._run(self._pool.close())
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
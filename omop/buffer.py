@@ -0,0 +1,222 @@
+"""
+COLUMNAR TABLE BUFFERS
+
+This module contains a columnar (struct-of-arrays) buffer for the rows of an OMOP CDM
+table. The columns and their types are taken from the data classes in `omop.tables`.
+"""
+import dataclasses
+import datetime
+from typing import Any, Dict, Iterator, List, Tuple, cast
+
+import numpy as np
+
+from omop.tables import TABLES
+
+# numpy dtypes for the python types used in the data classes
+DTYPES: Dict[type, np.dtype] = {
+    int: np.dtype(np.int64),
+    float: np.dtype(np.float64),
+    datetime.date: np.dtype("datetime64[D]"),
+    datetime.datetime: np.dtype("datetime64[us]"),
+}
+
+INITIAL_CAPACITY = 1024
+
+
+@dataclasses.dataclass(frozen=True)
+class Column:
+    """
+    Column of an OMOP CDM table (name, numpy dtype and default value)
+    """
+
+    name: str
+    dtype: np.dtype
+    default: Any = dataclasses.MISSING
+
+
+_SCHEMA_CACHE: Dict[str, Tuple[Column, ...]] = {}
+
+
+def table_schema(table: str) -> Tuple[Column, ...]:
+    """
+    Return the columns of an OMOP CDM table as derived from its data class
+    """
+    schema = _SCHEMA_CACHE.get(table)
+
+    if schema is None:
+        if table not in TABLES:
+            raise ValueError(f"Unknown table {table}")
+        schema = tuple(
+            Column(name=f.name, dtype=DTYPES[cast(type, f.type)], default=f.default)
+            for f in dataclasses.fields(TABLES[table])
+        )
+        _SCHEMA_CACHE[table] = schema
+
+    return schema
+
+
+class TableBuffer:
+    """
+    Columnar buffer for the rows of an OMOP CDM table.
+
+    Each column is stored in a typed numpy array, which grows as rows are appended.
+    Rows can be appended one by one (`append`, `append_row`) or as whole columns
+    (`extend`), the latter without creating any python object per row.
+    """
+
+    def __init__(self, table: str, capacity: int = INITIAL_CAPACITY) -> None:
+        self.table = table
+        self.schema = table_schema(table)
+        self._size = 0
+        self._data: Dict[str, np.ndarray] = {
+            c.name: np.empty(max(capacity, 1), dtype=c.dtype) for c in self.schema
+        }
+
+    def __len__(self) -> int:
+        """
+        Return the number of rows in the buffer
+        """
+        return self._size
+
+    def __repr__(self) -> str:
+        """
+        Return a short description of the buffer
+        """
+        return f"TableBuffer(table={self.table!r}, rows={self._size})"
+
+    @property
+    def column_names(self) -> Tuple[str, ...]:
+        """
+        Names of the columns of the buffer
+        """
+        return tuple(c.name for c in self.schema)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Number of bytes used by the rows in the buffer
+        """
+        return sum(self._size * c.dtype.itemsize for c in self.schema)
+
+    def _reserve(self, n: int) -> None:
+        """
+        Make sure that `n` more rows fit into the buffer
+        """
+        capacity = max(len(self._data[self.schema[0].name]), 1)
+        required = self._size + n
+
+        if required <= capacity:
+            return
+
+        while capacity < required:
+            capacity *= 2
+
+        for name, data in self._data.items():
+            grown = np.empty(capacity, dtype=data.dtype)
+            grown[: self._size] = data[: self._size]
+            self._data[name] = grown
+
+    def _value(self, column: Column, values: Dict[str, Any]) -> Any:
+        if column.name in values:
+            return values[column.name]
+        if column.default is dataclasses.MISSING:
+            raise ValueError(f"No value for column {column.name} of {self.table}")
+        return column.default
+
+    def append(self, **values: Any) -> None:
+        """
+        Append a single row, given as column values (missing columns are set to their default)
+        """
+        self._reserve(1)
+        for column in self.schema:
+            self._data[column.name][self._size] = self._value(column, values)
+        self._size += 1
+
+    def append_row(self, row: Any) -> None:
+        """
+        Append a single row, given as data class instance
+        """
+        self._reserve(1)
+        for column in self.schema:
+            self._data[column.name][self._size] = getattr(row, column.name)
+        self._size += 1
+
+    def append_rows(self, rows: List[Any]) -> None:
+        """
+        Append rows, given as data class instances
+        """
+        for row in rows:
+            self.append_row(row)
+
+    def extend(self, **columns: Any) -> None:
+        """
+        Append rows, given as columns.
+
+        Each value is either an array with one value per row or a scalar that is used for all
+        rows. Missing columns are set to their default value.
+        """
+        n = None
+        for value in columns.values():
+            if np.ndim(value) > 0:
+                if n is not None and len(value) != n:
+                    raise ValueError("All columns must have the same length")
+                n = len(value)
+
+        if n is None:
+            raise ValueError("At least one column must be given as an array")
+
+        self._reserve(n)
+        for column in self.schema:
+            self._data[column.name][self._size : self._size + n] = self._value(
+                column, columns
+            )
+        self._size += n
+
+    def extend_buffer(self, other: "TableBuffer") -> None:
+        """
+        Append all rows of another buffer of the same table
+        """
+        if other.table != self.table:
+            raise ValueError(f"Cannot extend {self.table} with rows of {other.table}")
+        if len(other):
+            self.extend(**other.columns())
+
+    def columns(self) -> Dict[str, np.ndarray]:
+        """
+        Return the columns of the buffer (as views, valid until the buffer is modified)
+        """
+        return {name: data[: self._size] for name, data in self._data.items()}
+
+    def rows(self) -> Iterator[Tuple[Any, ...]]:
+        """
+        Iterate over the rows of the buffer as tuples of python values
+        """
+        return zip(*(data[: self._size].tolist() for data in self._data.values()))
+
+    def clear(self) -> None:
+        """
+        Remove all rows (the allocated memory is kept)
+        """
+        self._size = 0
+
+    def __getstate__(self) -> Dict[str, Any]:
+        """
+        Only pickle the used part of the columns
+        """
+        return {"table": self.table, "columns": self.columns()}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        """
+        Restore the buffer from its pickled columns
+        """
+        self.table = state["table"]
+        self.schema = table_schema(self.table)
+        self._data = {name: np.array(data) for name, data in state["columns"].items()}
+        self._size = len(next(iter(self._data.values())))
+
+
+def create_buffers() -> Dict[str, TableBuffer]:
+    """
+    Create an empty buffer for each table in `omop.tables.TABLES`
+    """
+    return {table: TableBuffer(table) for table in TABLES}
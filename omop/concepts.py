@@ -65,3 +65,61 @@ ARDS = 4195694
 # Allergies
 ALLERGY_HEPARIN = 4169185
 ALLERGY_HEPARINOID = 4170358
+
+# Expected domain of each standard concept above (checked against the vocabulary with
+# `python -m omop.vocabulary check`)
+DOMAINS = {
+    EHR: "Type Concept",
+    VISIT_TYPE_STILL_PATIENT: "Type Concept",
+    INTENSIVE_CARE: "Visit",
+    INPATIENT_VISIT: "Visit",
+    GENDER_FEMALE: "Gender",
+    GENDER_MALE: "Gender",
+    WEIGHT: "Measurement",
+    IDEAL_BODY_WEIGHT: "Measurement",
+    **dict.fromkeys(
+        [
+            HEPARIN,
+            ARGATROBAN,
+            DALTEPARIN,
+            ENOXAPARIN,
+            NADROPARIN,
+            CERTOPARIN,
+            FONDAPARINUX,
+        ],
+        "Drug",
+    ),
+    **dict.fromkeys(
+        [
+            UNIT_MG,
+            UNIT_UNIT,
+            UNIT_PERCENT,
+            UNIT_ML_PER_KG,
+            UNIT_CM_H2O,
+            UNIT_MM_HG,
+            UNIT_SECOND,
+            UNIT_UG_PER_L,
+            UNIT_KG,
+            UNIT_ML,
+        ],
+        "Unit",
+    ),
+    ARTIFICIAL_RESPIRATION: "Procedure",
+    OXYGEN_THERAPY: "Procedure",
+    PRONE_POSITIONING: "Procedure",
+    INHALED_OXYGEN_CONCENTRATION: "Measurement",
+    TIDAL_VOLUME: "Measurement",
+    PRESSURE_MAX: "Measurement",
+    PEEP: "Measurement",
+    LAB_DDIMER: "Measurement",
+    LAB_APTT: "Measurement",
+    LAB_HOROWITZ: "Measurement",
+    COVID19: "Condition",
+    VENOUS_THROMBOSIS: "Condition",
+    HEPARIN_INDUCED_THROMBOCYTOPENIA_WITH_THROMBOSIS: "Condition",
+    THROMBOCYTOPENIA: "Condition",
+    PULMONARY_EMBOLISM: "Condition",
+    ARDS: "Condition",
+    ALLERGY_HEPARIN: "Observation",
+    ALLERGY_HEPARINOID: "Observation",
+}
@@ -0,0 +1,29 @@
+"""
+CONSTANTS
+
+This module contains the names of the OMOP CDM tables and the defaults of the sinks. It
+has no dependencies, such that it can be imported without loading numpy or pydantic
+(e.g. by the command line interface before it knows whether any data is generated).
+"""
+from typing import Final
+
+# OMOP CDM tables in the order in which they must be loaded (parents before children),
+# see `omop.tables.TABLES`
+TABLE_NAMES: Final = (
+    "person",
+    "visit_occurrence",
+    "drug_exposure",
+    "procedure_occurrence",
+    "measurement",
+    "condition_occurrence",
+    "observation",
+)
+
+DEFAULT_BATCH_SIZE = 10000
+DEFAULT_ROWS_PER_FILE = 1_000_000
+
+# formats of COPY FROM STDIN used by `omop.sink.CopySink` (binary: see `omop.pgcopy`)
+COPY_FORMATS: Final = ("binary", "text")
+
+# file formats of `omop.sink.FileSink`
+FILE_FORMATS: Final = ("parquet", "csv")
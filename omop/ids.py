@@ -0,0 +1,82 @@
+"""
+ID ALLOCATION
+
+This module reserves blocks of ids (e.g. person_id) in the CDM database, such that
+several loader processes (on one or more hosts) can fill the same CDM concurrently
+without id conflicts.
+
+For each table, ids are drawn from a dedicated sequence `tdg_<table>_id_seq`. The
+sequence is created on first use and starts after the largest id that exists in the
+table at that time (this is the only time the table is scanned). A block is reserved
+by advancing the sequence by the size of the block while holding a transaction-level
+advisory lock; the reservation is committed immediately (on a separate connection),
+so it is never rolled back together with the data of the loader.
+
+Child tables whose ids are assigned by the database (serial/identity columns, e.g.
+measurement_id) are already safe to load concurrently; their blocks can be reserved
+in the same way if explicit ids are needed.
+"""
+import zlib
+from typing import Any
+
+SEQUENCE_TEMPLATE = "tdg_{table}_id_seq"
+
+
+def _lock_key(table: str) -> int:
+    """
+    Return the advisory lock key used for reserving ids of a table
+    """
+    return zlib.crc32(f"tdg_id_{table}".encode())
+
+
+class IdAllocator:
+    """
+    Reserves contiguous blocks of ids for OMOP CDM tables.
+
+    `con` must be a database connection that is not used for loading data, because
+    each reservation is committed immediately.
+    """
+
+    def __init__(self, con: Any) -> None:
+        self.con = con
+
+    def _ensure_sequence(self, cursor: Any, table: str, id_column: str) -> str:
+        sequence = SEQUENCE_TEMPLATE.format(table=table)
+
+        cursor.execute("SELECT to_regclass(%s)", (sequence,))
+        if cursor.fetchone()[0] is None:
+            cursor.execute(f"CREATE SEQUENCE IF NOT EXISTS {sequence} MINVALUE 0")
+            cursor.execute(f"SELECT MAX({id_column}) FROM {table}")  # nosec
+            max_id = cursor.fetchone()[0]
+            start = 0 if max_id is None else max_id + 1
+            # the next call of nextval() returns `start`
+            cursor.execute("SELECT setval(%s, %s, false)", (sequence, start))
+
+        return sequence
+
+    def reserve(self, table: str, n: int, id_column: str = "") -> range:
+        """
+        Reserve a block of `n` consecutive ids of `table` and return it
+        """
+        if n < 1:
+            raise ValueError("n must be positive")
+
+        id_column = id_column or f"{table}_id"
+
+        with self.con.cursor() as cursor:
+            try:
+                cursor.execute("SELECT pg_advisory_xact_lock(%s)", (_lock_key(table),))
+
+                sequence = self._ensure_sequence(cursor, table, id_column)
+
+                cursor.execute("SELECT nextval(%s)", (sequence,))
+                start = cursor.fetchone()[0]
+                # the next call of nextval() returns start + n
+                cursor.execute("SELECT setval(%s, %s, false)", (sequence, start + n))
+
+                self.con.commit()
+            except Exception:
+                self.con.rollback()
+                raise
+
+        return range(start, start + n)
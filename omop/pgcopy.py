@@ -0,0 +1,345 @@
+"""
+BINARY COPY
+
+This module encodes the rows of a columnar buffer in PostgreSQL's binary COPY format
+(`COPY ... FROM STDIN WITH (FORMAT binary)`), i.e. as the binary representation of each
+value instead of text.
+
+Each column is converted to its (big-endian) wire representation with a single numpy
+operation, e.g. dates to days and datetimes to microseconds since 2000-01-01. The rows
+are then assembled by stacking the fixed-width fields of all columns, or, if a column
+contains NULLs (which are shorter than the other fields), by scattering the fields to
+their offsets in the output. No python object is created per row or value.
+
+The PostgreSQL type of each column is derived from its numpy dtype, using the types of
+the OMOP CDM 5.4 (INTEGER for all integer columns, NUMERIC for `NUMERIC_COLUMNS`); other
+types (e.g. BIGINT ids) can be given explicitly.
+"""
+from typing import Callable, Dict, Final, List, Optional, Tuple
+
+import numpy as np
+
+from omop.buffer import TableBuffer
+
+# signature, flags and length of the header extension
+HEADER: Final = b"PGCOPY\n\xff\r\n\x00" + bytes(4) + bytes(4)
+TRAILER: Final = b"\xff\xff"
+
+# columns of type NUMERIC in the OMOP CDM 5.4
+NUMERIC_COLUMNS: Final = frozenset(
+    {"quantity", "value_as_number", "range_low", "range_high"}
+)
+
+POSTGRES_EPOCH: Final = np.datetime64("2000-01-01T00:00:00", "us")
+
+# significant decimal digits of floats that are written to NUMERIC columns
+# (DBL_DIG, as in PostgreSQL's float8 to numeric cast)
+NUMERIC_SIGNIFICANT_DIGITS = 15
+
+# floats in this range are rounded to significant digits with numpy operations, all
+# others (which are rare in generated data) one by one
+NUMERIC_VECTORIZED_RANGE = (1e-7, 1e14)
+
+# powers of ten that are exact as floats
+EXACT_POWERS_OF_TEN: Final = np.array([float(10**k) for k in range(23)])
+
+NUMERIC_POS = 0x0000
+NUMERIC_NEG = 0x4000
+NUMERIC_NDIGITS = 5  # base 10000 digits, enough for 15 significant decimal digits
+
+NUMERIC_DTYPE: Final = np.dtype(
+    [
+        ("ndigits", ">i2"),
+        ("weight", ">i2"),
+        ("sign", ">u2"),
+        ("dscale", ">u2"),
+        ("digits", ">i2", (NUMERIC_NDIGITS,)),
+    ]
+)
+
+INT4_MIN, INT4_MAX = -(2**31), 2**31 - 1
+
+# encoded values (big-endian) and mask of missing values (NULL), or None
+Encoded = Tuple[np.ndarray, Optional[np.ndarray]]
+
+
+def _check_range(data: np.ndarray, minimum: int, maximum: int, name: str) -> None:
+    if len(data) and (data.min() < minimum or data.max() > maximum):
+        raise ValueError(f"Value out of range for {name}")
+
+
+def encode_int4(data: np.ndarray) -> Encoded:
+    """
+    Encode integers as INTEGER
+    """
+    _check_range(data, INT4_MIN, INT4_MAX, "integer")
+    return data.astype(">i4"), None
+
+
+def encode_int8(data: np.ndarray) -> Encoded:
+    """
+    Encode integers as BIGINT
+    """
+    return data.astype(">i8"), None
+
+
+def encode_float8(data: np.ndarray) -> Encoded:
+    """
+    Encode floats as DOUBLE PRECISION (NaN is written as NULL)
+    """
+    missing = np.isnan(data)
+    return data.astype(">f8"), missing if missing.any() else None
+
+
+def encode_date(data: np.ndarray) -> Encoded:
+    """
+    Encode dates as DATE, i.e. days since 2000-01-01 (NaT is written as NULL)
+    """
+    missing = np.isnat(data)
+    days = (data.astype("datetime64[D]") - POSTGRES_EPOCH.astype("datetime64[D]")).view(
+        np.int64
+    )
+    days = np.where(missing, 0, days)
+    _check_range(days, INT4_MIN, INT4_MAX, "date")
+    return days.astype(">i4"), missing if missing.any() else None
+
+
+def encode_timestamp(data: np.ndarray) -> Encoded:
+    """
+    Encode datetimes as TIMESTAMP, i.e. microseconds since 2000-01-01 (NaT is written
+    as NULL)
+    """
+    missing = np.isnat(data)
+    microseconds = (data.astype("datetime64[us]") - POSTGRES_EPOCH).view(np.int64)
+    return microseconds.astype(">i8"), missing if missing.any() else None
+
+
+def _split(a: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Split floats into two halves of 26 significant bits (Dekker), whose products are exact
+    """
+    c = 134217729.0 * a  # 2**27 + 1
+    high = c - (c - a)
+    return high, a - high
+
+
+def _rint_product(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """
+    Return the exact product of floats rounded to the nearest integer (ties to even).
+
+    The product is computed without rounding error as the sum of the rounded product and
+    its error (Dekker's two product), such that the rounding is decided exactly.
+    """
+    product = a * b
+    a_high, a_low = _split(a)
+    b_high, b_low = _split(b)
+    error = (
+        (a_high * b_high - product) + a_high * b_low + a_low * b_high
+    ) + a_low * b_low
+
+    # product - rounded is exact, hence the comparisons with the error are exact
+    rounded = np.rint(product)
+    fraction = product - rounded
+    up = error > 0.5 - fraction
+    down = error < -0.5 - fraction
+    # ties between rounded and its neighbor, rounded to the even one
+    tie_up = (error == 0.5 - fraction) & (rounded % 2 == 1)
+    tie_down = (error == -0.5 - fraction) & (rounded % 2 == 1)
+
+    return rounded.astype(np.int64) + (up | tie_up) - (down | tie_down)
+
+
+def _significant_digits(magnitude: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Round positive floats to `NUMERIC_SIGNIFICANT_DIGITS` significant digits exactly as
+    printf's `%.15g` (i.e. the exact binary value, ties to even) and return the
+    mantissas (integers with as many digits) and the decimal exponents
+    """
+    mantissa = np.zeros(len(magnitude), dtype=np.int64)
+    exponent = np.zeros(len(magnitude), dtype=np.int64)
+
+    low, high = NUMERIC_VECTORIZED_RANGE
+    vectorized = (magnitude >= low) & (magnitude < high)
+    values = magnitude[vectorized]
+
+    # value = mantissa * 10**e, i.e. mantissa = value * 10**-e with an exact power of ten
+    e = np.floor(np.log10(values)).astype(np.int64) - NUMERIC_SIGNIFICANT_DIGITS + 1
+    for _ in range(3):
+        m = _rint_product(values, EXACT_POWERS_OF_TEN[-e])
+        # log10 may be off by one at powers of ten, or the value rounds to the next one
+        too_long = m >= 10**NUMERIC_SIGNIFICANT_DIGITS
+        too_short = m < 10 ** (NUMERIC_SIGNIFICANT_DIGITS - 1)
+        if not (too_long | too_short).any():
+            break
+        e += too_long
+        e -= too_short
+    mantissa[vectorized] = m
+    exponent[vectorized] = e
+
+    for i in np.flatnonzero(~vectorized & (magnitude > 0)):
+        (
+            digits,
+            _,
+            power,
+        ) = f"{magnitude[i]:.{NUMERIC_SIGNIFICANT_DIGITS - 1}e}".partition("e")
+        mantissa[i] = int(digits.replace(".", ""))
+        exponent[i] = int(power) - NUMERIC_SIGNIFICANT_DIGITS + 1
+
+    return mantissa, exponent
+
+
+def encode_numeric(data: np.ndarray) -> Encoded:
+    """
+    Encode numbers as NUMERIC (NaN is written as NULL).
+
+    Integers are written exactly, floats rounded to `NUMERIC_SIGNIFICANT_DIGITS`
+    significant digits like `%.15g` and with the display scale of the shortest such
+    decimal, but at least one decimal digit (e.g. 36.6 and 30.0, as in the text format;
+    unlike the text format, which writes up to 17 digits, the value equals PostgreSQL's
+    float8 to numeric cast).
+
+    Each value is written as `NUMERIC_NDIGITS` base 10000 digits, including leading and
+    trailing zero digits, which PostgreSQL strips when it stores the value.
+    """
+    missing: Optional[np.ndarray] = None
+    min_scale = 0
+
+    if np.issubdtype(data.dtype, np.integer):
+        if len(data) and np.abs(data).max() >= 10**NUMERIC_SIGNIFICANT_DIGITS:
+            raise ValueError("Value out of range for numeric")
+        sign = data < 0
+        mantissa = np.abs(data).astype(np.int64)
+        exponent = np.zeros(len(data), dtype=np.int64)
+    else:
+        missing = np.isnan(data)
+        if np.isinf(data).any():
+            raise ValueError("Cannot write infinite values to a numeric column")
+        values = np.where(missing, 0.0, data)
+        sign = values < 0
+
+        # value = mantissa * 10**exponent with a mantissa of (at most) 15 digits
+        mantissa, exponent = _significant_digits(np.abs(values))
+
+        if not missing.any():
+            missing = None
+        min_scale = 1
+
+    # remove trailing zeros, such that the display scale is that of the shortest decimal
+    for _ in range(NUMERIC_SIGNIFICANT_DIGITS):
+        trailing = (mantissa % 10 == 0) & (mantissa > 0)
+        if not trailing.any():
+            break
+        mantissa[trailing] //= 10
+        exponent[trailing] += 1
+    exponent[mantissa == 0] = 0
+
+    # align the exponent to base 10000 digits: value = mantissa * 10**shift * 10000**q
+    q = exponent // 4
+    mantissa = mantissa * 10 ** (exponent - 4 * q)
+
+    encoded = np.zeros(len(data), dtype=NUMERIC_DTYPE)
+    encoded["ndigits"] = NUMERIC_NDIGITS
+    encoded["weight"] = q + NUMERIC_NDIGITS - 1
+    encoded["sign"] = np.where(sign, NUMERIC_NEG, NUMERIC_POS)
+    encoded["dscale"] = np.maximum(-exponent, min_scale)
+    for i in range(NUMERIC_NDIGITS):
+        encoded["digits"][:, NUMERIC_NDIGITS - 1 - i] = mantissa % 10000
+        mantissa //= 10000
+
+    return encoded, missing
+
+
+ENCODERS: Dict[str, Callable[[np.ndarray], Encoded]] = {
+    "int4": encode_int4,
+    "int8": encode_int8,
+    "float8": encode_float8,
+    "numeric": encode_numeric,
+    "date": encode_date,
+    "timestamp": encode_timestamp,
+}
+
+
+def column_types(buffer: TableBuffer) -> Dict[str, str]:
+    """
+    Return the PostgreSQL type (key of `ENCODERS`) of each column of a buffer, according
+    to the OMOP CDM 5.4
+    """
+    types = {}
+
+    for column in buffer.schema:
+        if column.name in NUMERIC_COLUMNS:
+            types[column.name] = "numeric"
+        elif column.dtype == np.dtype("datetime64[D]"):
+            types[column.name] = "date"
+        elif column.dtype == np.dtype("datetime64[us]"):
+            types[column.name] = "timestamp"
+        elif np.issubdtype(column.dtype, np.integer):
+            types[column.name] = "int4"
+        elif np.issubdtype(column.dtype, np.floating):
+            types[column.name] = "float8"
+        else:
+            raise ValueError(f"No binary encoding for column {column.name}")
+
+    return types
+
+
+def _fields(values: np.ndarray) -> np.ndarray:
+    """
+    Return the encoded values as fields (length and bytes of the value), one row per value
+    """
+    n, width = len(values), values.dtype.itemsize
+    lengths = np.full(n, width, dtype=">i4").view(np.uint8).reshape(n, 4)
+    return np.hstack([lengths, values.view(np.uint8).reshape(n, width)])
+
+
+def copy_binary(buffer: TableBuffer, types: Optional[Dict[str, str]] = None) -> bytes:
+    """
+    Encode the rows of a buffer in PostgreSQL's binary COPY format.
+
+    `types` overrides the PostgreSQL type of columns (see `column_types`).
+    """
+    n = len(buffer)
+    column_type = column_types(buffer)
+    if types is not None:
+        column_type.update(types)
+
+    fields: List[np.ndarray] = []
+    missing: List[Optional[np.ndarray]] = []
+    for name, data in buffer.columns().items():
+        values, null = ENCODERS[column_type[name]](data)
+        fields.append(_fields(values))
+        missing.append(null)
+
+    count = (
+        np.full(n, len(fields), dtype=">i2").view(np.uint8).reshape(n, 2)
+        if n
+        else np.empty((0, 2), dtype=np.uint8)
+    )
+
+    if all(null is None for null in missing):
+        # fixed-width rows
+        body = np.hstack([count, *fields])
+        return HEADER + body.tobytes() + TRAILER
+
+    # a NULL field is only its length (-1), i.e. the fields of a column do not have
+    # the same offset in each row
+    lengths = [
+        np.full(n, f.shape[1]) if null is None else np.where(null, 4, f.shape[1])
+        for f, null in zip(fields, missing)
+    ]
+    row_lengths = 2 + np.sum(lengths, axis=0)
+    offset = np.concatenate([[0], np.cumsum(row_lengths)[:-1]])
+
+    body = np.empty(int(row_lengths.sum()), dtype=np.uint8)
+    body[offset[:, None] + np.arange(2)] = count
+    offset = offset + 2
+
+    for f, null, length in zip(fields, missing, lengths):
+        if null is None:
+            body[offset[:, None] + np.arange(f.shape[1])] = f
+        else:
+            body[offset[~null, None] + np.arange(f.shape[1])] = f[~null]
+            body[offset[null, None] + np.arange(4)] = 0xFF
+        offset = offset + length
+
+    return HEADER + body.tobytes() + TRAILER
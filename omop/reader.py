@@ -0,0 +1,103 @@
+"""
+READERS
+
+This module reads the tables written by `omop.sink.FileSink` (Parquet or gzip
+compressed CSV files) or the tables of the database back as batches of numpy columns
+(with the dtypes of `omop.buffer`), such that generated data can be checked or
+evaluated without holding a whole table in memory. Only the requested columns are read.
+"""
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Sequence, Union
+
+import numpy as np
+
+from omop.buffer import table_schema
+
+Columns = Dict[str, np.ndarray]
+
+# number of rows per batch (Parquet)
+BATCH_SIZE = 1 << 20
+
+
+def table_files(
+    directory: Union[str, Path], table: str, file_format: str
+) -> List[Path]:
+    """
+    Return the files of a table written by `omop.sink.FileSink` (including those of the
+    shards in subdirectories, see `data_generator.shards`)
+    """
+    suffix = "parquet" if file_format == "parquet" else "csv.gz"
+    return sorted(Path(directory).glob(f"**/{table}/part-*.{suffix}"))
+
+
+def _csv_convert_options(table: str, columns: Sequence[str]) -> Any:
+    import pyarrow as pa
+    import pyarrow.csv as pv
+
+    types = {
+        np.dtype(np.int64): pa.int64(),
+        np.dtype(np.float64): pa.float64(),
+        np.dtype("datetime64[D]"): pa.date32(),
+        np.dtype("datetime64[us]"): pa.timestamp("us"),
+    }
+    return pv.ConvertOptions(
+        column_types={
+            c.name: types[c.dtype] for c in table_schema(table) if c.name in columns
+        },
+        include_columns=list(columns),
+    )
+
+
+def _numpy_columns(batch: Any) -> Columns:
+    return {
+        name: column.to_numpy(zero_copy_only=False)
+        for name, column in zip(batch.schema.names, batch.columns)
+    }
+
+
+def file_batches(
+    directory: Union[str, Path],
+    table: str,
+    columns: Sequence[str],
+    file_format: str = "parquet",
+    batch_size: int = BATCH_SIZE,
+) -> Iterator[Columns]:
+    """
+    Read columns of a table from the files written by `omop.sink.FileSink` in batches
+    """
+    import pyarrow.csv as pv
+    import pyarrow.parquet as pq
+
+    for path in table_files(directory, table, file_format):
+        if file_format == "parquet":
+            batches = pq.ParquetFile(path).iter_batches(
+                batch_size=batch_size, columns=list(columns)
+            )
+        else:
+            batches = pv.open_csv(
+                path, convert_options=_csv_convert_options(table, columns)
+            )
+        for batch in batches:
+            yield _numpy_columns(batch)
+
+
+def database_batches(
+    cursor: Any, table: str, columns: Sequence[str]
+) -> Iterator[Columns]:
+    """
+    Read columns of a table of the CDM in batches (the table is copied to a temporary
+    CSV file with COPY TO STDOUT)
+    """
+    import pyarrow.csv as pv
+
+    with tempfile.TemporaryFile() as f:
+        cursor.copy_expert(
+            f"COPY (SELECT {', '.join(columns)} FROM {table}) "  # nosec
+            "TO STDOUT WITH (FORMAT csv, HEADER)",
+            f,
+        )
+        f.seek(0)
+        convert_options = _csv_convert_options(table, columns)
+        for batch in pv.open_csv(f, convert_options=convert_options):
+            yield _numpy_columns(batch)
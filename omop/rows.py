@@ -0,0 +1,64 @@
+"""
+FAST ROW CLASSES
+
+This module provides row classes for the OMOP CDM tables that skip pydantic's validation.
+
+The classes are generated from the (validating) data classes in `omop.tables`, which
+stay the single definition of fields, types and defaults. They are plain data classes
+with `__slots__`, i.e. they are cheap to construct and small, and are used for the
+(trusted) output of the generator.
+
+Validation can be switched on for debugging by setting the environment variable
+`OMOP_VALIDATE_ROWS=1` before this module is imported; the classes exported here
+are then the validating classes from `omop.tables`.
+"""
+import dataclasses
+import os
+from typing import Any, Dict, List, Tuple
+
+from omop import tables
+
+VALIDATE_ROWS = os.environ.get("OMOP_VALIDATE_ROWS", "0") not in ("", "0")
+
+_FAST_CLASSES: Dict[type, type] = {}
+
+
+def fast_row_class(cls: type) -> type:
+    """
+    Return a data class with `__slots__` and the same fields as `cls`, but without
+    validation
+    """
+    if cls in _FAST_CLASSES:
+        return _FAST_CLASSES[cls]
+
+    fields: List[Tuple[str, Any, Any]] = []
+    for f in dataclasses.fields(cls):
+        if f.default is not dataclasses.MISSING:
+            fields.append((f.name, f.type, dataclasses.field(default=f.default)))
+        else:
+            fields.append((f.name, f.type, dataclasses.field()))
+
+    fast = dataclasses.make_dataclass(
+        cls.__name__, fields, namespace={"__doc__": cls.__doc__}, slots=True
+    )
+    fast.__module__ = __name__
+
+    _FAST_CLASSES[cls] = fast
+
+    return fast
+
+
+def row_class(cls: type) -> type:
+    """
+    Return the class used for rows of `cls` (the fast class, unless validation is enabled)
+    """
+    return cls if VALIDATE_ROWS else fast_row_class(cls)
+
+
+Person = row_class(tables.Person)
+VisitOccurrence = row_class(tables.VisitOccurrence)
+ProcedureOccurrence = row_class(tables.ProcedureOccurrence)
+DrugExposure = row_class(tables.DrugExposure)
+Measurement = row_class(tables.Measurement)
+ConditionOccurrence = row_class(tables.ConditionOccurrence)
+Observation = row_class(tables.Observation)
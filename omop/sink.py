@@ -0,0 +1,479 @@
+"""
+SINKS
+
+This module contains the sinks that write generated OMOP CDM rows to a database or to files.
+"""
+import dataclasses
+import gzip
+import io
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+
+from omop.buffer import TableBuffer
+from omop.constants import (
+    COPY_FORMATS,
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_ROWS_PER_FILE,
+    FILE_FORMATS,
+)
+from omop.pgcopy import copy_binary
+from omop.tables import TABLES
+
+if TYPE_CHECKING:
+    from data_generator.instrumentation import Stats
+
+_COLUMN_CACHE: Dict[type, Tuple[str, ...]] = {}
+
+
+def row_columns(row: Any) -> Tuple[str, ...]:
+    """
+    Return the column names of a row (i.e. the field names of its data class)
+    """
+    return _columns_of_type(type(row))
+
+
+def _columns_of_type(cls: type) -> Tuple[str, ...]:
+    columns = _COLUMN_CACHE.get(cls)
+    if columns is None:
+        columns = tuple(f.name for f in dataclasses.fields(cls))
+        _COLUMN_CACHE[cls] = columns
+    return columns
+
+
+def row_values(row: Any, columns: Tuple[str, ...]) -> Tuple[Any, ...]:
+    """
+    Return the values of a row in the order of `columns`
+    """
+    return tuple(getattr(row, c) for c in columns)
+
+
+def _format_column(data: np.ndarray, null: bytes) -> np.ndarray:
+    """
+    Format a numeric or datetime column as text (bytes array), using `null` for missing values
+    """
+    if np.issubdtype(data.dtype, np.datetime64):
+        text = np.char.encode(np.datetime_as_string(data))
+        missing = np.isnat(data)
+    else:
+        text = data.astype(np.bytes_)
+        missing = np.isnan(data) if np.issubdtype(data.dtype, np.floating) else None
+
+    if missing is not None and missing.any():
+        text = np.where(missing, null, text)
+
+    return text
+
+
+def delimited_text(buffer: TableBuffer, delimiter: bytes, null: bytes) -> bytes:
+    """
+    Encode the rows of a buffer as delimited text (one line per row).
+
+    The columns are formatted as fixed-width byte arrays, which are concatenated
+    column-wise. The NUL padding of the fixed-width fields is removed afterwards, hence
+    no python object is created per row.
+    """
+    if not len(buffer):
+        return b""
+
+    text = None
+    for data in buffer.columns().values():
+        column = _format_column(data, null)
+        text = (
+            column
+            if text is None
+            else np.char.add(np.char.add(text, delimiter), column)
+        )
+    assert text is not None  # every table has columns
+
+    text = np.char.add(text, b"\n")
+
+    return text.tobytes().replace(b"\x00", b"")
+
+
+def copy_text(buffer: TableBuffer) -> bytes:
+    """
+    Encode the rows of a buffer in PostgreSQL's COPY text format
+    """
+    return delimited_text(buffer, delimiter=b"\t", null=b"\\N")
+
+
+def csv_text(buffer: TableBuffer) -> bytes:
+    """
+    Encode the rows of a buffer as CSV (without header, empty fields are NULL)
+    """
+    return delimited_text(buffer, delimiter=b",", null=b"")
+
+
+def _table_position(table: str) -> int:
+    order = list(TABLES)
+    return order.index(table) if table in order else len(order)
+
+
+class Sink(ABC):
+    """
+    Base class for a writer of OMOP CDM rows.
+    """
+
+    @abstractmethod
+    def write(self, table: str, rows: Iterable[Any]) -> None:
+        """
+        Write rows (data class instances) to the given table
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def write_buffer(self, buffer: TableBuffer) -> None:
+        """
+        Write the rows of a columnar buffer to its table
+        """
+        raise NotImplementedError()
+
+    def write_buffers(self, buffers: Dict[str, TableBuffer]) -> None:
+        """
+        Write several buffers (in the load order of `omop.tables.TABLES`)
+        """
+        for table in sorted(buffers, key=_table_position):
+            self.write_buffer(buffers[table])
+
+    def flush(self) -> None:
+        """
+        Write out all pending rows
+        """
+
+    def close(self) -> None:
+        """
+        Flush pending rows and release resources
+        """
+        self.flush()
+
+    def __enter__(self) -> "Sink":
+        """
+        Enter the context manager
+        """
+        return self
+
+    def __exit__(self, exc_type: Any, exc_value: Any, traceback: Any) -> None:
+        """
+        Close the sink when leaving the context manager (only if no exception occurred)
+        """
+        if exc_type is None:
+            self.close()
+
+
+class InsertSink(Sink):
+    """
+    Writes each row with a separate INSERT statement.
+
+    This is slow (one round trip per row) and only kept as a fallback for databases
+    that do not support COPY.
+    """
+
+    def __init__(self, cursor: Any, stats: Optional["Stats"] = None) -> None:
+        self.cursor = cursor
+        self.stats = stats
+
+    def _insert(
+        self, table: str, columns: Tuple[str, ...], rows: Iterable[Tuple[Any, ...]]
+    ) -> None:
+        value_placeholder = ", ".join(["%s"] * len(columns))
+        sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({value_placeholder})"
+        start = time.perf_counter()
+        n = 0
+        for values in rows:
+            self.cursor.execute(sql, values)
+            n += 1
+        if self.stats is not None and n:
+            self.stats.add_flush(table, n, time.perf_counter() - start)
+
+    def write(self, table: str, rows: Iterable[Any]) -> None:
+        """
+        Insert the rows into the given table, one statement per row
+        """
+        for row in rows:
+            columns = row_columns(row)
+            self._insert(table, columns, [row_values(row, columns)])
+
+    def write_buffer(self, buffer: TableBuffer) -> None:
+        """
+        Insert the rows of the buffer into its table, one statement per row
+        """
+        self._insert(buffer.table, buffer.column_names, buffer.rows())
+
+
+class MemorySink(Sink):
+    """
+    Keeps all rows in columnar buffers in memory (e.g. for benchmarks).
+    """
+
+    def __init__(self) -> None:
+        self.buffers: Dict[str, TableBuffer] = {}
+
+    def _buffer(self, table: str) -> TableBuffer:
+        if table not in self.buffers:
+            self.buffers[table] = TableBuffer(table)
+        return self.buffers[table]
+
+    def write(self, table: str, rows: Iterable[Any]) -> None:
+        """
+        Append the rows to the buffer of the table
+        """
+        self._buffer(table).append_rows(list(rows))
+
+    def write_buffer(self, buffer: TableBuffer) -> None:
+        """
+        Append the rows of the buffer to the buffer of its table
+        """
+        self._buffer(buffer.table).extend_buffer(buffer)
+
+    def row_counts(self) -> Dict[str, int]:
+        """
+        Return the number of rows written per table
+        """
+        return {table: len(buffer) for table, buffer in self.buffers.items()}
+
+
+class BufferedSink(Sink):
+    """
+    Base class for sinks that collect rows per table and write them in batches.
+
+    A table is written as soon as `batch_size` rows are pending for it. To satisfy
+    foreign key constraints, all tables that precede it in `omop.tables.TABLES`
+    are written first (see `_flush_upto`). If `stats` is given, the number of rows and
+    the latency of each write are recorded.
+    """
+
+    def __init__(
+        self, batch_size: int = DEFAULT_BATCH_SIZE, stats: Optional["Stats"] = None
+    ) -> None:
+        if batch_size < 1:
+            raise ValueError("batch_size must be positive")
+
+        self.batch_size = batch_size
+        self.stats = stats
+        self._pending: Dict[str, TableBuffer] = {}
+
+    @abstractmethod
+    def _flush_upto(self, table: str) -> None:
+        """
+        Write the pending rows of `table` and of all tables that precede it
+        """
+        raise NotImplementedError()
+
+    def _buffer(self, table: str) -> TableBuffer:
+        if table not in self._pending:
+            self._pending[table] = TableBuffer(table)
+        return self._pending[table]
+
+    def write(self, table: str, rows: Iterable[Any]) -> None:
+        """
+        Buffer the rows and write the table if the batch is full
+        """
+        pending = self._buffer(table)
+
+        for row in rows:
+            pending.append_row(row)
+
+        if len(pending) >= self.batch_size:
+            self._flush_upto(table)
+
+    def write_buffer(self, buffer: TableBuffer) -> None:
+        """
+        Buffer the rows of the buffer and write the table if the batch is full
+        """
+        pending = self._buffer(buffer.table)
+        pending.extend_buffer(buffer)
+
+        if len(pending) >= self.batch_size:
+            self._flush_upto(buffer.table)
+
+    def _table_order(self) -> List[str]:
+        return sorted(self._pending, key=_table_position)
+
+
+class SyncBufferedSink(BufferedSink):
+    """
+    Base class for buffered sinks that write one table at a time and wait until it is
+    written (see `_write_table`).
+    """
+
+    @abstractmethod
+    def _write_table(self, buffer: TableBuffer) -> None:
+        """
+        Write a batch of rows of a single table
+        """
+        raise NotImplementedError()
+
+    def flush(self) -> None:
+        """
+        Write all pending rows of all tables
+        """
+        for table in self._table_order():
+            self._flush_table(table)
+
+    def _flush_upto(self, table: str) -> None:
+        for t in self._table_order():
+            self._flush_table(t)
+            if t == table:
+                break
+
+    def _flush_table(self, table: str) -> None:
+        pending = self._pending.get(table)
+        if not pending:
+            return
+
+        start = time.perf_counter()
+        self._write_table(pending)
+        if self.stats is not None:
+            self.stats.add_flush(table, len(pending), time.perf_counter() - start)
+        pending.clear()
+
+
+class CopySink(SyncBufferedSink):
+    """
+    Buffers rows per table and streams them to PostgreSQL using COPY FROM STDIN, in
+    binary (default, see `omop.pgcopy`) or text format.
+    """
+
+    COPY_FORMATS = COPY_FORMATS
+
+    def __init__(
+        self,
+        cursor: Any,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        stats: Optional["Stats"] = None,
+        copy_format: str = "binary",
+    ) -> None:
+        super().__init__(batch_size=batch_size, stats=stats)
+        if copy_format not in self.COPY_FORMATS:
+            raise ValueError(
+                f"Unknown COPY format {copy_format}, must be one of {self.COPY_FORMATS}"
+            )
+        self.cursor = cursor
+        self.copy_format = copy_format
+
+    def _write_table(self, buffer: TableBuffer) -> None:
+        columns = ", ".join(buffer.column_names)
+        if self.copy_format == "binary":
+            data = copy_binary(buffer)
+        else:
+            data = copy_text(buffer)
+        self.cursor.copy_expert(
+            f"COPY {buffer.table} ({columns}) FROM STDIN "
+            f"WITH (FORMAT {self.copy_format})",
+            io.BytesIO(data),
+        )
+
+
+class FileSink(SyncBufferedSink):
+    """
+    Writes each table to a directory of Parquet or gzip compressed CSV files.
+
+    The rows of table `t` are written to `output_dir/t/part-00000.parquet` (or
+    `.csv.gz`), ...; each batch of `batch_size` rows is appended to the current file
+    (as a row group in case of Parquet) and a new file is started after `rows_per_file`
+    rows. Thus, memory usage does not depend on the number of generated rows. The files
+    of a previous run in the directory of a table are removed when the table is first
+    written.
+    """
+
+    FORMATS = FILE_FORMATS
+
+    def __init__(
+        self,
+        output_dir: Union[str, Path],
+        file_format: str = "parquet",
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        rows_per_file: int = DEFAULT_ROWS_PER_FILE,
+        stats: Optional["Stats"] = None,
+    ) -> None:
+        super().__init__(batch_size=batch_size, stats=stats)
+
+        if file_format not in self.FORMATS:
+            raise ValueError(
+                f"Unknown format {file_format}, must be one of {self.FORMATS}"
+            )
+
+        if file_format == "parquet":
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                raise ImportError(
+                    "Writing Parquet files requires pyarrow (pip install pyarrow)"
+                )
+
+        self.output_dir = Path(output_dir)
+        self.file_format = file_format
+        self.rows_per_file = rows_per_file
+        self._writers: Dict[str, Any] = {}
+        self._rows_in_file: Dict[str, int] = {}
+        self._file_index: Dict[str, int] = {}
+
+    def _file_name(self, table: str) -> Path:
+        suffix = "parquet" if self.file_format == "parquet" else "csv.gz"
+        return self.output_dir / table / f"part-{self._file_index[table]:05d}.{suffix}"
+
+    def _open(self, buffer: TableBuffer) -> Any:
+        table = buffer.table
+        if table not in self._file_index:
+            # remove the files of a previous run, which may have had more parts
+            for stale in (self.output_dir / table).glob("part-*"):
+                stale.unlink()
+        self._file_index[table] = self._file_index.get(table, -1) + 1
+        self._rows_in_file[table] = 0
+
+        path = self._file_name(table)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        if self.file_format == "parquet":
+            import pyarrow.parquet as pq
+
+            return pq.ParquetWriter(path, _arrow_table(buffer).schema)
+
+        f = gzip.open(path, "wb")
+        f.write(",".join(buffer.column_names).encode() + b"\n")
+        return f
+
+    def _close_writer(self, table: str) -> None:
+        writer = self._writers.pop(table, None)
+        if writer is not None:
+            writer.close()
+
+    def _write_table(self, buffer: TableBuffer) -> None:
+        table = buffer.table
+
+        if (
+            table in self._writers
+            and self._rows_in_file[table] + len(buffer) > self.rows_per_file
+        ):
+            self._close_writer(table)
+
+        if table not in self._writers:
+            self._writers[table] = self._open(buffer)
+
+        if self.file_format == "parquet":
+            self._writers[table].write_table(_arrow_table(buffer))
+        else:
+            self._writers[table].write(csv_text(buffer))
+
+        self._rows_in_file[table] += len(buffer)
+
+    def close(self) -> None:
+        """
+        Write all pending rows and close the files
+        """
+        self.flush()
+        for table in list(self._writers):
+            self._close_writer(table)
+
+
+def _arrow_table(buffer: TableBuffer) -> Any:
+    """
+    Convert a buffer to a pyarrow table (without copying the columns, if possible)
+    """
+    import pyarrow as pa
+
+    return pa.table(buffer.columns())
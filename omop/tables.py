@@ -4,36 +4,39 @@ DATA CLASSES
 This module contains the data classes used in the OMOP CDM.
 """
 import datetime
-import random
 
 pass
 
+import numpy as np
 from pydantic.dataclasses import dataclass
 
-from data_generator import parameter as params
 from omop import concepts
 
 # DUMMY_* values are used as default values for the data classes,
 # in order to use required fields without having to provide a value.
-# The value will then be set in the __post_init__ function of the
-# respective data class.
+# The values of persons and visits are set when they are created
+# (see `data_generator.generator.create_person` / `create_visit`).
 DUMMY_DATE = datetime.date(1900, 1, 1)
 DUMMY_DATETIME = datetime.datetime(1900, 1, 1, 0, 0, 0)
 DUMMY_INT = -1
 DUMMY_CONCEPT_ID = concepts.UNKNOWN
 
 
-def random_date(start_date: datetime.date, end_date: datetime.date) -> datetime.date:
+def random_date(
+    start_date: datetime.date, end_date: datetime.date, rng: np.random.Generator
+) -> datetime.date:
     """Generate a random datetime between `start_date` and `end_date`"""
     return start_date + datetime.timedelta(
-        days=random.randint(0, (end_date - start_date).days),
+        days=int(rng.integers(0, (end_date - start_date).days, endpoint=True)),
     )
 
 
-def random_datetime(date: datetime.date, max_hours: int = 24) -> datetime.datetime:
+def random_datetime(
+    date: datetime.date, rng: np.random.Generator, max_hours: int = 24
+) -> datetime.datetime:
     """Generate a random datetime between `date` and `date` + 1 day"""
     return datetime.datetime.combine(date, datetime.time()) + datetime.timedelta(
-        seconds=random.randint(0, max_hours * 3600)
+        seconds=int(rng.integers(0, max_hours * 3600, endpoint=True))
     )
 
 
@@ -45,7 +48,7 @@ class Person:
 
     person_id: int
     birth_datetime: datetime.datetime = DUMMY_DATETIME
-    # All further values will be overwritten in __post_init__
+    # All further values are set by create_person
     gender_concept_id: int = DUMMY_CONCEPT_ID
     year_of_birth: int = DUMMY_INT
     month_of_birth: int = DUMMY_INT
@@ -53,23 +56,6 @@ class Person:
     race_concept_id: int = DUMMY_CONCEPT_ID
     ethnicity_concept_id: int = DUMMY_CONCEPT_ID
 
-    def __post_init__(self) -> None:
-        """
-        Set the default values for the person.
-        """
-        self.gender_concept_id = random.choice(list(params.GENDER_LIST))
-        date = random_date(
-            datetime.date(1920, 1, 1), datetime.date(2003, 12, 31)
-        )
-        self.birth_datetime = random_datetime(date)
-
-        self.year_of_birth = self.birth_datetime.year
-        self.month_of_birth = self.birth_datetime.month
-        self.day_of_birth = self.birth_datetime.day
-
-        self.race_concept_id = concepts.UNKNOWN  # always set to zero / unknown
-        self.ethnicity_concept_id = concepts.UNKNOWN  # always set to zero / unknown
-
 
 @dataclass
 class VisitOccurrence:
@@ -78,7 +64,7 @@ class VisitOccurrence:
     """
 
     person_id: int
-    # All following values will be overwritten in __post_init__
+    # All following values are set by create_visit
     visit_concept_id: int = DUMMY_CONCEPT_ID
     visit_start_date: datetime.date = DUMMY_DATE
     visit_start_datetime: datetime.datetime = DUMMY_DATETIME
@@ -86,21 +72,6 @@ class VisitOccurrence:
     visit_end_datetime: datetime.datetime = DUMMY_DATETIME
     visit_type_concept_id: int = DUMMY_CONCEPT_ID
 
-    def __post_init__(self) -> None:
-        """
-        Set the default values for the visit occurrence.
-        """
-        self.visit_concept_id = random.choice(list(params.VISIT_CONCEPTS))
-        self.visit_start_date = random_date(
-            start_date=params.VISIT_START_DATE, end_date=params.VISIT_END_DATE
-        )
-        self.visit_start_datetime = random_datetime(self.visit_start_date)
-        self.visit_end_date = self.visit_start_date + datetime.timedelta(
-            days=random.choice(range(3, 60))
-        )
-        self.visit_end_datetime = random_datetime(self.visit_start_date)
-        self.visit_type_concept_id = concepts.VISIT_TYPE_STILL_PATIENT
-
 
 @dataclass
 class ProcedureOccurrence:
@@ -130,13 +101,7 @@ class DrugExposure:
     drug_exposure_end_date: datetime.date
     drug_exposure_end_datetime: datetime.datetime
     quantity: int
-    drug_type_concept_id: int = DUMMY_CONCEPT_ID
-
-    def __post_init__(self) -> None:
-        """
-        Set the drug_type_concept_id to EHR
-        """
-        self.drug_type_concept_id = concepts.EHR
+    drug_type_concept_id: int = concepts.EHR
 
 
 @dataclass
@@ -151,13 +116,7 @@ class Measurement:
     measurement_datetime: datetime.datetime
     value_as_number: float
     unit_concept_id: int
-    measurement_type_concept_id: int = DUMMY_CONCEPT_ID
-
-    def __post_init__(self) -> None:
-        """
-        Set measurement_type_concept_id to EHR
-        """
-        self.measurement_type_concept_id = concepts.EHR
+    measurement_type_concept_id: int = concepts.EHR
 
 
 @dataclass
@@ -172,13 +131,7 @@ class ConditionOccurrence:
     condition_start_datetime: datetime.datetime
     condition_end_date: datetime.date
     condition_end_datetime: datetime.datetime
-    condition_type_concept_id: int = DUMMY_CONCEPT_ID
-
-    def __post_init__(self) -> None:
-        """
-        Set condition_type_concept_id to EHR
-        """
-        self.condition_type_concept_id = concepts.EHR
+    condition_type_concept_id: int = concepts.EHR
 
 
 @dataclass
@@ -191,10 +144,18 @@ class Observation:
     observation_concept_id: int
     observation_date: datetime.date
     observation_datetime: datetime.datetime
-    observation_type_concept_id: int = DUMMY_CONCEPT_ID
-
-    def __post_init__(self) -> None:
-        """
-        Set observation_type_concept_id to EHR
-        """
-        self.observation_type_concept_id = concepts.EHR
+    observation_type_concept_id: int = concepts.EHR
+
+
+# Mapping of OMOP CDM table names to the data classes that hold their rows.
+# The order is the order in which tables must be loaded (parents before children),
+# i.e. that of `omop.constants.TABLE_NAMES`.
+TABLES: dict[str, type] = {
+    "person": Person,
+    "visit_occurrence": VisitOccurrence,
+    "drug_exposure": DrugExposure,
+    "procedure_occurrence": ProcedureOccurrence,
+    "measurement": Measurement,
+    "condition_occurrence": ConditionOccurrence,
+    "observation": Observation,
+}
@@ -0,0 +1,453 @@
+"""
+VOCABULARY
+
+This module provides a local cache of OMOP concepts in an indexed SQLite database, such
+that concepts can be looked up without a (slow, per concept) request to an Atlas
+WebAPI and without network access.
+
+The cache is filled from the `CONCEPT.csv` and `CONCEPT_RELATIONSHIP.csv` files of a
+vocabulary download from Athena (tab separated), or from concepts returned by a WebAPI
+(e.g. a JSON dump of `POST /vocabulary/lookup/identifiers`, see `fetch_webapi`):
+
+    python -m omop.vocabulary --cache vocabulary.sqlite import-athena path/to/athena
+    python -m omop.vocabulary --cache vocabulary.sqlite import-webapi concepts.json
+    python -m omop.vocabulary --cache vocabulary.sqlite check
+
+Concepts are looked up in batches (`ConceptCache.lookup`), which takes a few
+microseconds per concept. `check_concepts` checks that all concepts in
+`omop.concepts` exist, are standard and valid and belong to the expected domain.
+"""
+import argparse
+import csv
+import datetime
+import json
+import sqlite3
+import sys
+from pathlib import Path
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+DEFAULT_CACHE_FILE = "vocabulary.sqlite"
+
+# number of rows inserted per statement during import
+IMPORT_CHUNK_SIZE = 50_000
+
+# number of ids per query of a batch lookup (below SQLite's limit of host parameters)
+LOOKUP_CHUNK_SIZE = 900
+
+CONCEPT_COLUMNS = (
+    "concept_id",
+    "concept_name",
+    "domain_id",
+    "vocabulary_id",
+    "concept_class_id",
+    "standard_concept",
+    "concept_code",
+    "valid_start_date",
+    "valid_end_date",
+    "invalid_reason",
+)
+
+CONCEPT_RELATIONSHIP_COLUMNS = (
+    "concept_id_1",
+    "concept_id_2",
+    "relationship_id",
+    "valid_start_date",
+    "valid_end_date",
+    "invalid_reason",
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS concept (
+    concept_id INTEGER PRIMARY KEY,
+    concept_name TEXT NOT NULL,
+    domain_id TEXT NOT NULL,
+    vocabulary_id TEXT NOT NULL,
+    concept_class_id TEXT NOT NULL,
+    standard_concept TEXT,
+    concept_code TEXT NOT NULL,
+    valid_start_date TEXT,
+    valid_end_date TEXT,
+    invalid_reason TEXT
+);
+CREATE TABLE IF NOT EXISTS concept_relationship (
+    concept_id_1 INTEGER NOT NULL,
+    concept_id_2 INTEGER NOT NULL,
+    relationship_id TEXT NOT NULL,
+    valid_start_date TEXT,
+    valid_end_date TEXT,
+    invalid_reason TEXT,
+    PRIMARY KEY (concept_id_1, relationship_id, concept_id_2)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS concept_code ON concept (vocabulary_id, concept_code);
+"""
+
+
+class Concept(NamedTuple):
+    """
+    OMOP concept (row of the CONCEPT table, dates as YYYYMMDD as in the Athena files)
+    """
+
+    concept_id: int
+    concept_name: str
+    domain_id: str
+    vocabulary_id: str
+    concept_class_id: str
+    standard_concept: Optional[str]
+    concept_code: str
+    valid_start_date: Optional[str]
+    valid_end_date: Optional[str]
+    invalid_reason: Optional[str]
+
+    @property
+    def is_standard(self) -> bool:
+        """
+        Return whether the concept is a standard concept
+        """
+        return self.standard_concept == "S"
+
+    @property
+    def is_valid(self) -> bool:
+        """
+        Return whether the concept is valid (not deprecated or upgraded)
+        """
+        return self.invalid_reason is None
+
+
+def _webapi_date(value: Any) -> Optional[str]:
+    """
+    Convert a date returned by the WebAPI (milliseconds since 1970 or ISO string) to
+    the format of the Athena files (YYYYMMDD)
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return (
+            (datetime.datetime(1970, 1, 1) + datetime.timedelta(milliseconds=value))
+            .date()
+            .strftime("%Y%m%d")
+        )
+    return str(value)[:10].replace("-", "")
+
+
+def _chunks(
+    rows: Iterable[Tuple[Any, ...]], size: int
+) -> Iterator[List[Tuple[Any, ...]]]:
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class ConceptCache:
+    """
+    Indexed on-disk cache of OMOP concepts and their relationships (SQLite)
+    """
+
+    def __init__(self, path: Union[str, Path] = DEFAULT_CACHE_FILE) -> None:
+        self.path = Path(path)
+        self.con = sqlite3.connect(self.path)
+        self.con.execute("PRAGMA journal_mode = WAL")
+        self.con.executescript(SCHEMA)
+        self._concepts: Dict[int, Optional[Concept]] = {}
+
+    def close(self) -> None:
+        """
+        Close the database
+        """
+        self.con.close()
+
+    def __enter__(self) -> "ConceptCache":
+        """
+        Return the cache
+        """
+        return self
+
+    def __exit__(self, exc_type: Any, exc_value: Any, traceback: Any) -> None:
+        """
+        Close the database
+        """
+        self.close()
+
+    def __len__(self) -> int:
+        """
+        Return the number of concepts in the cache
+        """
+        return self.con.execute("SELECT count(*) FROM concept").fetchone()[0]
+
+    def _insert(
+        self, table: str, columns: Sequence[str], rows: Iterable[Tuple[Any, ...]]
+    ) -> int:
+        """
+        Insert (or replace) rows in a single transaction and return their number
+        """
+        placeholders = ", ".join("?" * len(columns))
+        sql = (
+            f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) "  # nosec
+            f"VALUES ({placeholders})"
+        )
+        n_rows = 0
+
+        self.con.execute("PRAGMA synchronous = OFF")
+        with self.con:
+            for chunk in _chunks(rows, IMPORT_CHUNK_SIZE):
+                self.con.executemany(sql, chunk)
+                n_rows += len(chunk)
+        self.con.execute("PRAGMA synchronous = FULL")
+
+        self._concepts.clear()
+
+        return n_rows
+
+    def import_concepts(self, rows: Iterable[Tuple[Any, ...]]) -> int:
+        """
+        Insert concepts (tuples in the order of `CONCEPT_COLUMNS`) and return their number
+        """
+        return self._insert("concept", CONCEPT_COLUMNS, rows)
+
+    def import_relationships(self, rows: Iterable[Tuple[Any, ...]]) -> int:
+        """
+        Insert concept relationships (tuples in the order of
+        `CONCEPT_RELATIONSHIP_COLUMNS`) and return their number
+        """
+        return self._insert("concept_relationship", CONCEPT_RELATIONSHIP_COLUMNS, rows)
+
+    def import_athena(self, directory: Union[str, Path]) -> Dict[str, int]:
+        """
+        Import CONCEPT.csv and (if it exists) CONCEPT_RELATIONSHIP.csv of an Athena
+        vocabulary download and return the number of imported rows per file
+        """
+        directory = Path(directory)
+        counts = {
+            "CONCEPT.csv": self.import_concepts(
+                _read_athena(directory / "CONCEPT.csv", CONCEPT_COLUMNS)
+            )
+        }
+
+        relationships = directory / "CONCEPT_RELATIONSHIP.csv"
+        if relationships.exists():
+            counts["CONCEPT_RELATIONSHIP.csv"] = self.import_relationships(
+                _read_athena(relationships, CONCEPT_RELATIONSHIP_COLUMNS)
+            )
+
+        return counts
+
+    def import_webapi(self, records: Iterable[Dict[str, Any]]) -> int:
+        """
+        Import concepts as returned by the WebAPI (e.g. by `GET /vocabulary/concept/{id}`
+        or `POST /vocabulary/lookup/identifiers`) and return their number
+        """
+        return self.import_concepts(
+            (
+                int(r["CONCEPT_ID"]),
+                r["CONCEPT_NAME"],
+                r["DOMAIN_ID"],
+                r["VOCABULARY_ID"],
+                r["CONCEPT_CLASS_ID"],
+                None
+                if r.get("STANDARD_CONCEPT") in (None, "", "N")
+                else r["STANDARD_CONCEPT"],
+                r["CONCEPT_CODE"],
+                _webapi_date(r.get("VALID_START_DATE")),
+                _webapi_date(r.get("VALID_END_DATE")),
+                # the WebAPI reports valid concepts as "V"
+                None
+                if r.get("INVALID_REASON") in (None, "", "V")
+                else r["INVALID_REASON"],
+            )
+            for r in records
+        )
+
+    def lookup(self, concept_ids: Iterable[int]) -> Dict[int, Concept]:
+        """
+        Return the concepts with the given ids (missing concepts are left out)
+        """
+        ids = {int(concept_id) for concept_id in concept_ids}
+        missing = [concept_id for concept_id in ids if concept_id not in self._concepts]
+
+        for start in range(0, len(missing), LOOKUP_CHUNK_SIZE):
+            chunk = missing[start : start + LOOKUP_CHUNK_SIZE]
+            for concept_id in chunk:
+                self._concepts[concept_id] = None
+            placeholders = ", ".join("?" * len(chunk))
+            for row in self.con.execute(
+                f"SELECT {', '.join(CONCEPT_COLUMNS)} FROM concept "  # nosec
+                f"WHERE concept_id IN ({placeholders})",
+                chunk,
+            ):
+                self._concepts[row[0]] = Concept(*row)
+
+        found = {}
+        for concept_id in ids:
+            concept = self._concepts[concept_id]
+            if concept is not None:
+                found[concept_id] = concept
+
+        return found
+
+    def get(self, concept_id: int) -> Optional[Concept]:
+        """
+        Return the concept with the given id (None, if it is not in the cache)
+        """
+        return self.lookup([concept_id]).get(int(concept_id))
+
+    def lookup_codes(
+        self, codes: Iterable[Tuple[str, str]]
+    ) -> Dict[Tuple[str, str], Concept]:
+        """
+        Return the concepts with the given (vocabulary_id, concept_code), e.g.
+        ("SNOMED", "840539006") (missing concepts are left out)
+        """
+        by_vocabulary: Dict[str, List[str]] = {}
+        for vocabulary_id, concept_code in set(codes):
+            by_vocabulary.setdefault(vocabulary_id, []).append(concept_code)
+
+        found = {}
+        for vocabulary_id, concept_codes in by_vocabulary.items():
+            for start in range(0, len(concept_codes), LOOKUP_CHUNK_SIZE):
+                chunk = concept_codes[start : start + LOOKUP_CHUNK_SIZE]
+                placeholders = ", ".join("?" * len(chunk))
+                for row in self.con.execute(
+                    f"SELECT {', '.join(CONCEPT_COLUMNS)} FROM concept "  # nosec
+                    f"WHERE vocabulary_id = ? AND concept_code IN ({placeholders})",
+                    [vocabulary_id, *chunk],
+                ):
+                    concept = Concept(*row)
+                    found[(vocabulary_id, concept.concept_code)] = concept
+
+        return found
+
+    def related(
+        self, concept_ids: Iterable[int], relationship_id: str = "Maps to"
+    ) -> Dict[int, List[int]]:
+        """
+        Return the ids of the concepts that are related to each of the given concepts by
+        a valid relationship (e.g. the standard concepts a concept maps to)
+        """
+        ids = sorted({int(concept_id) for concept_id in concept_ids})
+        related: Dict[int, List[int]] = {concept_id: [] for concept_id in ids}
+
+        for start in range(0, len(ids), LOOKUP_CHUNK_SIZE):
+            chunk = ids[start : start + LOOKUP_CHUNK_SIZE]
+            placeholders = ", ".join("?" * len(chunk))
+            for concept_id_1, concept_id_2 in self.con.execute(
+                "SELECT concept_id_1, concept_id_2 FROM concept_relationship "  # nosec
+                f"WHERE concept_id_1 IN ({placeholders}) AND relationship_id = ? "
+                "AND invalid_reason IS NULL",
+                [*chunk, relationship_id],
+            ):
+                related[concept_id_1].append(concept_id_2)
+
+        return related
+
+
+def _read_athena(path: Path, columns: Sequence[str]) -> Iterator[Tuple[Any, ...]]:
+    """
+    Read the given columns of a (tab separated, unquoted) file of an Athena vocabulary
+    download (empty fields are returned as None)
+    """
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f, delimiter="\t", quoting=csv.QUOTE_NONE)
+        header = next(reader)
+        indexes = [header.index(column) for column in columns]
+        for row in reader:
+            yield tuple(row[i] or None for i in indexes)
+
+
+def fetch_webapi(api_url: str, concept_ids: Iterable[int]) -> List[Dict[str, Any]]:
+    """
+    Fetch concepts from an Atlas WebAPI with a single request
+    (`POST /vocabulary/lookup/identifiers`)
+    """
+    import requests
+
+    r = requests.post(
+        api_url.rstrip("/") + "/vocabulary/lookup/identifiers",
+        json=sorted({int(concept_id) for concept_id in concept_ids}),
+        timeout=60,
+    )
+    r.raise_for_status()
+
+    return r.json()
+
+
+def check_concepts(
+    cache: ConceptCache, domains: Optional[Dict[int, str]] = None
+) -> List[str]:
+    """
+    Check that concepts exist in the cache and are standard, valid and of the expected
+    domain and return the problems found (empty, if all concepts are fine).
+
+    `domains` maps each concept id to its expected domain (default: all concepts in
+    `omop.concepts`, see `omop.concepts.DOMAINS`).
+    """
+    if domains is None:
+        from omop.concepts import DOMAINS
+
+        domains = DOMAINS
+
+    found = cache.lookup(domains)
+    problems = []
+
+    for concept_id, domain_id in domains.items():
+        concept = found.get(concept_id)
+        if concept is None:
+            problems.append(f"{concept_id}: not in the vocabulary")
+            continue
+
+        name = f"{concept_id} ({concept.concept_name})"
+        if not concept.is_standard:
+            problems.append(f"{name}: not a standard concept")
+        if not concept.is_valid:
+            problems.append(f"{name}: invalid ({concept.invalid_reason})")
+        if concept.domain_id != domain_id:
+            problems.append(
+                f"{name}: domain is {concept.domain_id}, expected {domain_id}"
+            )
+
+    return problems
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local cache of OMOP concepts")
+    parser.add_argument(
+        "--cache",
+        help=f"SQLite file of the cache (default: {DEFAULT_CACHE_FILE})",
+        default=DEFAULT_CACHE_FILE,
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser(
+        "import-athena", help="Import the CSV files of an Athena download"
+    ).add_argument("directory")
+    commands.add_parser(
+        "import-webapi", help="Import a JSON list of concepts returned by a WebAPI"
+    ).add_argument("file")
+    commands.add_parser("check", help="Check all concepts of omop/concepts.py")
+    args = parser.parse_args()
+
+    with ConceptCache(args.cache) as cache:
+        if args.command == "import-athena":
+            for file_name, n_rows in cache.import_athena(args.directory).items():
+                print(f"{file_name}: {n_rows:,} rows")
+        elif args.command == "import-webapi":
+            records = json.loads(Path(args.file).read_text())
+            print(f"{cache.import_webapi(records):,} concepts")
+        else:
+            problems = check_concepts(cache)
+            for problem in problems:
+                print(problem)
+            sys.exit(1 if problems else 0)
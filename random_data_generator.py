@@ -1,50 +1,97 @@
 import argparse
 import json
 import logging
-import random
-from dataclasses import asdict
-from typing import Any, Dict
-
-import numpy as np
-import psycopg2
+import os
+import shutil
+import sys
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+from data_generator.checkpoint import (
+    DEFAULT_CHECKPOINT_FILE,
+    DEFAULT_COMMIT_EVERY,
+    Checkpoint,
+)
+from data_generator.criteria import DEFAULT_CRITERIA_FILE
+from data_generator.manifest import DEFAULT_MANIFEST_FILE, MANIFEST_FILE_NAME
+from data_generator.shards import (
+    SHARD_MANIFEST_FILE,
+    ShardManifest,
+    check_shards,
+    load_shard,
+)
+from omop.constants import COPY_FORMATS, DEFAULT_BATCH_SIZE, FILE_FORMATS, TABLE_NAMES
+from omop.ids import IdAllocator
+
+if TYPE_CHECKING:
+    import psycopg2
+
+    from omop.sink import Sink
+
+# Heavy modules (numpy, pydantic, psycopg2, the generator) are only imported by the
+# code paths that need them, such that --help, --plan and small runs start quickly.
 
 SECONDS_PER_DAY = 86400
+DEFAULT_N_PERSON = 10
 
 
-def insert(table: str, data: Dict) -> Any:
+def connection_settings() -> Tuple[Dict[str, Any], str]:
     """
-    Insert data into a table
+    Return the connection parameters and the schema of the database
     """
-    columns = ", ".join(data.keys())
-    value_placeholder = ", ".join(["%s"] * len(data))
-    sql = f"INSERT INTO {table} ({columns}) VALUES ({value_placeholder}) RETURNING {table}_id"
-    cursor.execute(sql, list(data.values()))
+    settings = json.loads(open(".credentials.json").read())
+    schema = settings.pop("schema", "cds_cdm")
 
-    return cursor.fetchone()[0]
+    return settings, schema
 
 
-def next_person_id() -> int:
+def connect_db() -> "psycopg2.extensions.connection":
     """
-    Return the maximal patient_id in the database
+    Connect to the database
     """
-    cursor.execute("SELECT MAX(person_id) FROM person")
-    person_id = cursor.fetchone()[0]
+    import psycopg2
 
-    if person_id is None:
-        return 0
+    settings, schema = connection_settings()
+    con = psycopg2.connect(**settings, options=f"-c search_path={schema}")
 
-    return person_id + 1
+    return con
 
 
-def connect_db() -> psycopg2.extensions.connection:
+def delete_persons(
+    con: "psycopg2.extensions.connection",
+    person_ids: range,
+    tables: Optional[List[str]] = None,
+) -> None:
     """
-    Connect to the database
+    Delete all rows of the given persons from `tables` (default: all tables, child
+    tables first) and commit
     """
-    settings = json.loads(open(".credentials.json").read())
-    schema = settings.pop("schema", "cds_cdm")
-    con = psycopg2.connect(**settings, options=f"-c search_path={schema}")
+    with con.cursor() as cursor:
+        for table in reversed(TABLE_NAMES):
+            if tables is not None and table not in tables:
+                continue
+            cursor.execute(
+                f"DELETE FROM {table} WHERE person_id >= %s AND person_id < %s",  # nosec
+                (person_ids.start, person_ids.stop),
+            )
+    con.commit()
 
-    return con
+
+def pin_visit_end_date(visit_end_date: Optional[str]) -> None:
+    """
+    Let the visit window of the generated patients end on `visit_end_date` (the end of
+    the window of a previous run) instead of today, see `params.VISIT_END_DATE`
+    """
+    if (
+        visit_end_date is None
+        or os.environ.get("OMOP_VISIT_END_DATE") == visit_end_date
+    ):
+        return
+    if "data_generator.parameter" in sys.modules:
+        raise RuntimeError("The visit window must be set before loading the generator")
+    # read by data_generator.parameter (also inherited by workers)
+    os.environ["OMOP_VISIT_END_DATE"] = visit_end_date
 
 
 if __name__ == "__main__":
@@ -61,9 +108,9 @@ if __name__ == "__main__":
 
     parser.add_argument(
         "n_person",
-        help="Number of persons to generate",
+        help=f"Number of persons to generate (default: {DEFAULT_N_PERSON}; with\n"
+        "--recommendations: the number of cases)",
         type=int,
-        default=10,
         nargs="?",
     )
 
@@ -71,118 +118,568 @@ if __name__ == "__main__":
         "--seed", help="Seed for random number generator", type=int, nargs="?"
     )
 
-    args = parser.parse_args()
+    parser.add_argument(
+        "--batch-size",
+        help="Number of rows per table that are buffered before they are written. Patients\n"
+        "are generated in chunks of about this number of rows (with --workers, at most\n"
+        "two chunks per worker are held in memory).",
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+    )
 
-    if args.seed is not None:
-        random.seed(args.seed)
-        np.random.seed(args.seed)
+    parser.add_argument(
+        "--no-copy",
+        help="Write rows with one INSERT statement per row instead of COPY (slow)",
+        action="store_true",
+    )
 
-    # MUST be imported AFTER setting the seed!
-    from data_generator.generator import (
-        create_cond,
-        create_drug_exp2,
-        create_lab_values_measurements,
-        create_obs,
-        create_prone_positioning_procedure,
-        create_vent_params_measurements,
-        create_vent_params_procedure,
-        create_weight_measurements,
+    parser.add_argument(
+        "--copy-format",
+        help="Format of the data sent with COPY (default: binary, i.e. without formatting\n"
+        "values as text)",
+        choices=COPY_FORMATS,
+        default="binary",
     )
-    from omop.tables import Person, VisitOccurrence
 
-    con = connect_db()
-    cursor = con.cursor()
+    parser.add_argument(
+        "--connections",
+        help="Write the tables concurrently over this number of database connections,\n"
+        "while patients are being generated (requires asyncpg; each COPY is committed\n"
+        "on its own)",
+        type=int,
+        default=1,
+    )
 
-    # get maximal patient_id from DB
-    start_patient_id = next_person_id()
-    print("Patient start ID for new patient data: ", start_patient_id)
+    parser.add_argument(
+        "--workers",
+        help="Number of processes used to generate patients. The generated data only\n"
+        "depends on --seed, not on the number of workers.",
+        type=int,
+        default=1,
+    )
 
-    patient_id_list = range(start_patient_id, start_patient_id + args.n_person)
+    parser.add_argument(
+        "--output-dir",
+        help="Write the tables to files in this directory instead of the database\n"
+        "(no database connection is needed)",
+    )
 
-    # create patients and insert into DB
-    for person_id in patient_id_list:
-        print("#########################")
-        print("Creating data for patient with ID: ", person_id)
+    parser.add_argument(
+        "--format",
+        help="File format used with --output-dir (default: parquet; with --incremental,\n"
+        "the format of the run recorded in the manifest)",
+        choices=FILE_FORMATS,
+    )
 
-        # create person
-        person = Person(person_id)
+    parser.add_argument(
+        "--start-person-id",
+        help="First person_id used with --output-dir (default: 0; with --shards, a block of\n"
+        "person_ids is reserved in the database instead)",
+        type=int,
+    )
 
-        # create visit
-        visit = VisitOccurrence(person_id=person_id)
+    parser.add_argument(
+        "--shards",
+        help="Split the run into this number of shards and only write the shard manifest\n"
+        f"({SHARD_MANIFEST_FILE}) to --output-dir. Each shard is then generated with\n"
+        "--shard (e.g. on another node) and all shards are loaded with --merge.",
+        type=int,
+    )
 
-        # create drugs
-        list_of_drugs = create_drug_exp2(person_id, visit, n_administrations=10)
+    parser.add_argument(
+        "--shard",
+        help="Generate the shard with this index of the shard manifest in --output-dir\n"
+        "(into a subdirectory of --output-dir; n_person, --seed and --format are ignored)",
+        type=int,
+    )
 
-        # create first procedure
-        prod = create_vent_params_procedure(person_id, visit)
+    parser.add_argument(
+        "--merge",
+        help="Check that the shards in --output-dir are complete and do not overlap and\n"
+        "load them into the database",
+        action="store_true",
+    )
 
-        # create measurements
-        list_of_measurements = create_vent_params_measurements(
-            person_id, prod, visit
-        )  # REALLY USE THE FIRST PROD HERE??
-        list_of_measurements += create_lab_values_measurements(person_id, visit)
+    parser.add_argument(
+        "--commit-every",
+        help="Commit after this number of patients and record the progress in the\n"
+        f"checkpoint file (default: {DEFAULT_COMMIT_EVERY})",
+        type=int,
+        default=DEFAULT_COMMIT_EVERY,
+    )
 
-        # create rest of procedures
-        list_of_procedures = []
-        if prod is not None:
-            list_of_procedures.append(prod)
+    parser.add_argument(
+        "--checkpoint",
+        help=f"Checkpoint file of the run (default: {DEFAULT_CHECKPOINT_FILE})",
+        default=DEFAULT_CHECKPOINT_FILE,
+    )
 
-        list_of_procedures += create_prone_positioning_procedure(
-            person_id, visit, max_occurrences=5
-        )
+    parser.add_argument(
+        "--resume",
+        help="Continue the interrupted run recorded in the checkpoint file (seed and\n"
+        "person ids are taken from the checkpoint, n_person and --seed are ignored)",
+        action="store_true",
+    )
 
-        # create list of condition_occurrences
-        list_of_conditions = create_cond(person_id, visit, max_occurrences=4)
+    parser.add_argument(
+        "--manifest",
+        help="Manifest file recording seed, person ids and the fingerprint of each table\n"
+        f"of the last run (default: {DEFAULT_MANIFEST_FILE}, or {MANIFEST_FILE_NAME} in the\n"
+        "output directory)",
+    )
 
-        # create list of observations
-        list_of_observations = create_obs(
-            person_id, visit, max_occurrences=2, probability_threshold=0.5
-        )
+    parser.add_argument(
+        "--incremental",
+        help="Regenerate (and replace) only the tables of the run recorded in the manifest\n"
+        "whose generator code or parameters changed since (n_person and --seed are ignored)",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--ventilation-interval",
+        help="Create the ventilation parameters of ventilated patients as time series with\n"
+        "one value every MINUTES minutes (e.g. 1 for minute resolution) instead of\n"
+        "24 values per day",
+        type=float,
+        metavar="MINUTES",
+    )
+
+    parser.add_argument(
+        "--recommendations",
+        help="Generate patients that cover the criteria of the recommendations (FHIR\n"
+        "resources) in this directory: each patient satisfies, lies on the boundary of\n"
+        "or violates one criterion and has no other data (requires --vocabulary)",
+    )
+
+    parser.add_argument(
+        "--criteria-file",
+        help="Cache of the criteria compiled from --recommendations\n"
+        f"(default: {DEFAULT_CRITERIA_FILE})",
+        default=DEFAULT_CRITERIA_FILE,
+    )
 
-        # create measurements for weight and ideal weight
-        list_of_measurements += create_weight_measurements(person_id, person, visit)
+    parser.add_argument(
+        "--plan",
+        help="Print the person ids and the expected number of rows per table of the run\n"
+        "as JSON and exit (without connecting to the database or generating data)",
+        action="store_true",
+    )
 
-        logging.info("Inserting data into database")
+    parser.add_argument(
+        "--verbose",
+        help="Log details of each generated patient",
+        action="store_true",
+    )
 
-        insert("person", asdict(person))
-        logging.info("- Inserted patient data")
+    parser.add_argument(
+        "--progress-interval",
+        help="Seconds between progress messages (default: 10)",
+        type=float,
+        default=10.0,
+    )
 
-        # insert visit
-        insert("visit_occurrence", asdict(visit))
-        logging.info("- Inserted visit data")
+    parser.add_argument(
+        "--report",
+        help="Write timings and throughput of the run as JSON to this file",
+    )
 
-        # insert list of drugs
-        for d in list_of_drugs:
-            insert("drug_exposure", asdict(d))
-        logging.info(f"Inserted drug exposure data with {len(list_of_drugs)} entries")
+    parser.add_argument(
+        "--validate",
+        help="Validate each generated row with pydantic (slow, for debugging)",
+        action="store_true",
+    )
 
-        # insert procedure
-        for prod in list_of_procedures:
-            insert("procedure_occurrence", asdict(prod))
-        logging.info(
-            f"Inserted procedure occurrence data with {len(list_of_procedures)} entries",
+    parser.add_argument(
+        "--vocabulary",
+        help="Check the concepts of omop/concepts.py against this concept cache\n"
+        "(see omop/vocabulary.py) before generating",
+    )
+
+    args = parser.parse_args()
+
+    if args.verbose:
+        logging.getLogger().setLevel(logging.DEBUG)
+
+    if args.validate:
+        # must be set before the row classes are imported (also inherited by workers)
+        os.environ["OMOP_VALIDATE_ROWS"] = "1"
+
+    if args.ventilation_interval is not None:
+        # read by data_generator.parameter (also inherited by workers)
+        os.environ["OMOP_VENTILATION_INTERVAL"] = str(args.ventilation_interval)
+
+    if args.resume and args.output_dir is not None:
+        parser.error("--resume is only supported when writing to the database")
+    if args.resume and args.incremental:
+        parser.error("--resume and --incremental cannot be combined")
+    shard_modes = [
+        name
+        for name, value in [
+            ("--shards", args.shards is not None),
+            ("--shard", args.shard is not None),
+            ("--merge", args.merge),
+        ]
+        if value
+    ]
+    if shard_modes and args.output_dir is None:
+        parser.error(f"{shard_modes[0]} requires --output-dir")
+    if len(shard_modes) > 1:
+        parser.error(f"{' and '.join(shard_modes)} cannot be combined")
+    if shard_modes and (args.resume or args.incremental or args.plan):
+        parser.error(
+            f"{shard_modes[0]} cannot be combined with --resume, --incremental or --plan"
+        )
+    if args.recommendations is not None:
+        if args.vocabulary is None:
+            parser.error("--recommendations requires --vocabulary")
+        if shard_modes or args.resume or args.incremental or args.plan:
+            parser.error(
+                "--recommendations cannot be combined with --shards, --shard, --merge, "
+                "--resume, --incremental or --plan"
+            )
+    elif args.n_person is None:
+        args.n_person = DEFAULT_N_PERSON
+    if args.plan and args.incremental:
+        parser.error(
+            "--plan cannot be combined with --incremental (the changed tables are only "
+            "known after importing the generator)"
         )
 
-        # insert list of measurements
-        for m in list_of_measurements:
-            insert("measurement", asdict(m))
+    if args.plan:
+        from data_generator.plan import expected_rows
+
+        plan_ids: Optional[range]
+        if args.resume:
+            plan_checkpoint = Checkpoint.load(args.checkpoint)
+            plan_seed, plan_ids = plan_checkpoint.seed, plan_checkpoint.remaining
+            plan_tables = plan_checkpoint.tables
+            n_planned = len(plan_ids)
+        else:
+            plan_seed, plan_tables, n_planned = args.seed, None, args.n_person
+            plan_ids = None
+            if args.output_dir is not None:
+                start_person_id = args.start_person_id or 0
+                plan_ids = range(start_person_id, start_person_id + args.n_person)
+            else:
+                logging.info(
+                    "The person ids are reserved from tdg_person_id_seq at run time"
+                )
+
+        rows = expected_rows(n_planned, plan_tables, args.ventilation_interval)
+        print(
+            json.dumps(
+                {
+                    "seed": plan_seed,
+                    "n_person": n_planned,
+                    "first_person_id": plan_ids[0] if plan_ids else None,
+                    "last_person_id": plan_ids[-1] if plan_ids else None,
+                    "rows": rows,
+                    "total_rows": sum(rows.values()),
+                },
+                indent=2,
+            )
+        )
+        sys.exit(0)
+
+    if args.vocabulary is not None:
+        from omop.vocabulary import ConceptCache, check_concepts
+
+        if not Path(args.vocabulary).exists():
+            parser.error(f"Concept cache {args.vocabulary} does not exist")
+        with ConceptCache(args.vocabulary) as concept_cache:
+            concept_problems = check_concepts(concept_cache)
+        for problem in concept_problems:
+            logging.error(f"Concept {problem}")
+        if concept_problems:
+            sys.exit(1)
+        logging.info("All concepts are valid standard concepts of the expected domain")
+
+    criteria_plan = None
+    if args.recommendations is not None:
+        from data_generator.criteria import load_plan
+
+        criteria_plan = load_plan(
+            args.recommendations, args.vocabulary, args.criteria_file
+        )
+        if args.n_person is None:
+            args.n_person = len(criteria_plan.cases)
         logging.info(
-            f"Inserted measurement data with {len(list_of_measurements)} entries"
+            f"Covering {len(criteria_plan.cases)} cases of "
+            f"{len(criteria_plan.criteria)} criteria with {args.n_person} patients"
         )
 
-        # insert list of conditions
-        for c in list_of_conditions:
-            insert("condition_occurrence", asdict(c))
+    if args.merge:
+        shard_manifest = ShardManifest.load(Path(args.output_dir) / SHARD_MANIFEST_FILE)
+        check_shards(args.output_dir, shard_manifest)
+
+        con = connect_db()
+        for shard in shard_manifest.shards:
+            # a shard replaces its persons, i.e. an interrupted merge can be repeated
+            person_ids = shard_manifest.person_ids_of(shard)
+            delete_persons(con, person_ids)
+            with con.cursor() as cursor:
+                n_rows = load_shard(
+                    cursor,
+                    Path(args.output_dir) / shard.directory,
+                    shard_manifest.file_format,
+                )
+            con.commit()
+            logging.info(
+                f"Loaded shard {shard.index}: {n_rows:,} rows of person_id "
+                f"{person_ids.start} - {person_ids.stop - 1}"
+            )
+        con.close()
+        sys.exit(0)
+
+    from data_generator.instrumentation import STATS
+    from data_generator.manifest import Manifest, table_fingerprints
+
+    if args.shards is not None:
+        from data_generator import parameter as params
+        from data_generator.pipeline import random_seed
+
+        seed = args.seed if args.seed is not None else random_seed()
+        if args.start_person_id is not None:
+            first_person_id = args.start_person_id
+        else:
+            id_con = connect_db()
+            first_person_id = IdAllocator(id_con).reserve("person", args.n_person).start
+            id_con.close()
+
+        shard_manifest = ShardManifest.split(
+            seed,
+            first_person_id,
+            args.n_person,
+            args.shards,
+            args.format or "parquet",
+            visit_end_date=params.VISIT_END_DATE.isoformat(),
+        )
+        Path(args.output_dir).mkdir(parents=True, exist_ok=True)
+        shard_manifest.save(Path(args.output_dir) / SHARD_MANIFEST_FILE)
+        logging.info(
+            f"Wrote {SHARD_MANIFEST_FILE} with {args.shards} shards of the run with seed "
+            f"{seed} (person_id {first_person_id} - "
+            f"{shard_manifest.person_ids[-1]})"
+        )
+        sys.exit(0)
+
+    output_dir = args.output_dir
+    file_format = args.format or "parquet"
+
+    checkpoint = None
+    if args.shard is not None:
+        # generate a shard of a distributed run into its own directory
+        shard_manifest = ShardManifest.load(Path(args.output_dir) / SHARD_MANIFEST_FILE)
+        shard = shard_manifest.shard(args.shard)
+        output_dir = str(Path(args.output_dir) / shard.directory)
+        file_format = shard_manifest.file_format
+        checkpoint = Checkpoint(
+            shard_manifest.seed,
+            shard_manifest.person_ids_of(shard).start,
+            shard.n_person,
+            first_index=shard.first_index,
+            visit_end_date=shard_manifest.visit_end_date,
+        )
         logging.info(
-            f"Inserted condition_occurrence data with {len(list_of_conditions)} entries"
+            f"Generating shard {shard.index} of the run with seed {checkpoint.seed} "
+            f"(person_id {checkpoint.first_person_id} - {checkpoint.person_ids[-1]})"
+        )
+
+    manifest_file = args.manifest
+    if manifest_file is None:
+        manifest_file = (
+            DEFAULT_MANIFEST_FILE
+            if output_dir is None
+            else Path(output_dir) / MANIFEST_FILE_NAME
         )
 
-        # insert list of observations
-        for o in list_of_observations:
-            insert("observation", asdict(o))
+    if args.shard is not None:
+        # the manifest of a shard marks it as complete (see check_shards), it is
+        # written again when the shard is done
+        manifest_file = Path(output_dir) / MANIFEST_FILE_NAME
+        manifest_file.unlink(missing_ok=True)
+
+    if args.resume:
+        checkpoint = Checkpoint.load(args.checkpoint)
+        logging.info(
+            f"Resuming run with seed {checkpoint.seed} after {checkpoint.n_committed} of "
+            f"{checkpoint.n_person} patients (person_id {checkpoint.first_person_id} - "
+            f"{checkpoint.person_ids[-1]})"
+        )
+        if checkpoint.criteria is not None:
+            from data_generator.criteria import CriteriaPlan
+
+            criteria_plan = CriteriaPlan.load(checkpoint.criteria)
+    elif args.incremental:
+        manifest = Manifest.load(manifest_file)
+        # (before the generator is loaded by table_fingerprints)
+        pin_visit_end_date(manifest.visit_end_date)
+        if output_dir is not None and manifest.file_format is not None:
+            # all tables of a run are written in the same format
+            if args.format is not None and args.format != manifest.file_format:
+                parser.error(
+                    f"--format {args.format} differs from the format of the run in "
+                    f"{manifest_file} ({manifest.file_format})"
+                )
+            file_format = manifest.file_format
+        changed = manifest.changed_tables(table_fingerprints())
+        if not changed:
+            logging.info("No table changed since the last run")
+            sys.exit(0)
         logging.info(
-            f"Inserted observation data with {len(list_of_observations)} entries"
+            f"Regenerating {', '.join(changed)} of the run with seed {manifest.seed} "
+            f"(person_id {manifest.first_person_id} - {manifest.person_ids[-1]})"
+        )
+        checkpoint = Checkpoint(
+            manifest.seed,
+            manifest.first_person_id,
+            manifest.n_person,
+            tables=changed,
+            visit_end_date=manifest.visit_end_date,
         )
 
-    con.commit()
-    con.close()
+    if checkpoint is not None:
+        pin_visit_end_date(checkpoint.visit_end_date)
+
+    from data_generator import parameter as params
+    from data_generator.pipeline import generate, random_seed
+
+    seed = args.seed
+    if checkpoint is not None:
+        seed = checkpoint.seed
+    elif seed is None:
+        seed = random_seed()
+        logging.info(f"No seed given, using seed {seed}")
+
+    sink: "Sink"
+
+    if output_dir is not None:
+        from omop.sink import FileSink
+
+        con = None
+        sink = FileSink(
+            output_dir,
+            file_format=file_format,
+            batch_size=args.batch_size,
+            stats=STATS,
+        )
+    elif args.connections > 1:
+        from omop.async_sink import AsyncCopySink
+
+        con = None
+        settings, schema = connection_settings()
+        sink = AsyncCopySink(
+            settings,
+            schema=schema,
+            pool_size=args.connections,
+            batch_size=args.batch_size,
+            stats=STATS,
+            copy_format=args.copy_format,
+        )
+    else:
+        from omop.sink import CopySink, InsertSink
+
+        con = connect_db()
+        cursor = con.cursor()
+
+        if args.no_copy:
+            sink = InsertSink(cursor, stats=STATS)
+        else:
+            sink = CopySink(
+                cursor,
+                batch_size=args.batch_size,
+                stats=STATS,
+                copy_format=args.copy_format,
+            )
+
+    if checkpoint is None:
+        criteria_file = None if criteria_plan is None else args.criteria_file
+        if output_dir is not None:
+            checkpoint = Checkpoint(
+                seed, args.start_person_id or 0, args.n_person, criteria=criteria_file
+            )
+        else:
+            # reserve a block of person_ids (on a separate connection, because the
+            # reservation is committed immediately)
+            id_con = connect_db()
+            person_ids = IdAllocator(id_con).reserve("person", args.n_person)
+            id_con.close()
+            checkpoint = Checkpoint(
+                seed, person_ids.start, args.n_person, criteria=criteria_file
+            )
+    elif output_dir is None:
+        # remove the rows that are regenerated (when resuming, the rows of a partially
+        # written part, which exist if the tables were written over several connections)
+        cleanup_con = connect_db()
+        delete_persons(cleanup_con, checkpoint.remaining, checkpoint.tables)
+        cleanup_con.close()
+
+    if output_dir is not None:
+        # replace the files of the (re)generated tables, including those of a previous
+        # run that were written to the same directory
+        for table in checkpoint.tables or TABLE_NAMES:
+            shutil.rmtree(Path(output_dir) / table, ignore_errors=True)
+    else:
+        if checkpoint.visit_end_date is None:
+            checkpoint.visit_end_date = params.VISIT_END_DATE.isoformat()
+        checkpoint.save(args.checkpoint)
+
+    logging.info(f"Patient start ID for new patient data: {checkpoint.first_person_id}")
+
+    n_remaining = len(checkpoint.remaining)
+
+    STATS.reset()
+    last_progress = time.monotonic()
+
+    # create patients and write them to the database / files, committing (and updating
+    # the checkpoint) after each part of --commit-every patients
+    for person_ids, first_index in checkpoint.parts(args.commit_every):
+        for buffers in generate(
+            person_ids,
+            seed=seed,
+            workers=args.workers,
+            batch_size=args.batch_size,
+            first_index=first_index,
+            tables=checkpoint.tables,
+            criteria=criteria_plan,
+        ):
+            sink.write_buffers(buffers)
+
+            if time.monotonic() - last_progress >= args.progress_interval:
+                logging.info(STATS.progress_line(n_remaining))
+                last_progress = time.monotonic()
+
+        if output_dir is None:
+            sink.flush()
+            if con is not None:
+                con.commit()
+
+            checkpoint.n_committed += len(person_ids)
+            checkpoint.save(args.checkpoint)
+
+    sink.close()
+
+    if con is not None:
+        con.commit()
+        con.close()
+
+    if output_dir is None:
+        os.remove(args.checkpoint)
+
+    if criteria_plan is None:
+        # (the tables of a recommendation-driven run cannot be regenerated incrementally)
+        Manifest(
+            seed,
+            checkpoint.first_person_id,
+            checkpoint.n_person,
+            table_fingerprints(),
+            file_format=None if output_dir is None else file_format,
+            visit_end_date=params.VISIT_END_DATE.isoformat(),
+        ).save(manifest_file)
+
+    logging.info(STATS.progress_line(n_remaining))
+
+    if args.report is not None:
+        with open(args.report, "w") as f:
+            json.dump(STATS.report(), f, indent=2)
+        logging.info(f"Wrote report to {args.report}")
@@ -0,0 +1,134 @@
+import asyncio
+import sys
+import types
+from collections import Counter
+from typing import Any, Dict, List, Tuple
+
+import pytest
+
+from data_generator.instrumentation import Stats
+from data_generator.pipeline import generate
+from omop.async_sink import AsyncCopySink
+from omop.sink import MemorySink, copy_text
+
+
+class StandInConnection:
+    """
+    Stand-in for an asyncpg connection that records the data of each COPY
+    """
+
+    def __init__(self, copies: List[Tuple[str, Tuple[str, ...], str, bytes]]) -> None:
+        self.copies = copies
+
+    async def copy_to_table(
+        self, table: str, source: Any, columns: Any, format: str
+    ) -> None:
+        await asyncio.sleep(0)
+        self.copies.append((table, tuple(columns), format, source.read()))
+
+
+class StandInPool:
+    """
+    Stand-in for an asyncpg connection pool
+    """
+
+    def __init__(self, **settings: Any) -> None:
+        self.settings = settings
+        self.copies: List[Tuple[str, Tuple[str, ...], str, bytes]] = []
+        self.closed = False
+
+    def acquire(self) -> "StandInPool":
+        return self
+
+    async def __aenter__(self) -> StandInConnection:
+        return StandInConnection(self.copies)
+
+    async def __aexit__(self, *args: Any) -> None:
+        pass
+
+    async def close(self) -> None:
+        self.closed = True
+
+
+@pytest.fixture
+def pools(monkeypatch: pytest.MonkeyPatch) -> List[StandInPool]:
+    created: List[StandInPool] = []
+
+    async def create_pool(**settings: Any) -> StandInPool:
+        pool = StandInPool(**settings)
+        created.append(pool)
+        return pool
+
+    asyncpg = types.ModuleType("asyncpg")
+    asyncpg.create_pool = create_pool  # type: ignore[attr-defined]
+    monkeypatch.setitem(sys.modules, "asyncpg", asyncpg)
+    return created
+
+
+def generated_buffers(n_person: int) -> List[Dict[str, Any]]:
+    return list(generate(range(n_person), seed=1, batch_size=500))
+
+
+def test_writes_all_rows(pools: List[StandInPool]) -> None:
+    chunks = generated_buffers(5)
+    stats = Stats()
+
+    sink = AsyncCopySink(
+        {"host": "localhost", "dbname": "cdm"},
+        pool_size=2,
+        batch_size=500,
+        stats=stats,
+        copy_format="text",
+    )
+    for buffers in chunks:
+        sink.write_buffers(buffers)
+    sink.close()
+
+    expected = MemorySink()
+    for buffers in chunks:
+        expected.write_buffers(buffers)
+
+    (pool,) = pools
+    assert pool.closed
+    assert pool.settings["database"] == "cdm"
+    assert pool.settings["server_settings"] == {"search_path": "cds_cdm"}
+
+    written: Dict[str, Counter] = {}
+    for table, columns, copy_format, data in pool.copies:
+        assert copy_format == "text"
+        assert columns == expected.buffers[table].column_names
+        written.setdefault(table, Counter()).update(data.splitlines())
+
+    assert written == {
+        table: Counter(copy_text(buffer).splitlines())
+        for table, buffer in expected.buffers.items()
+    }
+    assert dict(stats.rows) == expected.row_counts()
+
+
+def test_writes_persons_first(pools: List[StandInPool]) -> None:
+    sink = AsyncCopySink({}, pool_size=4, batch_size=100)
+    for buffers in generated_buffers(3):
+        sink.write_buffers(buffers)
+    sink.close()
+
+    tables = [table for table, *_ in pools[0].copies]
+    assert tables.index("person") < min(
+        tables.index(table) for table in tables if table != "person"
+    )
+
+
+def test_raises_errors_of_copy(
+    pools: List[StandInPool], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    async def fail(*args: Any, **kwargs: Any) -> None:
+        raise RuntimeError("COPY failed")
+
+    monkeypatch.setattr(StandInConnection, "copy_to_table", fail)
+
+    sink = AsyncCopySink({}, batch_size=10**6)
+    for buffers in generated_buffers(1):
+        sink.write_buffers(buffers)
+    with pytest.raises(RuntimeError, match="COPY failed"):
+        sink.close()
+    assert pools[0].closed
@@ -0,0 +1,61 @@
+from decimal import Decimal
+from typing import List
+
+import numpy as np
+import pytest
+
+from omop.pgcopy import NUMERIC_NDIGITS, encode_numeric
+
+
+def decode_numeric(encoded: np.ndarray) -> List[Decimal]:
+    values = []
+    for value in encoded:
+        digits = int("".join(f"{digit:04d}" for digit in value["digits"]))
+        number = Decimal(digits).scaleb(
+            4 * (int(value["weight"]) - NUMERIC_NDIGITS + 1)
+        )
+        values.append(-number if value["sign"] else number)
+    return values
+
+
+@pytest.mark.parametrize(
+    "values",
+    [
+        np.random.default_rng(0).random(10000),
+        np.random.default_rng(1).normal(50, 20, 10000),
+        np.exp(np.random.default_rng(2).uniform(-740, 700, 1000)),
+        np.array(
+            [
+                5e-324,
+                1e-7,
+                0.001,
+                0.001 * (1 - 2**-52),
+                2.0**-30,
+                0.5,
+                36.6,
+                30.0,
+                1e14,
+                999999999999999.5,
+                1.7976931348623157e308,
+            ]
+        ),
+    ],
+)
+def test_numeric_equals_float8_cast(values: np.ndarray) -> None:
+    values = np.concatenate([values, -values])
+    encoded, missing = encode_numeric(values)
+
+    assert missing is None
+    assert decode_numeric(encoded) == [Decimal(f"{v:.15g}") for v in values]
+
+
+def test_numeric_display_scale() -> None:
+    encoded, missing = encode_numeric(np.array([36.6, 30.0, 0.0, np.nan]))
+
+    assert encoded["dscale"][:3].tolist() == [1, 1, 1]
+    assert missing is not None and missing.tolist() == [False, False, False, True]
+
+
+def test_numeric_rejects_infinity() -> None:
+    with pytest.raises(ValueError):
+        encode_numeric(np.array([1.0, np.inf]))
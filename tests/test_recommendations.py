@@ -0,0 +1,178 @@
+import io
+import tarfile
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, Iterator, List
+
+import pytest
+import requests
+
+from data_generator.recommendations import RecommendationCache, package_name
+
+VERSION = "v1.2.0"
+
+
+def write_tarball(path: Path, members: Dict[str, bytes]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with tarfile.open(path, "w:gz") as tar:
+        for name, data in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+
+class ReleaseHandler(SimpleHTTPRequestHandler):
+    """
+    Serves a directory with the layout of GitHub releases (and records the requests)
+    """
+
+    requests: List[str]
+
+    def do_HEAD(self) -> None:
+        self.requests.append(self.path)
+        if self.path == "/releases/latest":
+            self.send_response(302)
+            self.send_header("Location", f"/releases/tag/{VERSION}")
+            self.end_headers()
+        elif self.path.startswith("/releases/tag/"):
+            self.send_response(200)
+            self.end_headers()
+        else:
+            super().do_HEAD()
+
+    def do_GET(self) -> None:
+        self.requests.append(self.path)
+        super().do_GET()
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
+
+@pytest.fixture
+def server(tmp_path: Path) -> Iterator[Dict[str, Any]]:
+    root = tmp_path / "server"
+    download = root / "releases" / "download"
+    write_tarball(
+        download / VERSION / package_name(VERSION),
+        {
+            "package/package.json": b"{}",
+            "package/example/recommendation.json": b'{"resourceType": "Bundle"}',
+            "package/example/activity/heparin.json": b"{}",
+        },
+    )
+    write_tarball(
+        download / "v0.0.1" / package_name("v0.0.1"), {"package/package.json": b"{}"}
+    )
+
+    recorded: List[str] = []
+    handler = type("Handler", (ReleaseHandler,), {"requests": recorded})
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), partial(handler, directory=str(root)))
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield {
+            "base_url": f"http://127.0.0.1:{httpd.server_port}/releases",
+            "requests": recorded,
+        }
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def files(directory: Path) -> List[str]:
+    return sorted(str(p.relative_to(directory)) for p in directory.rglob("*.json"))
+
+
+def test_download_extracts_examples(server: Dict[str, Any], tmp_path: Path) -> None:
+    cache = RecommendationCache(tmp_path / "cache")
+
+    example_dir = cache.fetch(base_url=server["base_url"])
+
+    assert example_dir == cache.example_dir(VERSION)
+    assert files(cache.path / VERSION) == [
+        "package/example/activity/heparin.json",
+        "package/example/recommendation.json",
+    ]
+    assert cache.index()["latest"] == VERSION
+    assert cache.tarball(VERSION) is not None
+    assert [p for p in server["requests"] if "/download/" in p] == [
+        f"/releases/download/{VERSION}/{package_name(VERSION)}"
+    ]
+
+
+def test_cached_release_is_not_downloaded(
+    server: Dict[str, Any], tmp_path: Path
+) -> None:
+    cache = RecommendationCache(tmp_path / "cache")
+    cache.fetch(VERSION, base_url=server["base_url"])
+    server["requests"].clear()
+
+    assert cache.fetch(VERSION, base_url=server["base_url"]).exists()
+    assert server["requests"] == []
+
+    # only the tarball is cached: extracted again without downloading
+    cache.example_dir(VERSION).parent.parent.rename(tmp_path / "removed")
+    assert cache.fetch(VERSION, base_url=server["base_url"]).exists()
+    assert server["requests"] == []
+
+
+def test_offline(server: Dict[str, Any], tmp_path: Path) -> None:
+    cache = RecommendationCache(tmp_path / "cache")
+    with pytest.raises(FileNotFoundError):
+        cache.fetch(offline=True)
+
+    cache.fetch(VERSION, base_url=server["base_url"])
+    server["requests"].clear()
+
+    assert cache.fetch(offline=True) == cache.example_dir(VERSION)
+    with pytest.raises(FileNotFoundError):
+        cache.fetch("v9.9.9", offline=True)
+    assert server["requests"] == []
+
+
+def test_package_without_examples(server: Dict[str, Any], tmp_path: Path) -> None:
+    cache = RecommendationCache(tmp_path / "cache")
+
+    with pytest.raises(ValueError, match="package/example"):
+        cache.fetch("v0.0.1", base_url=server["base_url"])
+
+    assert not (cache.path / "v0.0.1").exists()
+    assert not (cache.path / "v0.0.1.extract").exists()
+
+
+def test_unsafe_member(tmp_path: Path) -> None:
+    cache = RecommendationCache(tmp_path / "cache")
+    tarball = tmp_path / "unsafe.tgz"
+    write_tarball(tarball, {"package/example/../../../evil.json": b"{}"})
+
+    with pytest.raises(ValueError, match="Unsafe path"):
+        cache.extract(VERSION, tarball)
+    assert not (tmp_path / "evil.json").exists()
+
+
+def test_failed_download_is_removed(server: Dict[str, Any], tmp_path: Path) -> None:
+    cache = RecommendationCache(tmp_path / "cache")
+
+    with pytest.raises(requests.HTTPError):
+        cache.download("v9.9.9", base_url=server["base_url"])
+
+    assert list((cache.path / "packages").iterdir()) == []
+    assert cache.tarball("v9.9.9") is None
+
+
+def test_interrupted_download_is_removed(
+    server: Dict[str, Any], tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    def interrupted(self: requests.Response, chunk_size: int) -> Iterator[bytes]:
+        yield b"partial"
+        raise requests.ConnectionError("connection lost")
+
+    monkeypatch.setattr(requests.Response, "iter_content", interrupted)
+    cache = RecommendationCache(tmp_path / "cache")
+
+    with pytest.raises(requests.ConnectionError):
+        cache.download(VERSION, base_url=server["base_url"])
+
+    assert list((cache.path / "packages").iterdir()) == []
@@ -0,0 +1,101 @@
+import os
+import subprocess  # nosec
+import sys
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+import pytest
+
+from data_generator.manifest import MANIFEST_FILE_NAME
+from data_generator.shards import SHARD_MANIFEST_FILE, ShardManifest, check_shards
+from omop.buffer import table_schema
+from omop.constants import TABLE_NAMES
+from omop.reader import file_batches
+
+ROOT = Path(__file__).parents[1]
+N_PERSON = 30
+N_SHARDS = 3
+
+
+def run_generator(*args: str, env: Dict[str, str]) -> None:
+    subprocess.run(  # nosec
+        [sys.executable, str(ROOT / "random_data_generator.py"), *args],
+        check=True,
+        cwd=ROOT,
+        env={**os.environ, **env},
+        capture_output=True,
+    )
+
+
+def read_tables(directory: Path) -> Dict[str, Dict[str, np.ndarray]]:
+    tables = {}
+    for table in TABLE_NAMES:
+        columns = [c.name for c in table_schema(table)]
+        batches: List[Dict[str, np.ndarray]] = list(
+            file_batches(directory, table, columns)
+        )
+        tables[table] = {
+            c: np.concatenate([batch[c] for batch in batches]) for c in columns
+        }
+    return tables
+
+
+@pytest.fixture(scope="module")
+def runs(tmp_path_factory: pytest.TempPathFactory) -> Dict[str, Path]:
+    sharded = tmp_path_factory.mktemp("sharded")
+    single = tmp_path_factory.mktemp("single")
+    common = ["--seed", "7", "--start-person-id", "1000"]
+
+    run_generator(
+        str(N_PERSON),
+        *common,
+        "--shards",
+        str(N_SHARDS),
+        "--output-dir",
+        str(sharded),
+        env={},
+    )
+    visit_end_date = ShardManifest.load(sharded / SHARD_MANIFEST_FILE).visit_end_date
+    assert visit_end_date is not None
+    env = {"OMOP_VISIT_END_DATE": visit_end_date}
+
+    # the shards are generated by separate processes (as on separate nodes)
+    for index in range(N_SHARDS):
+        run_generator("--shard", str(index), "--output-dir", str(sharded), env=env)
+
+    run_generator(str(N_PERSON), *common, "--output-dir", str(single), env=env)
+
+    return {"sharded": sharded, "single": single}
+
+
+def test_shards_are_complete(runs: Dict[str, Path]) -> None:
+    shard_manifest = ShardManifest.load(runs["sharded"] / SHARD_MANIFEST_FILE)
+
+    assert len(shard_manifest.shards) == N_SHARDS
+    assert shard_manifest.person_ids == range(1000, 1000 + N_PERSON)
+    check_shards(runs["sharded"], shard_manifest)
+
+
+def test_shards_equal_single_run(runs: Dict[str, Path]) -> None:
+    sharded = read_tables(runs["sharded"])
+    single = read_tables(runs["single"])
+
+    for table in TABLE_NAMES:
+        assert len(single[table]["person_id"]), table
+        for column, values in single[table].items():
+            np.testing.assert_array_equal(
+                sharded[table][column], values, err_msg=f"{table}.{column}"
+            )
+
+
+def test_incomplete_shard_is_rejected(runs: Dict[str, Path], tmp_path: Path) -> None:
+    shard_manifest = ShardManifest.load(runs["sharded"] / SHARD_MANIFEST_FILE)
+    for shard in shard_manifest.shards[:-1]:
+        (tmp_path / shard.directory).mkdir()
+        (tmp_path / shard.directory / MANIFEST_FILE_NAME).write_bytes(
+            (runs["sharded"] / shard.directory / MANIFEST_FILE_NAME).read_bytes()
+        )
+
+    with pytest.raises(ValueError, match="not complete"):
+        check_shards(tmp_path, shard_manifest)